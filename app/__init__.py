@@ -1,17 +1,15 @@
 from flask import Flask
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from flask_bcrypt import Bcrypt
 from flask_jwt_extended import JWTManager
 import os
-import psycopg2
 from dotenv import load_dotenv
+from sqlalchemy.engine import make_url
 
 # --- Load environment variables from .env ---
 load_dotenv()
 
 db = SQLAlchemy()
-bcrypt = Bcrypt()
 jwt = JWTManager()
 
 
@@ -24,7 +22,8 @@ def create_app():
     # --- Debugging Log ---
     print("🔍 Checking DATABASE_URL environment variable...")
     if db_url:
-        print(f"✅ DATABASE_URL found: {db_url}")
+        # Never log credentials
+        print(f"✅ DATABASE_URL found: {make_url(db_url).render_as_string(hide_password=True)}")
     else:
         print("❌ DATABASE_URL is missing! Flask will not start.")
         raise RuntimeError("DATABASE_URL not set in environment variables.")
@@ -34,26 +33,189 @@ def create_app():
         db_url = db_url.replace("postgres://", "postgresql://", 1)
         print("ℹ️ Converted old postgres:// to postgresql://")
 
-    # --- Test PostgreSQL connection before starting ---
-    try:
-        print("🧩 Testing database connection...")
-        conn = psycopg2.connect(db_url)
-        conn.close()
-        print("✅ PostgreSQL connection successful.")
-    except Exception as e:
-        print(f"❌ Failed to connect to PostgreSQL: {e}")
-        raise RuntimeError("Database connection failed. Check DATABASE_URL or Railway settings.")
+    # No connection is opened here: the pool connects lazily on first use, so boot
+    # stays fast and safe for gunicorn --preload. Connectivity is reported by
+    # /api/health/ready and schema creation lives in create_tables.py.
 
     # --- Flask Config ---
     app.config["SQLALCHEMY_DATABASE_URI"] = db_url
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    if not db_url.startswith("sqlite"):
+        # Per process; gunicorn.conf.py derives these from DB_MAX_CONNECTIONS and the
+        # worker count, so the defaults here only apply to a single process (run.py)
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+            "pool_size": int(os.getenv("DB_POOL_SIZE", 10)),
+            "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 20)),
+            "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", 10)),
+            "pool_recycle": 1800,
+            "pool_pre_ping": True,
+        }
     app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY", "supersecret")
 
+    # --- Password Hashing Config ---
+    app.config["PASSWORD_HASH_METHOD"] = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+    app.config["PASSWORD_HASH_WORKERS"] = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+    app.config["PASSWORD_HASH_TIMEOUT"] = float(os.getenv("PASSWORD_HASH_TIMEOUT", 10))
+
+    # --- User Cache Config ---
+    app.config["USER_CACHE_TTL"] = int(os.getenv("USER_CACHE_TTL", 300))
+    app.config["USER_CACHE_SIZE"] = int(os.getenv("USER_CACHE_SIZE", 10000))
+
+    # --- Diagnosis Cache Config ---
+    app.config["DIAGNOSIS_CACHE_ENABLED"] = os.getenv("DIAGNOSIS_CACHE_ENABLED", "1") == "1"
+    app.config["DIAGNOSIS_CACHE_TTL"] = int(os.getenv("DIAGNOSIS_CACHE_TTL", 7 * 24 * 3600))
+    app.config["DIAGNOSIS_CACHE_SIZE"] = int(os.getenv("DIAGNOSIS_CACHE_SIZE", 1024))
+    app.config["DIAGNOSIS_CACHE_PHASH_DISTANCE"] = int(os.getenv("DIAGNOSIS_CACHE_PHASH_DISTANCE", 4))
+
+    # --- Image Preprocessing Config ---
+    app.config["IMAGE_MAX_EDGE"] = int(os.getenv("IMAGE_MAX_EDGE", 1536))
+    app.config["IMAGE_OUTPUT_FORMAT"] = os.getenv("IMAGE_OUTPUT_FORMAT", "JPEG").upper()
+    app.config["IMAGE_QUALITY"] = int(os.getenv("IMAGE_QUALITY", 85))
+    app.config["IMAGE_MAX_UPLOAD_BYTES"] = int(os.getenv("IMAGE_MAX_UPLOAD_BYTES", 15 * 1024 * 1024))
+    app.config["IMAGE_MAX_PIXELS"] = int(os.getenv("IMAGE_MAX_PIXELS", 40_000_000))
+    # Werkzeug rejects larger request bodies with 413 before they are read
+    app.config["MAX_CONTENT_LENGTH"] = app.config["IMAGE_MAX_UPLOAD_BYTES"] + 64 * 1024
+
+    # --- Image Store Config ---
+    app.config["IMAGE_STORE_ENABLED"] = os.getenv("IMAGE_STORE_ENABLED", "1") == "1"
+    app.config["IMAGE_STORE_BACKEND"] = os.getenv("IMAGE_STORE_BACKEND", "local")
+    app.config["IMAGE_STORE_ROOT"] = os.getenv("IMAGE_STORE_ROOT", os.path.join(app.instance_path, "images"))
+    app.config["IMAGE_STORE_QUOTA_BYTES"] = int(os.getenv("IMAGE_STORE_QUOTA_BYTES", 5 * 1024 ** 3))
+    app.config["IMAGE_STORE_GC_TARGET"] = float(os.getenv("IMAGE_STORE_GC_TARGET", 0.9))
+    app.config["IMAGE_STORE_GC_INTERVAL"] = int(os.getenv("IMAGE_STORE_GC_INTERVAL", 300))
+    app.config["IMAGE_STORE_ORPHAN_GRACE"] = int(os.getenv("IMAGE_STORE_ORPHAN_GRACE", 3600))
+    app.config["IMAGE_THUMBNAIL_SIZE"] = int(os.getenv("IMAGE_THUMBNAIL_SIZE", 256))
+
+    # --- Batch Diagnosis Config ---
+    app.config["BATCH_WORKERS"] = int(os.getenv("BATCH_WORKERS", 4))
+    app.config["BATCH_MAX_IMAGES"] = int(os.getenv("BATCH_MAX_IMAGES", 50))
+    app.config["BATCH_MAX_UPLOAD_BYTES"] = int(os.getenv("BATCH_MAX_UPLOAD_BYTES", 200 * 1024 * 1024))
+    app.config["BATCH_POLL_INTERVAL"] = float(os.getenv("BATCH_POLL_INTERVAL", 1.0))
+    app.config["BATCH_STALE_AFTER"] = int(os.getenv("BATCH_STALE_AFTER", 300))
+    app.config["BATCH_MAX_ATTEMPTS"] = int(os.getenv("BATCH_MAX_ATTEMPTS", 3))
+    app.config["BATCH_MAX_WAIT"] = int(os.getenv("BATCH_MAX_WAIT", 30))
+
+    # --- Knowledge Base Config ---
+    app.config["KB_ENABLED"] = os.getenv("KB_ENABLED", "1") == "1"
+    app.config["KB_MIN_CONFIDENCE"] = float(os.getenv("KB_MIN_CONFIDENCE", 0.85))
+
+    # --- Gemini Gateway Config ---
+    app.config["GEMINI_API_KEY"] = os.getenv("GEMINI_API_KEY")
+    # "grpc" (SDK default) or "rest"
+    app.config["GEMINI_TRANSPORT"] = os.getenv("GEMINI_TRANSPORT") or None
+    app.config["GEMINI_TIMEOUT"] = float(os.getenv("GEMINI_TIMEOUT", 30))
+    app.config["GEMINI_MAX_RETRIES"] = int(os.getenv("GEMINI_MAX_RETRIES", 2))
+    app.config["GEMINI_RETRY_BASE_DELAY"] = float(os.getenv("GEMINI_RETRY_BASE_DELAY", 0.5))
+    app.config["GEMINI_BREAKER_THRESHOLD"] = int(os.getenv("GEMINI_BREAKER_THRESHOLD", 5))
+    app.config["GEMINI_BREAKER_RESET"] = float(os.getenv("GEMINI_BREAKER_RESET", 30))
+
+    # --- Model Routing Config ---
+    app.config["ROUTER_FAST_MODELS"] = os.getenv("ROUTER_FAST_MODELS", "gemini-2.0-flash-exp,gemini-1.5-flash")
+    app.config["ROUTER_STRONG_MODELS"] = os.getenv("ROUTER_STRONG_MODELS", "gemini-1.5-pro,gemini-2.0-flash-exp")
+    app.config["ROUTER_IMAGE_MODELS"] = os.getenv("ROUTER_IMAGE_MODELS", "gemini-1.5-flash,gemini-2.0-flash-exp")
+    app.config["ROUTER_FAST_P95_LIMIT"] = float(os.getenv("ROUTER_FAST_P95_LIMIT", 4.0))
+    app.config["ROUTER_STRONG_P95_LIMIT"] = float(os.getenv("ROUTER_STRONG_P95_LIMIT", 12.0))
+    app.config["ROUTER_IMAGE_P95_LIMIT"] = float(os.getenv("ROUTER_IMAGE_P95_LIMIT", 8.0))
+    app.config["ROUTER_MAX_ERROR_RATE"] = float(os.getenv("ROUTER_MAX_ERROR_RATE", 0.2))
+    app.config["ROUTER_MIN_SAMPLES"] = int(os.getenv("ROUTER_MIN_SAMPLES", 20))
+    app.config["ROUTER_PROBE_RATE"] = float(os.getenv("ROUTER_PROBE_RATE", 0.05))
+    app.config["ROUTER_WINDOW"] = float(os.getenv("ROUTER_WINDOW", 300))
+    app.config["ROUTER_LONG_QUERY_TOKENS"] = int(os.getenv("ROUTER_LONG_QUERY_TOKENS", 60))
+    # Off by default: a hedge is a second billed call, doubling quota use exactly when a model is slow
+    app.config["ROUTER_HEDGE_ENABLED"] = os.getenv("ROUTER_HEDGE_ENABLED", "0") == "1"
+    app.config["ROUTER_HEDGE_DELAY"] = float(os.getenv("ROUTER_HEDGE_DELAY", 5.0))
+    app.config["ROUTER_HEDGE_MIN_DELAY"] = float(os.getenv("ROUTER_HEDGE_MIN_DELAY", 1.0))
+    app.config["ROUTER_HEDGE_THREADS"] = int(os.getenv("ROUTER_HEDGE_THREADS", 32))
+
+    # --- Admission Control Config ---
+    app.config["ADMISSION_ENABLED"] = os.getenv("ADMISSION_ENABLED", "1") == "1"
+    # "local" (per worker) or "postgres" (shared by every worker and instance)
+    app.config["ADMISSION_BACKEND"] = os.getenv("ADMISSION_BACKEND", "local")
+    app.config["ADMISSION_USER_RATE_PER_MIN"] = float(os.getenv("ADMISSION_USER_RATE_PER_MIN", 30))
+    app.config["ADMISSION_USER_BURST"] = float(os.getenv("ADMISSION_USER_BURST", 10))
+    app.config["ADMISSION_GLOBAL_RATE_PER_MIN"] = float(os.getenv("ADMISSION_GLOBAL_RATE_PER_MIN", 1200))
+    app.config["ADMISSION_GLOBAL_BURST"] = float(os.getenv("ADMISSION_GLOBAL_BURST", 100))
+    # Workers splitting the global limit with the local backend (gunicorn.conf.py sets it to its worker count)
+    app.config["ADMISSION_LOCAL_PROCESSES"] = int(os.getenv("ADMISSION_LOCAL_PROCESSES", 1))
+    # Below the gthread thread count, so auth and health requests always find a thread
+    app.config["ADMISSION_MAX_CONCURRENT"] = int(os.getenv("ADMISSION_MAX_CONCURRENT", 24))
+    app.config["ADMISSION_QUEUE_TARGET"] = float(os.getenv("ADMISSION_QUEUE_TARGET", 2.0))
+    app.config["ADMISSION_MAX_QUEUE"] = int(os.getenv("ADMISSION_MAX_QUEUE", 64))
+
+    # --- History Log Config ---
+    app.config["HISTORY_WRITE_BEHIND"] = os.getenv("HISTORY_WRITE_BEHIND", "1") == "1"
+    app.config["HISTORY_FLUSH_SIZE"] = int(os.getenv("HISTORY_FLUSH_SIZE", 200))
+    app.config["HISTORY_FLUSH_INTERVAL"] = float(os.getenv("HISTORY_FLUSH_INTERVAL", 1.0))
+    app.config["HISTORY_MAX_BUFFER"] = int(os.getenv("HISTORY_MAX_BUFFER", 10000))
+    app.config["HISTORY_MAX_PAGE_SIZE"] = int(os.getenv("HISTORY_MAX_PAGE_SIZE", 100))
+
+    # --- Conversation Context Config ---
+    app.config["CHAT_CONTEXT_TOKENS"] = int(os.getenv("CHAT_CONTEXT_TOKENS", 2000))
+    app.config["CHAT_SUMMARY_TOKENS"] = int(os.getenv("CHAT_SUMMARY_TOKENS", 300))
+    app.config["CHAT_SUMMARY_MODEL"] = os.getenv("CHAT_SUMMARY_MODEL", "gemini-2.0-flash-exp")
+    app.config["CHAT_CONTEXT_MAX_TURNS"] = int(os.getenv("CHAT_CONTEXT_MAX_TURNS", 50))
+    # Seconds a cached conversation is trusted before re-checking its row for other workers' turns
+    app.config["CHAT_CONTEXT_RECHECK"] = float(os.getenv("CHAT_CONTEXT_RECHECK", 5))
+    app.config["CHAT_CONTEXT_CACHE_SIZE"] = int(os.getenv("CHAT_CONTEXT_CACHE_SIZE", 5000))
+    app.config["CHAT_CONTEXT_CACHE_TTL"] = int(os.getenv("CHAT_CONTEXT_CACHE_TTL", 3600))
+
+    # --- Metrics Config ---
+    app.config["METRICS_ENABLED"] = os.getenv("METRICS_ENABLED", "1") == "1"
+    # Shared directory where gunicorn workers publish snapshots, so one scrape covers them all
+    app.config["METRICS_DIR"] = os.getenv("METRICS_DIR") or None
+    app.config["METRICS_FLUSH_INTERVAL"] = float(os.getenv("METRICS_FLUSH_INTERVAL", 5.0))
+    app.config["METRICS_TOKEN"] = os.getenv("METRICS_TOKEN") or None
+    # Per-request sampling profiler, triggered by an X-Profile: <token> header; off without a token
+    app.config["PROFILE_TOKEN"] = os.getenv("PROFILE_TOKEN") or None
+    app.config["PROFILE_INTERVAL"] = float(os.getenv("PROFILE_INTERVAL", 0.005))
+    app.config["PROFILE_DIR"] = os.getenv("PROFILE_DIR") or None
+    app.config["PROFILE_MAX_CONCURRENT"] = int(os.getenv("PROFILE_MAX_CONCURRENT", 2))
+
     # --- Initialize Extensions ---
     db.init_app(app)
-    bcrypt.init_app(app)
     jwt.init_app(app)
 
+    # First: before_request hooks run in registration order and teardown hooks in
+    # reverse, so the profiler samples everything the other hooks do as well
+    from app.services.profiler import profiler
+    profiler.init_app(app)
+
+    from app.services.metrics import metrics
+    metrics.init_app(app)
+
+    from app.services.password_service import password_hasher
+    password_hasher.init_app(app)
+
+    from app.services.user_service import user_cache
+    user_cache.init_app(app, jwt)
+
+    from app.services.history_log import history_log
+    history_log.init_app(app)
+
+    from app.services.diagnosis_cache import diagnosis_cache
+    diagnosis_cache.init_app(app)
+
+    from app.services.image_store import image_store
+    image_store.init_app(app)
+
+    from app.services.gemini_gateway import gemini_gateway
+    gemini_gateway.init_app(app)
+
+    from app.services.model_router import model_router
+    model_router.init_app(app)
+
+    from app.services.knowledge_base import knowledge_base
+    knowledge_base.init_app(app)
+
+    from app.services.conversation_context import conversation_context
+    conversation_context.init_app(app)
+
+    from app.services.batch_queue import batch_queue
+    batch_queue.init_app(app)
+
+    from app.services.admission_control import admission_control
+    admission_control.init_app(app)
+
     # --- CORS Configuration (FIXED) ---
     CORS(app, 
          resources={r"/api/*": {
@@ -68,21 +230,39 @@ def create_app():
              "supports_credentials": True
          }})
 
+    # --- Register Models (so create_all sees every table) ---
+    from app.models import (  # noqa: F401
+        user_model,
+        uploaded_image_model,
+        ai_diagnosis_model,
+        chat_log_model,
+        conversation_model,
+        diagnosis_job_model,
+        disease_info_model,
+        rate_limit_model,
+    )
+
     # --- Register Blueprints ---
     from app.routes.auth_routes import auth_bp
     from app.routes.ai_routes import ai_bp
+    from app.routes.history_routes import history_bp
+    from app.routes.image_routes import image_bp
     app.register_blueprint(auth_bp, url_prefix="/api/auth")
     app.register_blueprint(ai_bp, url_prefix="/api/ai")
+    app.register_blueprint(history_bp, url_prefix="/api/history")
+    app.register_blueprint(image_bp, url_prefix="/api/images")
+
+    from app.routes.health_routes import health_bp
+    app.register_blueprint(health_bp, url_prefix="/api/health")
 
-    # --- Health Check Route ---
-    @app.route("/api/health")
-    def health():
-        return {"status": "ok"}, 200
+    from app.routes.metrics_routes import metrics_bp
+    app.register_blueprint(metrics_bp, url_prefix="/api/metrics")
 
-    # --- Create Tables ---
-    with app.app_context():
-        db.create_all()
-        print("🗂️ All tables created or already exist.")
+    # --- Create Tables (opt-in; production runs `python create_tables.py` once per deploy) ---
+    if os.getenv("DB_CREATE_ALL_ON_STARTUP", "0") == "1":
+        with app.app_context():
+            db.create_all()
+            print("🗂️ All tables created or already exist.")
 
     print("🚀 Flask app initialized successfully and ready to serve.")
     return app
\ No newline at end of file
@@ -0,0 +1,47 @@
+from datetime import datetime, timezone
+
+from app import db
+
+
+def _utcnow():
+    # Naive UTC so cache TTL cutoffs compare the same way on every backend
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class AIDiagnosis(db.Model):
+    __tablename__ = 'ai_diagnoses'
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    # ✅ Content address of the normalized image bytes (SHA-256 hex)
+    image_hash = db.Column(db.String(64), nullable=False, index=True)
+    # Optional 64-bit perceptual hash (hex) used for near-duplicate matching
+    phash = db.Column(db.String(16), index=True)
+
+    model_name = db.Column(db.String(64))
+    result = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=_utcnow, nullable=False)
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    image_id = db.Column(db.Integer, db.ForeignKey('uploaded_images.id'), unique=True)
+
+    # Relationship
+    image = db.relationship('UploadedImage', back_populates='diagnosis')
+
+    # Per-user history, newest first; id breaks timestamp ties
+    __table_args__ = (
+        db.Index('ix_ai_diagnoses_user_created', 'user_id', 'created_at', 'id'),
+    )
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "image_hash": self.image_hash,
+            "model": self.model_name,
+            "response": self.result,
+            "image_id": self.image_id,
+            "created_at": self.created_at.isoformat() + "Z",
+        }
+
+    def __repr__(self):
+        return f"<AIDiagnosis {self.image_hash[:12]}>"
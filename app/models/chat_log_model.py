@@ -0,0 +1,44 @@
+from app import db
+from app.models.ai_diagnosis_model import _utcnow
+
+
+class ChatLog(db.Model):
+    __tablename__ = 'chat_logs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+
+    # "text_chat" or "image_analysis"
+    type = db.Column(db.String(20), nullable=False)
+    message = db.Column(db.Text)
+    response = db.Column(db.Text, nullable=False)
+
+    # Who answered: "gemini", "knowledge_base" or "cache"
+    source = db.Column(db.String(20), nullable=False)
+    model_name = db.Column(db.String(64))
+    image_hash = db.Column(db.String(64))
+    conversation_id = db.Column(db.String(32))
+
+    created_at = db.Column(db.DateTime, default=_utcnow, nullable=False)
+
+    # History is always read as "this user's newest first"; id breaks timestamp ties
+    __table_args__ = (
+        db.Index('ix_chat_logs_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('ix_chat_logs_conversation_created', 'conversation_id', 'created_at', 'id'),
+    )
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "type": self.type,
+            "message": self.message,
+            "response": self.response,
+            "source": self.source,
+            "model": self.model_name,
+            "image_hash": self.image_hash,
+            "conversation_id": self.conversation_id,
+            "created_at": self.created_at.isoformat() + "Z",
+        }
+
+    def __repr__(self):
+        return f"<ChatLog {self.id} user={self.user_id}>"
@@ -0,0 +1,26 @@
+from app import db
+from app.models.ai_diagnosis_model import _utcnow
+
+
+class Conversation(db.Model):
+    __tablename__ = 'conversations'
+
+    # Opaque id handed back to the client with every chat reply
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+
+    # Rolling summary of the oldest turns, and how many turns it covers
+    summary = db.Column(db.Text)
+    summarized_turns = db.Column(db.Integer, nullable=False, default=0)
+    # Position of the last summarized chat_logs row, so later turns are read with a keyset
+    # filter; the id is unknown (NULL) when that turn hadn't been flushed yet
+    summarized_until = db.Column(db.DateTime)
+    summarized_until_id = db.Column(db.Integer)
+    # Turns recorded by any worker; a cached copy with fewer is stale
+    turn_count = db.Column(db.Integer, nullable=False, default=0)
+
+    created_at = db.Column(db.DateTime, default=_utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=_utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<Conversation {self.id} user={self.user_id}>"
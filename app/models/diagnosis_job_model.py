@@ -0,0 +1,73 @@
+import uuid
+
+from app import db
+from app.models.ai_diagnosis_model import _utcnow
+
+
+class DiagnosisJob(db.Model):
+    __tablename__ = 'diagnosis_jobs'
+
+    # Opaque id handed back to the client for polling
+    id = db.Column(db.String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+
+    status = db.Column(db.String(16), nullable=False, default='queued')
+    total = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+
+    created_at = db.Column(db.DateTime, default=_utcnow, nullable=False)
+    finished_at = db.Column(db.DateTime)
+
+    # Relationship
+    items = db.relationship(
+        'DiagnosisJobItem',
+        back_populates='job',
+        order_by='DiagnosisJobItem.position',
+        cascade='all, delete-orphan',
+    )
+
+    @property
+    def is_finished(self):
+        return self.completed + self.failed >= self.total
+
+    def __repr__(self):
+        return f"<DiagnosisJob {self.id} {self.status}>"
+
+
+class DiagnosisJobItem(db.Model):
+    __tablename__ = 'diagnosis_job_items'
+    __table_args__ = (
+        # Workers claim the oldest queued item first
+        db.Index('ix_diagnosis_job_items_status_id', 'status', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(32), db.ForeignKey('diagnosis_jobs.id'), nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False)
+    filename = db.Column(db.String(255))
+
+    # queued → running → done | failed
+    status = db.Column(db.String(16), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+
+    # Normalized image bytes; cleared once the item is processed
+    image_data = db.deferred(db.Column(db.LargeBinary))
+    mime_type = db.Column(db.String(32))
+    image_hash = db.Column(db.String(64))
+    phash = db.Column(db.String(16))
+
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    cached = db.Column(db.Boolean, nullable=False, default=False)
+
+    claimed_at = db.Column(db.DateTime)
+    # A requeued item isn't claimed again before this (upstream backoff)
+    not_before = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    # Relationship
+    job = db.relationship('DiagnosisJob', back_populates='items')
+
+    def __repr__(self):
+        return f"<DiagnosisJobItem {self.job_id}#{self.position} {self.status}>"
@@ -0,0 +1,31 @@
+from app import db
+
+
+class DiseaseInfo(db.Model):
+    __tablename__ = 'disease_info'
+    __table_args__ = (
+        db.UniqueConstraint('crop', 'disease', name='uq_disease_info_crop_disease'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    crop = db.Column(db.String(64), nullable=False, index=True)
+    disease = db.Column(db.String(128), nullable=False)
+    # Comma-separated alternative names (local names, abbreviations, pathogen)
+    aliases = db.Column(db.Text)
+    symptoms = db.Column(db.Text, nullable=False)
+    treatment = db.Column(db.Text, nullable=False)
+    prevention = db.Column(db.Text)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "crop": self.crop,
+            "disease": self.disease,
+            "aliases": self.aliases,
+            "symptoms": self.symptoms,
+            "treatment": self.treatment,
+            "prevention": self.prevention,
+        }
+
+    def __repr__(self):
+        return f"<DiseaseInfo {self.crop}: {self.disease}>"
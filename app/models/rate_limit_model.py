@@ -0,0 +1,15 @@
+from app import db
+
+
+class RateLimitBucket(db.Model):
+    """Shared token bucket state (ADMISSION_BACKEND=postgres); updated with one atomic upsert."""
+    __tablename__ = 'rate_limit_buckets'
+
+    # "user:<id>", "ip:<addr>" or "global"
+    key = db.Column(db.String(128), primary_key=True)
+    tokens = db.Column(db.Float, nullable=False)
+    # Epoch seconds from the database clock, so instances never disagree about refill time
+    updated_at = db.Column(db.Float, nullable=False)
+
+    def __repr__(self):
+        return f"<RateLimitBucket {self.key} {self.tokens:.1f}>"
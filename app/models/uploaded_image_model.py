@@ -5,9 +5,15 @@ class UploadedImage(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
+    # Backend locator of the stored bytes, e.g. "local:ab/cd/<sha256>"
     filepath = db.Column(db.String(255), nullable=False)
     upload_time = db.Column(db.DateTime, server_default=db.func.now())
 
+    # ✅ Content address (SHA-256 hex); identical uploads share one stored file
+    content_hash = db.Column(db.String(64), index=True)
+    size_bytes = db.Column(db.Integer)
+    mime_type = db.Column(db.String(32))
+
     # ✅ Foreign key to users.id
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
 
@@ -15,5 +21,17 @@ class UploadedImage(db.Model):
     user = db.relationship('User', back_populates='images')
     diagnosis = db.relationship('AIDiagnosis', back_populates='image', uselist=False)
 
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "content_hash": self.content_hash,
+            "size_bytes": self.size_bytes,
+            "mime_type": self.mime_type,
+            "upload_time": self.upload_time.isoformat() + "Z" if self.upload_time else None,
+            "url": f"/api/images/{self.id}",
+            "thumbnail_url": f"/api/images/{self.id}/thumbnail",
+        }
+
     def __repr__(self):
         return f"<UploadedImage {self.filename}>"
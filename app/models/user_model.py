@@ -1,5 +1,5 @@
 from app import db
-from werkzeug.security import generate_password_hash, check_password_hash
+from app.services.password_service import password_hasher
 
 class User(db.Model):
     __tablename__ = 'users'  # 👈 properly indented
@@ -9,10 +9,20 @@ class User(db.Model):
     email = db.Column(db.String(100), unique=True, nullable=False)
     password_hash = db.Column(db.Text)
 
+    # Relationship
+    images = db.relationship('UploadedImage', back_populates='user')
+
     def set_password(self, password):
         """Hashes and stores the user's password."""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
         """Verifies a password against the stored hash."""
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+
+    def rehash_password_if_needed(self, password):
+        """Upgrade the stored hash to the configured algorithm/cost. Returns True if changed."""
+        if not password_hasher.needs_rehash(self.password_hash):
+            return False
+        self.set_password(password)
+        return True
@@ -1,24 +1,169 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-import google.generativeai as genai
-import os
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
+from flask_jwt_extended import jwt_required, current_user
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
+import json
+import time
+
+from app import db
+from app.services.ai_service import (
+    chat_prompt,
+    generate_ai_response,
+    image_contents,
+    lookup_diagnosis,
+    release_db_connection,
+    remember_diagnosis,
+)
+from app.models.diagnosis_job_model import DiagnosisJob
+from app.services.admission_control import admission_control
+from app.services.batch_queue import batch_queue
+from app.services.conversation_context import conversation_context
+from app.services.diagnosis_cache import diagnosis_cache, image_digest, cache_bypass_requested
+from app.services.image_preprocessor import preprocess_upload, ImageRejected
+from app.services.image_store import image_store
+from app.services.gemini_gateway import gemini_gateway, GatewayError
+from app.services.history_log import history_log
+from app.services.model_router import IMAGE, classify, model_router
 
 ai_bp = Blueprint("ai_bp", __name__)
+admission_control.protect(ai_bp)
+
+
+# -------------------------
+# 🔧 Helpers
+# -------------------------
+def _wants_stream():
+    """Streaming is opt-in via ?stream=1 or Accept: text/event-stream."""
+    if request.args.get("stream", "").lower() in ("1", "true", "yes"):
+        return True
+    return "text/event-stream" in request.headers.get("Accept", "")
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _sse_response(events):
+    return Response(
+        stream_with_context(events),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # disable proxy buffering (nginx)
+        },
+    )
+
+
+def _conversation(conversation_id):
+    """The caller's conversation, or a new one when no (well-formed) id is given."""
+    if not conversation_id or len(conversation_id) != 32 or not all(c in "0123456789abcdef" for c in conversation_id):
+        conversation_id = conversation_context.new_id()
+    return conversation_context.get(current_user.id, conversation_id)
+
+
+def _log_turn(conversation, response_type, message, response, source, **fields):
+    """Persist a chat turn (write-behind) and add it to the conversation context."""
+    created_at = history_log.log_chat(conversation.user_id, response_type, response, source, message=message,
+                                      conversation_id=conversation.conversation_id, **fields)
+    conversation_context.record(conversation, message or "[sent a photo]", response, created_at)
+
+
+def _store_upload(filename, prepared):
+    """Keep the upload in the image store; storage problems never block a diagnosis."""
+    try:
+        return image_store.save_upload(current_user.id, filename, prepared)
+    except Exception as e:
+        db.session.rollback()
+        print(f"⚠️ Could not store upload: {e}")
+        return None
+
+
+def _gateway_error(e):
+    resp = jsonify({"error": str(e)})
+    if e.retry_after:
+        resp.headers["Retry-After"] = str(e.retry_after)
+    return resp, e.status_code
+
+
+def _stream_generation(model_name, contents, response_type, on_complete=None, headers=None):
+    """
+    Forward Gemini chunks to the client as server-sent events.
+
+    Emits ``start``, one ``chunk`` per non-empty piece of text, and a final
+    ``done`` carrying the full text plus timing; ``error`` replaces ``done``
+    if generation fails. If the client disconnects mid-stream the WSGI server
+    closes this generator, which closes the gateway stream and cancels the
+    upstream call.
+    """
+    started = time.perf_counter()
+
+    def events():
+        first_chunk_ms = None
+        parts = []
+        chunks = model_router.stream(model_name, contents)
+        try:
+            yield _sse("start", {"type": response_type, "model": model_name})
+
+            for text in chunks:
+                if first_chunk_ms is None:
+                    first_chunk_ms = round((time.perf_counter() - started) * 1000, 1)
+                parts.append(text)
+                yield _sse("chunk", {"text": text})
+
+            full_text = "".join(parts)
+            if full_text and on_complete:
+                on_complete(full_text)
+
+            yield _sse("done", {
+                "type": response_type,
+                "response": full_text or "I couldn't generate a response. Please try again.",
+                "model": model_name,
+                "chunks": len(parts),
+                "time_to_first_chunk_ms": first_chunk_ms,
+                "total_ms": round((time.perf_counter() - started) * 1000, 1),
+            })
+        except Exception as e:
+            print(f"❌ AI Stream Error: {str(e)}")
+            yield _sse("error", {"error": str(e)})
+        finally:
+            chunks.close()
+
+    release_db_connection()
+    resp = _sse_response(events())
+    for key, value in (headers or {}).items():
+        resp.headers[key] = value
+    return resp
+
+
+def _stream_cached(response_type, text, headers=None):
+    """Single-shot SSE reply for answers that don't need the model."""
+    def events():
+        yield _sse("start", {"type": response_type})
+        yield _sse("done", {"type": response_type, "response": text, "cached": True, "total_ms": 0})
+
+    resp = _sse_response(events())
+    for key, value in (headers or {}).items():
+        resp.headers[key] = value
+    return resp
+
+
+@ai_bp.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    # The limit this request ran under (batch uploads raise it per request)
+    limit = (request.max_content_length or 0) // 1024
+    return jsonify({"error": f"Upload too large (max {limit} KB)"}), 413
 
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
 @ai_bp.route('/chat', methods=['POST', 'OPTIONS'])
 @jwt_required()
 def chat():
     """Unified AI endpoint for text and image input using Gemini"""
-    
+
     # --- Handle CORS preflight ---
     if request.method == 'OPTIONS':
         return '', 200
 
     try:
-        current_user_id = get_jwt_identity()
-        print(f"✅ Authenticated user: {current_user_id}")
+        stream = _wants_stream()
 
         # --- Handle text or image ---
         if request.content_type.startswith('multipart/form-data'):
@@ -27,29 +172,73 @@ def chat():
             if not file:
                 return jsonify({"error": "No image file provided"}), 400
 
-            # Save temporarily
-            filepath = f"/tmp/{file.filename}"
-            file.save(filepath)
+            # Normalize in memory: sniff format, fix orientation, strip EXIF, downscale
+            try:
+                prepared = preprocess_upload(file)
+            except ImageRejected as e:
+                return jsonify({"error": str(e)}), e.status_code
+
+            # --- Diagnosis cache (content-addressed on the normalized bytes) ---
+            image_hash = image_digest(prepared.data)
+            phash = prepared.phash
+            user_id = current_user.id
+            image_id = _store_upload(file.filename, prepared)
+            image_fields = {"image_id": image_id, "image_url": f"/api/images/{image_id}" if image_id else None}
+            conversation = _conversation(request.form.get('conversation_id'))
+
+            cached, cache_status = lookup_diagnosis(
+                image_hash, phash, bypass=cache_bypass_requested(request.headers)
+            )
+            cache_headers = {
+                "X-Diagnosis-Cache": cache_status,
+                "X-Conversation-Id": conversation.conversation_id,
+            }
+
+            if cached:
+                _log_turn(conversation, "image_analysis", None, cached.result, "cache",
+                          model_name=cached.model_name, image_hash=image_hash)
+                if stream:
+                    return _stream_cached("image_analysis", cached.result, cache_headers)
+                resp = jsonify({
+                    "type": "image_analysis",
+                    "response": cached.result,
+                    "cached": True,
+                    "conversation_id": conversation.conversation_id,
+                    **image_fields
+                })
+                resp.headers.update(cache_headers)
+                return resp, 200
 
-            print(f"🖼️ Received image: {file.filename}")
+            def remember(diagnosis_text, model_name):
+                remember_diagnosis(image_hash, diagnosis_text, model_name,
+                                   phash=phash, user_id=user_id, image_id=image_id)
+                _log_turn(conversation, "image_analysis", None, diagnosis_text, "gemini",
+                          model_name=model_name, image_hash=image_hash)
 
-            # Use Gemini vision model
-            model = genai.GenerativeModel("gemini-1.5-flash")
-            response = model.generate_content([
-                "You are AgroAI, an expert crop health assistant. Analyze this image of a plant leaf and detect if it has any disease. Include disease name, confidence level, and farming recommendations.",
-                {"mime_type": "image/jpeg", "data": open(filepath, "rb").read()}
-            ])
+            contents = image_contents(prepared.mime_type, prepared.data)
+            if stream:
+                model_name = model_router.pick(IMAGE)
+                return _stream_generation(model_name, contents, "image_analysis",
+                                          on_complete=lambda text: remember(text, model_name),
+                                          headers=cache_headers)
 
-            diagnosis_text = getattr(response, "text", None)
-            if not diagnosis_text and hasattr(response, "candidates"):
-                diagnosis_text = response.candidates[0].content.parts[0].text
+            # Use a Gemini vision model (routed by current latency/health)
+            release_db_connection()
+            diagnosis_text, model_name = model_router.generate(IMAGE, contents)
+            if diagnosis_text:
+                remember(diagnosis_text, model_name)
             diagnosis_text = diagnosis_text or "No diagnosis available."
+            cache_headers["X-Model"] = model_name
 
-            print(f"🧠 AI Diagnosis: {diagnosis_text[:120]}...")
-            return jsonify({
+            resp = jsonify({
                 "type": "image_analysis",
-                "response": diagnosis_text
-            }), 200
+                "response": diagnosis_text,
+                "cached": False,
+                "conversation_id": conversation.conversation_id,
+                **image_fields
+            })
+            resp.headers.update(cache_headers)
+            return resp, 200
 
         else:
             # Handle normal chat messages
@@ -58,29 +247,181 @@ def chat():
             if not query:
                 return jsonify({"error": "No message provided"}), 400
 
-            print(f"💬 Text message: {query}")
+            conversation = _conversation(data.get('conversation_id'))
+            conversation_headers = {"X-Conversation-Id": conversation.conversation_id}
 
-            model = genai.GenerativeModel("gemini-2.0-flash-exp")
-            prompt = f"""
-You are AgroAI, an expert agricultural assistant specializing in crop health and farming advice.
+            # --- Answer common disease questions locally ---
+            local_answer = generate_ai_response(query)
+            if local_answer:
+                _log_turn(conversation, "text_chat", query, local_answer, "knowledge_base")
+                headers = {"X-Answer-Source": "knowledge_base", **conversation_headers}
+                if stream:
+                    return _stream_cached("text_chat", local_answer, headers)
+                resp = jsonify({
+                    "type": "text_chat",
+                    "response": local_answer,
+                    "source": "knowledge_base",
+                    "conversation_id": conversation.conversation_id
+                })
+                resp.headers.update(headers)
+                return resp, 200
 
-User: {query}
+            # --- Follow-ups: rolling summary + the recent turns that fit the token budget ---
+            summary, recent_turns = conversation_context.window(conversation, query)
+            prompt = chat_prompt(query, summary, recent_turns)
 
-Provide a helpful, practical, and accurate farming response.
-"""
-            response = model.generate_content(prompt)
+            # --- Route: cheap questions to the fast tier, diagnostic ones to the strong tier ---
+            kind = classify(query, context_tokens=sum(turn.tokens for turn in recent_turns),
+                            long_query_tokens=model_router.long_query_tokens)
 
-            response_text = getattr(response, "text", None)
-            if not response_text and hasattr(response, "candidates"):
-                response_text = response.candidates[0].content.parts[0].text
+            def remember(response_text, model_name):
+                _log_turn(conversation, "text_chat", query, response_text, "gemini", model_name=model_name)
+
+            if stream:
+                model_name = model_router.pick(kind)
+                return _stream_generation(model_name, prompt, "text_chat",
+                                          on_complete=lambda text: remember(text, model_name),
+                                          headers=conversation_headers)
+
+            release_db_connection()
+            response_text, model_name = model_router.generate(kind, prompt)
+            if response_text:
+                remember(response_text, model_name)
             response_text = response_text or "I couldn't generate a response. Please try again."
+            conversation_headers["X-Model"] = model_name
 
-            print(f"🤖 AI Response: {response_text[:100]}...")
-            return jsonify({
+            resp = jsonify({
                 "type": "text_chat",
-                "response": response_text
-            }), 200
+                "response": response_text,
+                "conversation_id": conversation.conversation_id
+            })
+            resp.headers.update(conversation_headers)
+            return resp, 200
+
+    except HTTPException:
+        raise
+
+    except GatewayError as e:
+        print(f"❌ AI Gateway Error: {str(e)}")
+        return _gateway_error(e)
 
     except Exception as e:
         print(f"❌ AI Route Error: {str(e)}")
         return jsonify({"error": str(e)}), 500
+
+
+# -------------------------
+# 📦 Batch Diagnosis
+# -------------------------
+def _job_payload(job):
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "total": job.total,
+        "completed": job.completed,
+        "failed": job.failed,
+        "created_at": job.created_at.isoformat() + "Z",
+        "finished_at": job.finished_at.isoformat() + "Z" if job.finished_at else None,
+        "items": [
+            {
+                "position": item.position,
+                "filename": item.filename,
+                "status": item.status,
+                "response": item.result,
+                "cached": item.cached,
+                "error": item.error if item.status == "failed" else None,
+            }
+            for item in job.items
+        ],
+    }
+
+
+@ai_bp.route('/diagnose/batch', methods=['POST'])
+@jwt_required()
+def diagnose_batch():
+    """Queue many leaf images for diagnosis; returns a job id immediately"""
+    # Batches are allowed a larger body than single uploads
+    request.max_content_length = current_app.config["BATCH_MAX_UPLOAD_BYTES"]
+
+    files = request.files.getlist('images') or request.files.getlist('image')
+    if not files:
+        return jsonify({"error": "No image files provided"}), 400
+
+    max_images = current_app.config["BATCH_MAX_IMAGES"]
+    if len(files) > max_images:
+        return jsonify({"error": f"Too many images (max {max_images} per batch)"}), 400
+
+    # Admission took one token for the request; each further image costs one more
+    rejection = admission_control.charge(len(files) - 1)
+    if rejection:
+        return rejection
+
+    images, rejected = [], []
+    for file in files:
+        try:
+            images.append((file.filename, preprocess_upload(file)))
+        except ImageRejected as e:
+            rejected.append((file.filename, str(e)))
+
+    job = batch_queue.enqueue(current_user.id, images, rejected)
+    print(f"📦 Queued batch {job.id}: {len(images)} images, {len(rejected)} rejected")
+
+    resp = jsonify({
+        "job_id": job.id,
+        "status": job.status,
+        "total": job.total,
+        "status_url": f"/api/ai/diagnose/batch/{job.id}",
+    })
+    resp.headers["Location"] = f"/api/ai/diagnose/batch/{job.id}"
+    return resp, 202
+
+
+@ai_bp.route('/diagnose/batch/<job_id>', methods=['GET'])
+@jwt_required()
+def diagnose_batch_status(job_id):
+    """Job status and results; ?wait=N long-polls up to N seconds for completion"""
+    wait = min(request.args.get("wait", 0, type=float), current_app.config["BATCH_MAX_WAIT"])
+    deadline = time.monotonic() + wait
+    known_done = request.args.get("since", -1, type=int)
+
+    while True:
+        job = db.session.get(DiagnosisJob, job_id)
+        if job is None or job.user_id != current_user.id:
+            return jsonify({"error": "Job not found"}), 404
+
+        remaining = deadline - time.monotonic()
+        progressed = job.completed + job.failed > known_done >= 0
+        if job.is_finished or progressed or remaining <= 0:
+            return jsonify(_job_payload(job)), 200
+
+        # End the read transaction so the next poll sees other workers' commits
+        db.session.rollback()
+        batch_queue.wait_for_progress(min(remaining, batch_queue.poll_interval))
+
+
+@ai_bp.route('/cache/stats', methods=['GET'])
+@jwt_required()
+def cache_stats():
+    """Hit/miss counters for the image diagnosis cache"""
+    return jsonify(diagnosis_cache.stats()), 200
+
+
+@ai_bp.route('/router/stats', methods=['GET'])
+@jwt_required()
+def router_stats():
+    """Per-model rolling p50/p95 and error rates, routing, fallback and hedge counters"""
+    return jsonify(model_router.stats()), 200
+
+
+@ai_bp.route('/admission/stats', methods=['GET'])
+@jwt_required()
+def admission_stats():
+    """Admitted, throttled (429) and shed (503) request counters, plus current in-flight/queued"""
+    return jsonify(admission_control.stats()), 200
+
+
+@ai_bp.route('/gateway/stats', methods=['GET'])
+@jwt_required()
+def gateway_stats():
+    """Upstream call, coalescing, retry and circuit breaker counters"""
+    return jsonify(gemini_gateway.stats()), 200
@@ -1,11 +1,22 @@
 from flask import Blueprint, request, jsonify
 from app import db
 from app.models.user_model import User
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from app.services.password_service import HasherBusy
+from app.services.user_service import user_cache
+from flask_jwt_extended import create_access_token, jwt_required, current_user
 
 # Create a Blueprint for authentication routes
 auth_bp = Blueprint('auth_bp', __name__)
 
+
+@auth_bp.errorhandler(HasherBusy)
+def hasher_busy(e):
+    # Login storms: tell clients to back off instead of failing with a 500
+    db.session.rollback()
+    resp = jsonify({"message": "Too many sign-ins right now, please retry shortly"})
+    resp.headers["Retry-After"] = str(e.retry_after)
+    return resp, e.status_code
+
 # -------------------------
 # 🧩 Register User
 # -------------------------
@@ -47,8 +58,12 @@ def login():
     if not user or not user.check_password(password):
         return jsonify({"message": "Invalid credentials"}), 401
 
-    # Generate JWT access token
-    access_token = create_access_token(identity=user.email)
+    # Transparently upgrade hashes made with old parameters
+    if user.rehash_password_if_needed(password):
+        db.session.commit()
+
+    # Generate JWT access token (identity is the stable user id, not the email)
+    access_token = create_access_token(identity=str(user.id))
 
     return jsonify({
         "token": access_token,
@@ -66,17 +81,8 @@ def login():
 @auth_bp.route('/profile', methods=['GET'])
 @jwt_required()
 def get_profile():
-    current_user_email = get_jwt_identity()
-    user = User.query.filter_by(email=current_user_email).first()
-
-    if not user:
-        return jsonify({"message": "User not found"}), 404
-
-    return jsonify({
-        "id": user.id,
-        "username": user.username,
-        "email": user.email
-    }), 200
+    # current_user comes from the cached JWT user loader; no DB round trip
+    return jsonify(current_user.to_dict()), 200
 
 
 # -------------------------
@@ -85,8 +91,7 @@ def get_profile():
 @auth_bp.route('/profile', methods=['PUT'])
 @jwt_required()
 def update_profile():
-    current_user_email = get_jwt_identity()
-    user = User.query.filter_by(email=current_user_email).first()
+    user = db.session.get(User, current_user.id)
 
     if not user:
         return jsonify({"message": "User not found"}), 404
@@ -108,5 +113,6 @@ def update_profile():
         user.set_password(password)
 
     db.session.commit()
+    user_cache.invalidate(user.id)
 
     return jsonify({"message": "Profile updated successfully"}), 200
\ No newline at end of file
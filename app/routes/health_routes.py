@@ -0,0 +1,49 @@
+from flask import Blueprint, current_app, jsonify
+from sqlalchemy import text
+
+from app import db
+from app.services.gemini_gateway import gemini_gateway
+
+health_bp = Blueprint("health_bp", __name__)
+
+
+# -------------------------
+# 💓 Liveness
+# -------------------------
+@health_bp.route('', methods=['GET'])
+@health_bp.route('/live', methods=['GET'])
+def live():
+    """Process is up and serving; touches no dependencies."""
+    return {"status": "ok"}, 200
+
+
+# -------------------------
+# ✅ Readiness
+# -------------------------
+@health_bp.route('/ready', methods=['GET'])
+def ready():
+    """Dependencies are usable: the database answers and Gemini is configured."""
+    checks = {}
+    ready = True
+
+    try:
+        db.session.execute(text("SELECT 1"))
+        checks["database"] = "ok"
+    except Exception as e:
+        db.session.rollback()
+        checks["database"] = f"error: {e.__class__.__name__}"
+        ready = False
+
+    if not current_app.config.get("GEMINI_API_KEY"):
+        checks["gemini"] = "missing GEMINI_API_KEY"
+    else:
+        open_breakers = [
+            name for name, breaker in gemini_gateway.stats()["breakers"].items()
+            if breaker["state"] != "closed"
+        ]
+        checks["gemini"] = f"degraded: {', '.join(open_breakers)}" if open_breakers else "ok"
+
+    status = "ok" if ready else "unavailable"
+    if ready and checks["gemini"] != "ok":
+        status = "degraded"
+    return jsonify({"status": status, "checks": checks}), 200 if ready else 503
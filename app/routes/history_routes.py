@@ -0,0 +1,55 @@
+from flask import Blueprint, current_app, jsonify, request
+from flask_jwt_extended import jwt_required, current_user
+
+from app.models.ai_diagnosis_model import AIDiagnosis
+from app.models.chat_log_model import ChatLog
+from app.services.history_log import history_log
+from app.services.history_service import history_page
+
+history_bp = Blueprint("history_bp", __name__)
+
+
+def _page(model, filters=()):
+    max_limit = current_app.config.get("HISTORY_MAX_PAGE_SIZE", 100)
+    limit = max(1, min(request.args.get("limit", 20, type=int), max_limit))
+
+    # Rows logged by this process may still be buffered; write them so users see their own messages
+    history_log.flush()
+
+    try:
+        rows, next_cursor = history_page(model, current_user.id, limit, request.args.get("cursor"), filters)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "items": [row.to_dict() for row in rows],
+        "next_cursor": next_cursor,
+    }), 200
+
+
+# -------------------------
+# 💬 Chat History
+# -------------------------
+@history_bp.route('/chats', methods=['GET'])
+@jwt_required()
+def chat_history():
+    """Newest-first chat turns; pass ?cursor=<next_cursor> for the next page, ?conversation_id= to narrow"""
+    conversation_id = request.args.get("conversation_id")
+    return _page(ChatLog, [ChatLog.conversation_id == conversation_id] if conversation_id else ())
+
+
+# -------------------------
+# 🌿 Diagnosis History
+# -------------------------
+@history_bp.route('/diagnoses', methods=['GET'])
+@jwt_required()
+def diagnosis_history():
+    """Newest-first image diagnoses; pass ?cursor=<next_cursor> for the next page"""
+    return _page(AIDiagnosis)
+
+
+@history_bp.route('/stats', methods=['GET'])
+@jwt_required()
+def history_stats():
+    """Write-behind buffer and flush counters for this process"""
+    return jsonify(history_log.stats()), 200
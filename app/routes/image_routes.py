@@ -0,0 +1,60 @@
+from flask import Blueprint, jsonify, send_file
+from flask_jwt_extended import jwt_required, current_user
+
+from app import db
+from app.models.uploaded_image_model import UploadedImage
+from app.services.image_store import image_store
+
+image_bp = Blueprint("image_bp", __name__)
+
+# Content-addressed, so a given URL's bytes never change
+MAX_AGE = 7 * 24 * 3600
+
+
+def _owned_image(image_id):
+    image = db.session.get(UploadedImage, image_id)
+    if image is None or image.user_id != current_user.id or not image.content_hash:
+        return None
+    return image
+
+
+def _send(fh, mimetype, etag):
+    return send_file(fh, mimetype=mimetype, etag=etag, max_age=MAX_AGE, conditional=True)
+
+
+# -------------------------
+# 🖼️ Stored Uploads
+# -------------------------
+@image_bp.route('/<int:image_id>', methods=['GET'])
+@jwt_required()
+def get_image(image_id):
+    """The normalized image as it was sent for diagnosis"""
+    image = _owned_image(image_id)
+    if image is None:
+        return jsonify({"error": "Image not found"}), 404
+    try:
+        fh = image_store.open(image.content_hash)
+    except FileNotFoundError:
+        return jsonify({"error": "Image is no longer stored"}), 410
+    return _send(fh, image.mime_type or "image/jpeg", image.content_hash)
+
+
+@image_bp.route('/<int:image_id>/thumbnail', methods=['GET'])
+@jwt_required()
+def get_thumbnail(image_id):
+    """Small JPEG preview, generated on first request"""
+    image = _owned_image(image_id)
+    if image is None:
+        return jsonify({"error": "Image not found"}), 404
+    try:
+        fh = image_store.thumbnail(image.content_hash)
+    except FileNotFoundError:
+        return jsonify({"error": "Image is no longer stored"}), 410
+    return _send(fh, "image/jpeg", f"{image.content_hash}-thumb")
+
+
+@image_bp.route('/stats', methods=['GET'])
+@jwt_required()
+def image_stats():
+    """Store, dedup, thumbnail and garbage collection counters for this process"""
+    return jsonify(image_store.stats()), 200
@@ -0,0 +1,35 @@
+from flask import Blueprint, Response, jsonify, request, send_file
+
+from app.services.metrics import metrics
+from app.services.profiler import profiler
+
+metrics_bp = Blueprint("metrics_bp", __name__)
+
+
+# -------------------------
+# 📈 Prometheus scrape
+# -------------------------
+@metrics_bp.route('', methods=['GET'])
+def scrape():
+    """Prometheus text format: route latency, SQL, pool, Gemini and image metrics."""
+    if not metrics.authorized(request.headers):
+        return jsonify({"error": "Unauthorized"}), 401
+    return Response(metrics.exposition(), mimetype="text/plain; version=0.0.4")
+
+
+# -------------------------
+# 🔬 Request profiles
+# -------------------------
+@metrics_bp.route('/profiles/<profile_id>', methods=['GET'])
+def profile(profile_id):
+    """Collapsed stacks for a request sent with ``X-Profile`` (id from its ``X-Profile-Id``)."""
+    if not metrics.authorized(request.headers):
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        path = profiler.path(profile_id)
+    except ValueError:
+        return jsonify({"error": "Profile not found"}), 404
+    try:
+        return send_file(path, mimetype="text/plain")
+    except FileNotFoundError:
+        return jsonify({"error": "Profile not found"}), 404
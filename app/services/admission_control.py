@@ -0,0 +1,344 @@
+import math
+import threading
+import time
+
+from cachetools import TTLCache
+from flask import g, jsonify, request
+from sqlalchemy import text
+
+from app import db
+
+# One statement refills and spends atomically; no row means "not enough tokens"
+_TAKE_SQL = text("""
+    INSERT INTO rate_limit_buckets AS b (key, tokens, updated_at)
+    VALUES (:key, :burst - :cost, EXTRACT(EPOCH FROM clock_timestamp())::double precision)
+    ON CONFLICT (key) DO UPDATE SET
+        tokens = LEAST(:burst, b.tokens + (EXTRACT(EPOCH FROM clock_timestamp())::double precision - b.updated_at) * :rate) - :cost,
+        updated_at = EXTRACT(EPOCH FROM clock_timestamp())::double precision
+    WHERE LEAST(:burst, b.tokens + (EXTRACT(EPOCH FROM clock_timestamp())::double precision - b.updated_at) * :rate) >= :cost
+    RETURNING tokens
+""")
+
+_AVAILABLE_SQL = text("""
+    SELECT LEAST(:burst, tokens + (EXTRACT(EPOCH FROM clock_timestamp())::double precision - updated_at) * :rate)
+    FROM rate_limit_buckets WHERE key = :key
+""")
+
+_REFUND_SQL = text("""
+    UPDATE rate_limit_buckets SET tokens = LEAST(:burst, tokens + :cost) WHERE key = :key
+""")
+
+
+class TokenBucket:
+    """Classic token bucket: ``rate`` tokens per second, holding at most ``burst``."""
+    __slots__ = ("tokens", "updated_at")
+
+    def __init__(self, burst):
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+
+    def take(self, rate, burst, cost=1.0):
+        """Spend ``cost`` tokens; return 0 if admitted, else seconds until enough have refilled."""
+        now = time.monotonic()
+        self.tokens = min(burst, self.tokens + (now - self.updated_at) * rate)
+        self.updated_at = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / rate
+
+    def refund(self, burst, cost=1.0):
+        """Give back tokens taken for a request that was rejected further on."""
+        self.tokens = min(burst, self.tokens + cost)
+
+
+class LocalBuckets:
+    """Token buckets kept in this process (per worker)."""
+
+    def __init__(self, maxsize=100000):
+        self._buckets = TTLCache(maxsize=maxsize, ttl=3600)
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1.0):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(burst)
+            return bucket.take(rate, burst, cost)
+
+    def refund(self, key, burst, cost=1.0):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.refund(burst, cost)
+
+
+class PostgresBuckets:
+    """
+    Token buckets shared by every worker and instance through the
+    ``rate_limit_buckets`` table. Each check is a single upsert on its own
+    short connection (never the request's session).
+    """
+
+    def take(self, key, rate, burst, cost=1.0):
+        params = {"key": key, "rate": rate, "burst": burst, "cost": cost}
+        with db.engine.begin() as conn:
+            if conn.execute(_TAKE_SQL, params).first() is not None:
+                return 0.0
+            available = conn.execute(_AVAILABLE_SQL, params).scalar() or 0.0
+        return max((cost - available) / rate, 0.001)
+
+    def refund(self, key, burst, cost=1.0):
+        with db.engine.begin() as conn:
+            conn.execute(_REFUND_SQL, {"key": key, "burst": burst, "cost": cost})
+
+
+class ConcurrencyLimiter:
+    """
+    Caps in-flight AI requests per process. Requests over the cap wait in a
+    queue; any that would wait longer than ``queue_target`` seconds, or find
+    ``max_queue`` others already waiting, are shed instead of piling up.
+    """
+
+    def __init__(self, limit=24, queue_target=2.0, max_queue=64):
+        self.limit = limit
+        self.queue_target = queue_target
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Return None when admitted, otherwise the shed reason."""
+        with self._cond:
+            if self.active < self.limit:
+                self.active += 1
+                return None
+            if self.waiting >= self.max_queue:
+                return "queue_full"
+
+            self.waiting += 1
+            deadline = time.monotonic() + self.queue_target
+            try:
+                while self.active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return "queue_timeout"
+                    self._cond.wait(remaining)
+                self.active += 1
+                return None
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+
+class AdmissionControl:
+    """
+    Admission control for the AI blueprint: a per-user token bucket (429), a
+    global token bucket protecting the Gemini quota (503), then a per-process
+    concurrency limiter that sheds load (503) once queueing would exceed the
+    latency target. Rejections carry ``Retry-After``, and tokens taken by an
+    earlier check are refunded when a later one rejects the request.
+
+    Views whose cost is only known from the body (batch uploads) ``charge``
+    the extra tokens to the user's bucket; batch workers, which run outside
+    any request, ``pace`` each model call through the global bucket, and a
+    hedged model call must ``spend_global`` a token of its own.
+
+    Buckets live in process memory by default, where each of the
+    ``ADMISSION_LOCAL_PROCESSES`` workers gets an equal share of the global
+    limit; ``ADMISSION_BACKEND=postgres`` shares them across workers and
+    instances through ``rate_limit_buckets`` (falling back to local buckets
+    if the database can't be reached).
+    Reads (GET, e.g. stats and batch polling) and CORS preflights are exempt.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.user_rate = 30 / 60
+        self.user_burst = 10
+        self.global_rate = 1200 / 60
+        self.global_burst = 100
+        self.local_processes = 1
+        self.local = LocalBuckets()
+        self.shared = None
+        self.limiter = ConcurrencyLimiter()
+        self._lock = threading.Lock()
+        self._counters = {
+            "admitted": 0,
+            "throttled_user": 0,
+            "throttled_global": 0,
+            "shed_queue_timeout": 0,
+            "shed_queue_full": 0,
+            "paced_background": 0,
+            "throttled_hedges": 0,
+            "backend_errors": 0,
+        }
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get("ADMISSION_ENABLED", self.enabled)
+        self.user_rate = app.config.get("ADMISSION_USER_RATE_PER_MIN", 30) / 60
+        self.user_burst = app.config.get("ADMISSION_USER_BURST", self.user_burst)
+        self.global_rate = app.config.get("ADMISSION_GLOBAL_RATE_PER_MIN", 1200) / 60
+        self.global_burst = app.config.get("ADMISSION_GLOBAL_BURST", self.global_burst)
+        self.local_processes = max(1, app.config.get("ADMISSION_LOCAL_PROCESSES", self.local_processes))
+        self.shared = PostgresBuckets() if app.config.get("ADMISSION_BACKEND") == "postgres" else None
+        self.limiter = ConcurrencyLimiter(
+            limit=app.config.get("ADMISSION_MAX_CONCURRENT", 24),
+            queue_target=app.config.get("ADMISSION_QUEUE_TARGET", 2.0),
+            max_queue=app.config.get("ADMISSION_MAX_QUEUE", 64),
+        )
+        app.extensions["admission_control"] = self
+
+    def protect(self, blueprint):
+        blueprint.before_request(self.admit)
+        blueprint.teardown_request(self.release)
+
+    # --- Buckets ---
+    def _local_limits(self, key, rate, burst):
+        """A local bucket only sees this process, so the global one gets this worker's share."""
+        if key == "global" and self.local_processes > 1:
+            return rate / self.local_processes, max(burst / self.local_processes, 1.0)
+        return rate, burst
+
+    def _take(self, key, rate, burst, cost=1.0):
+        """``(wait, buckets)``: the backend that answered, so a refund goes back to it."""
+        if self.shared is not None:
+            try:
+                return self.shared.take(key, rate, burst, cost), self.shared
+            except Exception as e:
+                self._count("backend_errors")
+                print(f"⚠️ Shared rate limit backend unavailable, using local buckets: {e}")
+        rate, burst = self._local_limits(key, rate, burst)
+        return self.local.take(key, rate, burst, cost), self.local
+
+    def _refund(self, buckets, key, burst, cost=1.0):
+        if buckets is self.local:
+            _, burst = self._local_limits(key, 0.0, burst)
+        try:
+            buckets.refund(key, burst, cost)
+        except Exception as e:
+            self._count("backend_errors")
+            print(f"⚠️ Could not refund rate limit tokens for {key}: {e}")
+
+    @staticmethod
+    def _client_key():
+        from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+
+        try:
+            verify_jwt_in_request(optional=True)
+            identity = get_jwt_identity()
+        except Exception:
+            identity = None  # The view's @jwt_required() reports the bad token
+        return f"user:{identity}" if identity is not None else f"ip:{request.remote_addr}"
+
+    # --- Request hooks ---
+    def admit(self):
+        if not self.enabled or request.method in ("GET", "HEAD", "OPTIONS"):
+            return None
+
+        key = self._client_key()
+        wait, user_buckets = self._take(key, self.user_rate, self.user_burst)
+        if wait:
+            self._count("throttled_user")
+            return self._reject(429, "Too many requests, slow down.", wait)
+
+        wait, global_buckets = self._take("global", self.global_rate, self.global_burst)
+        if wait:
+            self._refund(user_buckets, key, self.user_burst)
+            self._count("throttled_global")
+            return self._reject(503, "The AI service is busy, please retry shortly.", wait)
+
+        shed = self.limiter.acquire()
+        if shed:
+            self._refund(user_buckets, key, self.user_burst)
+            self._refund(global_buckets, "global", self.global_burst)
+            self._count(f"shed_{shed}")
+            return self._reject(503, "The AI service is overloaded, please retry shortly.", self.limiter.queue_target)
+
+        g.admission_slot = True
+        g.admission_key = key
+        g.admission_buckets = user_buckets
+        self._count("admitted")
+        return None
+
+    def charge(self, extra):
+        """
+        Take ``extra`` more tokens from the caller's bucket for an admitted
+        request whose real cost is only known in the view (e.g. one token per
+        image in a batch). Capped so the whole request never costs more than a
+        full bucket. Returns a 429 response to send back, or None; on a 429
+        the token ``admit`` took is refunded, since the request won't run.
+        """
+        key = g.get("admission_key")
+        if not self.enabled or key is None:
+            return None
+        extra = min(extra, self.user_burst - 1)
+        if extra <= 0:
+            return None
+        wait, _ = self._take(key, self.user_rate, self.user_burst, extra)
+        if wait:
+            self._refund(g.get("admission_buckets", self.local), key, self.user_burst)
+            self._count("throttled_user")
+            return self._reject(429, "Too many requests, slow down.", wait)
+        return None
+
+    def pace(self):
+        """Block until the global bucket admits one model call (batch workers, outside any request)."""
+        while self.enabled:
+            wait, _ = self._take("global", self.global_rate, self.global_burst)
+            if not wait:
+                return
+            self._count("paced_background")
+            time.sleep(min(wait, 5))
+
+    def spend_global(self):
+        """
+        Take a global token for an extra model call made on behalf of an
+        already admitted request (a hedge). Never waits: returns False when
+        the bucket is empty, and the extra call should be skipped.
+        """
+        if not self.enabled:
+            return True
+        wait, _ = self._take("global", self.global_rate, self.global_burst)
+        if wait:
+            self._count("throttled_hedges")
+            return False
+        return True
+
+    def release(self, _exc=None):
+        g.pop("admission_key", None)
+        g.pop("admission_buckets", None)
+        if g.pop("admission_slot", False):
+            self.limiter.release()
+
+    @staticmethod
+    def _reject(status_code, message, retry_after):
+        retry_after = max(1, math.ceil(retry_after))
+        resp = jsonify({"error": message, "retry_after": retry_after})
+        resp.headers["Retry-After"] = str(retry_after)
+        return resp, status_code
+
+    # --- Counters ---
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats["in_flight"] = self.limiter.active
+        stats["queued"] = self.limiter.waiting
+        stats["max_concurrent"] = self.limiter.limit
+        stats["backend"] = "postgres" if self.shared is not None else "local"
+        stats["local_processes"] = self.local_processes
+        return stats
+
+
+admission_control = AdmissionControl()
@@ -1,16 +1,91 @@
-def generate_ai_response(message: str) -> str:
+from app import db
+from app.services.diagnosis_cache import diagnosis_cache
+from app.services.model_router import IMAGE, model_router
+from app.services.knowledge_base import knowledge_base
+
+IMAGE_PROMPT = "You are AgroAI, an expert crop health assistant. Analyze this image of a plant leaf and detect if it has any disease. Include disease name, confidence level, and farming recommendations."
+
+
+def release_db_connection():
     """
-    Example AI logic — later you can replace this with OpenAI API, Hugging Face, or your own model.
+    End the session's transaction so its pooled connection goes back to the
+    pool before we block for seconds on Gemini. With threaded workers this
+    keeps the number of DB connections proportional to DB work, not to
+    the number of in-flight AI requests.
+    """
+    db.session.commit()
+
+
+def chat_prompt(query, summary="", turns=()):
+    """Text chat prompt with the conversation so far (rolling summary + recent turns)."""
+    context = ""
+    if summary:
+        context += f"\nSummary of the earlier conversation:\n{summary}\n"
+    if turns:
+        context += "\nRecent conversation:\n" + "\n".join(turn.render() for turn in turns) + "\n"
+
+    return f"""
+You are AgroAI, an expert agricultural assistant specializing in crop health and farming advice.
+{context}
+User: {query}
+
+Provide a helpful, practical, and accurate farming response.
+"""
+
+
+def image_contents(mime_type, data):
+    """Gemini request contents for a leaf diagnosis."""
+    return [IMAGE_PROMPT, {"mime_type": mime_type, "data": data}]
+
+
+def lookup_diagnosis(image_hash, phash=None, bypass=False):
+    """Return ``(cached_diagnosis_or_None, cache_status)`` for an image."""
+    if bypass:
+        diagnosis_cache.record_bypass()
+        return None, "BYPASS"
+    cached = diagnosis_cache.lookup(image_hash, phash)
+    return cached, "HIT" if cached else "MISS"
+
+
+def remember_diagnosis(image_hash, diagnosis_text, model_name, phash=None, user_id=None, image_id=None):
+    """Cache a fresh diagnosis; the database row is written behind, off the request path."""
+    diagnosis_cache.store(
+        image_hash,
+        diagnosis_text,
+        model_name=model_name,
+        phash=phash,
+        user_id=user_id,
+        image_id=image_id,
+    )
+
+
+def diagnose_image(image_hash, mime_type, data, phash=None, user_id=None, bypass=False, timeout=None):
+    """
+    Cache-first blocking diagnosis. Returns ``(text_or_None, cache_status)``;
+    raises GatewayError when the model can't be reached.
+    """
+    cached, cache_status = lookup_diagnosis(image_hash, phash, bypass)
+    if cached:
+        return cached.result, cache_status
+
+    release_db_connection()
+    diagnosis_text, model_name = model_router.generate(IMAGE, image_contents(mime_type, data), timeout=timeout)
+    if diagnosis_text:
+        remember_diagnosis(image_hash, diagnosis_text, model_name, phash=phash, user_id=user_id)
+    return diagnosis_text, cache_status
+
+
+def generate_ai_response(message: str):
+    """
+    Answer common disease questions from the local knowledge base.
+    Returns the answer text, or None when the question needs the LLM.
     """
     if not message:
-        return "Please enter a message."
-
-    lower_msg = message.lower()
-    if "hello" in lower_msg:
-        return "Hi there 👋! I'm AgroAI — how can I assist you today?"
-    elif "crop" in lower_msg:
-        return "I can help diagnose crop diseases. Please upload an image or describe the issue."
-    elif "weather" in lower_msg:
-        return "Today's weather looks great for planting 🌱."
-    else:
-        return "I'm your AI assistant, still learning to understand you better!"
+        return None
+
+    match = knowledge_base.answer(message)
+    if match is None:
+        return None
+    text, entry, confidence = match
+    print(f"📚 Knowledge base answer: {entry.crop} / {entry.disease} ({confidence:.2f})")
+    return text
@@ -0,0 +1,264 @@
+import os
+import threading
+import time
+from datetime import timedelta
+
+from sqlalchemy import case, or_, update
+
+from app import db
+from app.models.ai_diagnosis_model import _utcnow
+from app.models.diagnosis_job_model import DiagnosisJob, DiagnosisJobItem
+from app.services.admission_control import admission_control
+from app.services.ai_service import diagnose_image
+from app.services.diagnosis_cache import image_digest
+from app.services.gemini_gateway import GatewayError
+
+
+class BatchDiagnosisQueue:
+    """
+    Database-backed job queue for batch leaf diagnosis.
+
+    Items live in ``diagnosis_job_items``; each process runs a small pool of
+    worker threads that claim queued items (``FOR UPDATE SKIP LOCKED`` on
+    Postgres plus a conditional status update, so several gunicorn workers or
+    instances can share the table without an external broker) and run them
+    through the usual cache → Gemini gateway path. Concurrency towards the
+    model is bounded by ``BATCH_WORKERS`` per process, and each item takes a
+    token from the admission control global bucket before it runs, so batches
+    share the Gemini quota with interactive requests.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.workers = 4
+        self.poll_interval = 1.0
+        self.stale_after = 300
+        self.max_attempts = 3
+        self._pid = None
+        self._threads = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._progress = threading.Condition()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get("BATCH_WORKERS", self.workers)
+        self.poll_interval = app.config.get("BATCH_POLL_INTERVAL", self.poll_interval)
+        self.stale_after = app.config.get("BATCH_STALE_AFTER", self.stale_after)
+        self.max_attempts = app.config.get("BATCH_MAX_ATTEMPTS", self.max_attempts)
+        app.extensions["batch_queue"] = self
+        if self.workers > 0:
+            # Threads don't survive a fork, so start them lazily in each worker process
+            app.before_request(self.ensure_workers)
+
+    # --- Worker lifecycle ---
+    def ensure_workers(self):
+        if self._pid == os.getpid() or self.workers <= 0:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._threads = [
+                threading.Thread(target=self._run, name=f"batch-worker-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        last_reclaim = 0.0
+        while True:
+            with self.app.app_context():
+                try:
+                    if time.monotonic() - last_reclaim > self.stale_after / 2:
+                        self._reclaim_stale()
+                        last_reclaim = time.monotonic()
+                    worked = self._process_next()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"❌ Batch worker error: {e}")
+                    worked = False
+                finally:
+                    db.session.remove()
+            if not worked:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    # --- Enqueue ---
+    def enqueue(self, user_id, images, rejected=()):
+        """
+        Create a job from ``(filename, PreparedImage)`` pairs. ``rejected`` is a
+        list of ``(filename, error)`` for uploads that failed preprocessing;
+        they are recorded as failed items so positions match the request.
+        """
+        job = DiagnosisJob(user_id=user_id, status="queued", completed=0)
+        position = 0
+        for filename, prepared in images:
+            job.items.append(DiagnosisJobItem(
+                position=position,
+                filename=filename,
+                image_data=prepared.data,
+                mime_type=prepared.mime_type,
+                image_hash=image_digest(prepared.data),
+                phash=prepared.phash,
+            ))
+            position += 1
+        for filename, error in rejected:
+            job.items.append(DiagnosisJobItem(
+                position=position,
+                filename=filename,
+                status="failed",
+                error=error,
+                finished_at=_utcnow(),
+            ))
+            position += 1
+
+        job.total = position
+        job.failed = len(rejected)
+        if job.is_finished:
+            job.status = "completed"
+            job.finished_at = _utcnow()
+
+        db.session.add(job)
+        db.session.commit()
+
+        self.ensure_workers()
+        self._wakeup.set()
+        return job
+
+    # --- Processing ---
+    def _claim(self):
+        """
+        Atomically move the oldest queued item that is due to running (and its
+        job, on its first claim); return the item id or None.
+        """
+        query = (
+            db.session.query(DiagnosisJobItem.id, DiagnosisJobItem.job_id)
+            .filter(
+                DiagnosisJobItem.status == "queued",
+                or_(DiagnosisJobItem.not_before.is_(None), DiagnosisJobItem.not_before <= _utcnow()),
+            )
+            .order_by(DiagnosisJobItem.id)
+            .limit(1)
+        )
+        if db.engine.dialect.name == "postgresql":
+            query = query.with_for_update(skip_locked=True)
+
+        row = query.first()
+        if row is None:
+            db.session.rollback()
+            return None
+
+        result = db.session.execute(
+            update(DiagnosisJobItem)
+            .where(DiagnosisJobItem.id == row.id, DiagnosisJobItem.status == "queued")
+            .values(status="running", claimed_at=_utcnow(), attempts=DiagnosisJobItem.attempts + 1)
+        )
+        if result.rowcount == 1:
+            db.session.execute(
+                update(DiagnosisJob)
+                .where(DiagnosisJob.id == row.job_id, DiagnosisJob.status == "queued")
+                .values(status="running")
+            )
+        db.session.commit()
+        return row.id if result.rowcount == 1 else None
+
+    def _process_next(self):
+        item_id = self._claim()
+        if item_id is None:
+            return False
+
+        item = db.session.get(DiagnosisJobItem, item_id)
+        job = item.job
+        try:
+            admission_control.pace()
+            text, cache_status = diagnose_image(
+                item.image_hash, item.mime_type, item.image_data,
+                phash=item.phash, user_id=job.user_id,
+            )
+            item.result = text or "No diagnosis available."
+            item.cached = cache_status == "HIT"
+            item.status = "done"
+            counter = DiagnosisJob.completed
+        except Exception as e:
+            db.session.rollback()
+            item = db.session.get(DiagnosisJobItem, item_id)
+            if item.attempts < self.max_attempts:
+                # Requeue now, but keep it unclaimable while the upstream asks us to back off
+                if isinstance(e, GatewayError) and e.retry_after:
+                    item.not_before = _utcnow() + timedelta(seconds=min(e.retry_after, 30))
+                item.status = "queued"
+                item.error = str(e)
+                db.session.commit()
+                return True
+            item.status = "failed"
+            item.error = str(e)
+            counter = DiagnosisJob.failed
+
+        item.image_data = None
+        item.finished_at = _utcnow()
+        self._finish_item(item.job_id, counter)
+        return True
+
+    def _finish_item(self, job_id, counter):
+        # Counter and job status move in one statement (and one commit with the
+        # item), so a poll never sees every item done while the job still runs.
+        # SET expressions read the row as it was before this update.
+        finished = DiagnosisJob.completed + DiagnosisJob.failed + 1 >= DiagnosisJob.total
+        db.session.execute(
+            update(DiagnosisJob)
+            .where(DiagnosisJob.id == job_id)
+            .values({
+                counter: counter + 1,
+                DiagnosisJob.status: case((finished, "completed"), else_="running"),
+                DiagnosisJob.finished_at: case((finished, _utcnow()), else_=DiagnosisJob.finished_at),
+            })
+        )
+        db.session.commit()
+
+        with self._progress:
+            self._progress.notify_all()
+
+    def _reclaim_stale(self):
+        """
+        Requeue items whose worker died mid-flight. An item that has already
+        been claimed ``max_attempts`` times (say, an image that crashes the
+        worker) is failed instead, so it can't be retried forever.
+        """
+        cutoff = _utcnow() - timedelta(seconds=self.stale_after)
+        stale = (
+            db.session.query(DiagnosisJobItem.id, DiagnosisJobItem.job_id, DiagnosisJobItem.attempts)
+            .filter(DiagnosisJobItem.status == "running", DiagnosisJobItem.claimed_at < cutoff)
+            .all()
+        )
+        for item_id, job_id, attempts in stale:
+            give_up = attempts >= self.max_attempts
+            values = {"status": "queued"}
+            if give_up:
+                values = {
+                    "status": "failed",
+                    "error": f"Processing did not finish after {attempts} attempts",
+                    "image_data": None,
+                    "finished_at": _utcnow(),
+                }
+            # Conditional, so two processes reclaiming at once count the item only once
+            result = db.session.execute(
+                update(DiagnosisJobItem)
+                .where(DiagnosisJobItem.id == item_id, DiagnosisJobItem.status == "running")
+                .values(**values)
+            )
+            if give_up and result.rowcount == 1:
+                self._finish_item(job_id, DiagnosisJob.failed)
+        db.session.commit()
+
+    # --- Status ---
+    def wait_for_progress(self, timeout):
+        """Block until any local item finishes or ``timeout`` elapses (long-poll helper)."""
+        with self._progress:
+            self._progress.wait(timeout)
+
+
+batch_queue = BatchDiagnosisQueue()
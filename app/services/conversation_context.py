@@ -0,0 +1,348 @@
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from cachetools import TTLCache
+from sqlalchemy import and_, or_, update
+
+from app import db
+from app.models.ai_diagnosis_model import _utcnow
+from app.models.chat_log_model import ChatLog
+from app.models.conversation_model import Conversation
+from app.services.gemini_gateway import gemini_gateway
+from app.services.history_log import history_log
+
+SUMMARY_PROMPT = """You maintain the running summary of a conversation between a farmer and AgroAI, an agricultural assistant.
+Update the summary with the new exchanges below. Keep crops, locations, symptoms, diagnoses, products and advice already given, and any open questions.
+Write plain prose, at most {max_words} words.
+
+Current summary:
+{summary}
+
+New exchanges:
+{exchanges}
+
+Updated summary:"""
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token for English text); no API call."""
+    return len(text) // 4 + 1 if text else 0
+
+
+class Turn:
+    """
+    One exchange: the user's message and the assistant's reply, with the
+    position of its ``chat_logs`` row (``log_id`` is None until it is flushed).
+    """
+    __slots__ = ("user", "assistant", "tokens", "created_at", "log_id")
+
+    def __init__(self, user, assistant, created_at=None, log_id=None):
+        self.user = user
+        self.assistant = assistant
+        self.created_at = created_at
+        self.log_id = log_id
+        self.tokens = estimate_tokens(user) + estimate_tokens(assistant) + 4
+
+    def render(self):
+        return f"User: {self.user}\nAgroAI: {self.assistant}"
+
+
+class ConversationState:
+    """
+    In-process view of a conversation: the rolling summary of compacted turns
+    plus the turns after it, oldest first. ``turn_count`` and
+    ``saved_summarized_turns`` are what this copy knows of the database row,
+    and are compared with it to spot changes made by other workers.
+    """
+
+    def __init__(self, conversation_id, user_id, summary="", summarized_turns=0, turns=(), turn_count=0):
+        self.conversation_id = conversation_id
+        self.user_id = user_id
+        self.summary = summary
+        self.summarized_turns = summarized_turns
+        self.saved_summarized_turns = summarized_turns
+        self.turn_count = turn_count
+        self.verified_at = time.monotonic()
+        self.turns = deque(turns)
+        self.compacting = False
+        self.lock = threading.Lock()
+
+    def unsummarized_tokens(self):
+        return sum(turn.tokens for turn in self.turns)
+
+    def is_current(self, turn_count, summarized_turns):
+        """True unless another worker recorded turns or compacted since this copy was loaded."""
+        with self.lock:
+            return turn_count <= self.turn_count and summarized_turns == self.saved_summarized_turns
+
+
+class ConversationContext:
+    """
+    Token-budgeted context for multi-turn chat.
+
+    Each prompt gets the rolling summary plus as many of the most recent turns
+    as fit in ``CHAT_CONTEXT_TOKENS``, so prompt size stays bounded however
+    long the conversation runs. When the turns not yet summarized outgrow the
+    budget, the oldest of them are folded into the summary in the background:
+    the model only sees the previous summary and the new turns, never the
+    whole history. Summaries are stored in ``conversations`` so any worker
+    can pick a conversation up; states are cached per process.
+
+    A cached copy older than ``CHAT_CONTEXT_RECHECK`` seconds is compared
+    with the conversation's row (one primary-key read) before use, so a
+    conversation that moved between workers is reloaded instead of served
+    stale. The row's ``turn_count`` is bumped by the history writer in the
+    same flush as the turn itself, so recording a turn adds no database
+    work. Saving a summary is a compare-and-set on ``summarized_turns``:
+    when two workers compact at once, the loser drops its copy rather than
+    overwrite the winner's summary.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.budget = 2000
+        self.summary_tokens = 300
+        self.max_turns = 50
+        self.recheck = 5.0
+        self.summary_model = "gemini-2.0-flash-exp"
+        self._states = TTLCache(maxsize=5000, ttl=3600)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        self._counters = {"hits": 0, "loads": 0, "stale_reloads": 0, "compactions": 0,
+                          "compaction_failures": 0, "compaction_conflicts": 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.budget = app.config.get("CHAT_CONTEXT_TOKENS", self.budget)
+        self.summary_tokens = app.config.get("CHAT_SUMMARY_TOKENS", self.summary_tokens)
+        self.max_turns = app.config.get("CHAT_CONTEXT_MAX_TURNS", self.max_turns)
+        self.recheck = app.config.get("CHAT_CONTEXT_RECHECK", self.recheck)
+        self.summary_model = app.config.get("CHAT_SUMMARY_MODEL", self.summary_model)
+        with self._lock:
+            self._states = TTLCache(
+                maxsize=app.config.get("CHAT_CONTEXT_CACHE_SIZE", 5000),
+                ttl=app.config.get("CHAT_CONTEXT_CACHE_TTL", 3600),
+            )
+        app.extensions["conversation_context"] = self
+
+    @staticmethod
+    def new_id():
+        return uuid.uuid4().hex
+
+    # --- State ---
+    def get(self, user_id, conversation_id):
+        """
+        Return the ConversationState, loading it from the database on a cache
+        miss or when another worker has changed the conversation since (checked
+        at most every ``recheck`` seconds).
+        """
+        key = (user_id, conversation_id)
+        with self._lock:
+            state = self._states.get(key)
+
+        if state is not None:
+            current = time.monotonic() - state.verified_at < self.recheck
+            if not current:
+                version = (
+                    db.session.query(Conversation.turn_count, Conversation.summarized_turns)
+                    .filter_by(id=conversation_id, user_id=user_id)
+                    .first()
+                )
+                current = version is None or state.is_current(*version)
+                state.verified_at = time.monotonic()
+            if current:
+                with self._lock:
+                    self._counters["hits"] += 1
+                return state
+            # Our own recent turns may still be buffered; write them before reading the log back
+            history_log.flush()
+
+        fresh = self._load(user_id, conversation_id)
+        with self._lock:
+            if state is not None:
+                self._counters["stale_reloads"] += 1
+                self._states[key] = fresh
+                return fresh
+            self._counters["loads"] += 1
+            # Another thread may have loaded it meanwhile; keep the first so turns aren't split
+            return self._states.setdefault(key, fresh)
+
+    def _load(self, user_id, conversation_id):
+        conversation = (
+            Conversation.query
+            .filter_by(id=conversation_id, user_id=user_id)
+            .first()
+        )
+        summary = conversation.summary if conversation else ""
+        summarized = conversation.summarized_turns if conversation else 0
+
+        query = (
+            db.session.query(ChatLog.id, ChatLog.created_at, ChatLog.message, ChatLog.response)
+            .filter(ChatLog.conversation_id == conversation_id, ChatLog.user_id == user_id)
+        )
+        if conversation is not None and conversation.summarized_until is not None:
+            # Keyset on (created_at, id) past the summary, so cost doesn't grow with conversation length
+            until, until_id = conversation.summarized_until, conversation.summarized_until_id
+            after = ChatLog.created_at > until
+            if until_id is not None:
+                after = or_(after, and_(ChatLog.created_at == until, ChatLog.id > until_id))
+            query = query.filter(after)
+        # Newest max_turns only: older unsummarized turns would be trimmed anyway
+        rows = query.order_by(ChatLog.created_at.desc(), ChatLog.id.desc()).limit(self.max_turns).all()
+        turns = [
+            Turn(message or "[sent a photo]", response, created_at, log_id)
+            for log_id, created_at, message, response in reversed(rows)
+        ]
+        # Written in the same transaction as the chat_logs rows, so it counts exactly what we read
+        turn_count = conversation.turn_count if conversation else 0
+        return ConversationState(conversation_id, user_id, summary or "", summarized, turns, turn_count)
+
+    # --- Prompt context ---
+    def window(self, state, query):
+        """
+        ``(summary, recent_turns)`` to send with ``query``: the newest turns
+        whose estimated tokens, together with the summary and the query, fit
+        in the budget.
+        """
+        with state.lock:
+            summary = state.summary
+            available = self.budget - estimate_tokens(summary) - estimate_tokens(query)
+            recent = []
+            for turn in reversed(state.turns):
+                if turn.tokens > available:
+                    break
+                recent.append(turn)
+                available -= turn.tokens
+        recent.reverse()
+        return summary, recent
+
+    def record(self, state, message, response, created_at=None):
+        """
+        Append an exchange and compact older turns if they no longer fit the
+        budget. ``created_at`` is the timestamp its ``chat_logs`` row carries.
+        """
+        with state.lock:
+            state.turns.append(Turn(message, response, created_at))
+            state.turn_count += 1
+            # Hard cap in case summarization keeps failing
+            while len(state.turns) > self.max_turns and not state.compacting:
+                state.turns.popleft()
+                state.summarized_turns += 1
+            should_compact = not state.compacting and state.unsummarized_tokens() > self.budget
+            if should_compact:
+                state.compacting = True
+        if should_compact:
+            self._pool().submit(self._compact, state)
+
+    # --- Rolling summary ---
+    def _pool(self):
+        # Executor threads don't survive a fork; make one per process
+        if self._executor is None or self._executor_pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._executor_pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chat-summary")
+                    self._executor_pid = os.getpid()
+        return self._executor
+
+    def _compact(self, state):
+        """Fold the oldest turns into the summary until the rest fill half the budget."""
+        try:
+            with state.lock:
+                keep = self.budget // 2
+                remaining = state.unsummarized_tokens()
+                batch = []
+                for turn in state.turns:
+                    if remaining <= keep:
+                        break
+                    batch.append(turn)
+                    remaining -= turn.tokens
+                previous = state.summary
+                # record() doesn't trim while we compact, so these stay put until we apply the batch
+                expected = state.saved_summarized_turns
+                summarized_turns = state.summarized_turns + len(batch)
+
+            if not batch:
+                return
+
+            prompt = SUMMARY_PROMPT.format(
+                max_words=int(self.summary_tokens * 0.75),
+                summary=previous or "(none yet)",
+                exchanges="\n\n".join(turn.render() for turn in batch),
+            )
+            summary = gemini_gateway.generate(self.summary_model, prompt)
+            if not summary:
+                raise ValueError("empty summary")
+            # Never let a verbose summary eat the budget for recent turns
+            summary = summary.strip()[: self.summary_tokens * 4]
+
+            saved = self._save(state, summary, expected, summarized_turns, batch[-1])
+            if not saved and expected == 0 and history_log.pending():
+                # A new conversation's row may still be waiting in our history buffer
+                history_log.flush()
+                saved = self._save(state, summary, expected, summarized_turns, batch[-1])
+            if not saved:
+                # Another worker compacted first; its summary wins and our copy is out of date
+                with self._lock:
+                    self._counters["compaction_conflicts"] += 1
+                    key = (state.user_id, state.conversation_id)
+                    if self._states.get(key) is state:
+                        del self._states[key]
+                return
+
+            with state.lock:
+                # Turns are only appended while we were away, so the batch is still at the front
+                for _ in batch:
+                    state.turns.popleft()
+                state.summary = summary
+                state.summarized_turns = summarized_turns
+                state.saved_summarized_turns = summarized_turns
+            with self._lock:
+                self._counters["compactions"] += 1
+        except Exception as e:
+            with self._lock:
+                self._counters["compaction_failures"] += 1
+            print(f"⚠️ Conversation summary failed for {state.conversation_id}: {e}")
+        finally:
+            with state.lock:
+                state.compacting = False
+
+    def _save(self, state, summary, expected, summarized_turns, last):
+        """
+        Store the summary, which now ends at turn ``last``, if the row still
+        covers ``expected`` turns. Returns False if another worker changed it
+        first (or the row isn't ours).
+        """
+        with self.app.app_context(), db.engine.begin() as conn:
+            saved = conn.execute(
+                update(Conversation)
+                .where(
+                    Conversation.id == state.conversation_id,
+                    Conversation.user_id == state.user_id,
+                    Conversation.summarized_turns == expected,
+                )
+                .values(
+                    summary=summary,
+                    summarized_turns=summarized_turns,
+                    summarized_until=last.created_at,
+                    summarized_until_id=last.log_id,
+                    updated_at=_utcnow(),
+                )
+            ).rowcount
+        return saved == 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["cached_conversations"] = len(self._states)
+        stats["budget_tokens"] = self.budget
+        return stats
+
+
+conversation_context = ConversationContext()
@@ -0,0 +1,203 @@
+import hashlib
+import io
+import threading
+from datetime import timedelta
+
+from cachetools import TTLCache
+
+
+def image_digest(data: bytes) -> str:
+    """SHA-256 content address of the (normalized) image bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def perceptual_hash(data: bytes):
+    """
+    64-bit difference hash (dHash) as 16 hex chars, or None when the bytes
+    can't be decoded. Re-encoded or slightly recompressed copies of the same
+    photo land within a few bits of each other.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return dhash(img)
+    except Exception:
+        return None
+
+
+def dhash(img) -> str:
+    """dHash of an already-decoded PIL image."""
+    small = img.convert("L").resize((9, 8))
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (1 if left > right else 0)
+    return f"{bits:016x}"
+
+
+def hamming(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+class CachedDiagnosis:
+    __slots__ = ("image_hash", "phash", "result", "model_name", "source")
+
+    def __init__(self, image_hash, phash, result, model_name, source="memory"):
+        self.image_hash = image_hash
+        self.phash = phash
+        self.result = result
+        self.model_name = model_name
+        self.source = source
+
+
+class DiagnosisCache:
+    """
+    Two-tier diagnosis cache: an in-process LRU (with TTL) in front of the
+    persistent ``ai_diagnoses`` table, keyed by the SHA-256 of the image bytes.
+    Near-duplicates are matched by perceptual hash against the hot tier only.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.ttl = 7 * 24 * 3600
+        self.maxsize = 1024
+        self.phash_distance = 4
+        self._entries = TTLCache(maxsize=self.maxsize, ttl=self.ttl)
+        self._lock = threading.Lock()
+        self._counters = {
+            "memory_hits": 0,
+            "near_duplicate_hits": 0,
+            "db_hits": 0,
+            "misses": 0,
+            "bypassed": 0,
+            "stores": 0,
+        }
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get("DIAGNOSIS_CACHE_ENABLED", True)
+        self.ttl = app.config.get("DIAGNOSIS_CACHE_TTL", self.ttl)
+        self.maxsize = app.config.get("DIAGNOSIS_CACHE_SIZE", self.maxsize)
+        self.phash_distance = app.config.get("DIAGNOSIS_CACHE_PHASH_DISTANCE", self.phash_distance)
+        with self._lock:
+            self._entries = TTLCache(maxsize=self.maxsize, ttl=self.ttl)
+        app.extensions["diagnosis_cache"] = self
+
+    # --- Counters ---
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def record_bypass(self):
+        self._count("bypassed")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["size"] = len(self._entries)
+        lookups = stats["memory_hits"] + stats["near_duplicate_hits"] + stats["db_hits"] + stats["misses"]
+        hits = lookups - stats["misses"]
+        stats["hit_ratio"] = round(hits / lookups, 4) if lookups else 0.0
+        stats["maxsize"] = self.maxsize
+        stats["ttl_seconds"] = self.ttl
+        return stats
+
+    # --- Lookup ---
+    def lookup(self, image_hash, phash=None):
+        """Return a CachedDiagnosis for the image, or None on a miss."""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(image_hash)
+            if entry is None and phash and self.phash_distance > 0:
+                entry = self._nearest(phash)
+                if entry is not None:
+                    self._counters["near_duplicate_hits"] += 1
+                    return CachedDiagnosis(entry.image_hash, entry.phash, entry.result,
+                                           entry.model_name, source="near_duplicate")
+            if entry is not None:
+                self._counters["memory_hits"] += 1
+                return entry
+
+        entry = self._lookup_db(image_hash)
+        if entry is not None:
+            self._count("db_hits")
+            self._remember(entry)
+            return CachedDiagnosis(entry.image_hash, entry.phash, entry.result,
+                                   entry.model_name, source="database")
+
+        self._count("misses")
+        return None
+
+    def _nearest(self, phash):
+        # Caller holds the lock; the hot tier is bounded so a linear scan is cheap
+        best, best_distance = None, self.phash_distance + 1
+        for entry in self._entries.values():
+            if not entry.phash:
+                continue
+            distance = hamming(phash, entry.phash)
+            if distance < best_distance:
+                best, best_distance = entry, distance
+                if distance == 0:
+                    break
+        return best
+
+    def _lookup_db(self, image_hash):
+        from app.models.ai_diagnosis_model import AIDiagnosis, _utcnow
+
+        cutoff = _utcnow() - timedelta(seconds=self.ttl)
+        row = (
+            AIDiagnosis.query
+            .filter(AIDiagnosis.image_hash == image_hash, AIDiagnosis.created_at >= cutoff)
+            .order_by(AIDiagnosis.created_at.desc())
+            .first()
+        )
+        if row is None:
+            return None
+        return CachedDiagnosis(row.image_hash, row.phash, row.result, row.model_name)
+
+    # --- Store ---
+    def _remember(self, entry):
+        with self._lock:
+            self._entries[entry.image_hash] = entry
+
+    def store(self, image_hash, result, model_name=None, phash=None, user_id=None, image_id=None):
+        """
+        Record a fresh diagnosis. The hot tier is updated immediately; the
+        ``ai_diagnoses`` row is written behind by the history log.
+        """
+        from app.services.history_log import history_log
+
+        self._remember(CachedDiagnosis(image_hash, phash, result, model_name))
+        self._count("stores")
+        history_log.log_diagnosis(
+            image_hash,
+            result,
+            model_name=model_name,
+            phash=phash,
+            user_id=user_id,
+            image_id=image_id,
+        )
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def cache_bypass_requested(headers) -> bool:
+    """Clients can force a fresh diagnosis with X-Cache-Bypass or Cache-Control: no-cache."""
+    if headers.get("X-Cache-Bypass", "").strip().lower() in ("1", "true", "yes"):
+        return True
+    return "no-cache" in headers.get("Cache-Control", "").lower()
+
+
+diagnosis_cache = DiagnosisCache()
@@ -0,0 +1,438 @@
+import hashlib
+import os
+import random
+import threading
+import time
+
+from app.services.metrics import (
+    GEMINI_CALL_SECONDS,
+    GEMINI_FIRST_CHUNK_SECONDS,
+    GEMINI_REQUEST_BYTES,
+    GEMINI_RESPONSE_BYTES,
+    payload_size,
+)
+
+
+class GatewayError(Exception):
+    """Upstream model call failed; ``status_code`` is what the route should return."""
+    status_code = 502
+    retry_after = None
+
+
+class UpstreamTimeout(GatewayError):
+    status_code = 504
+
+
+class CallAbandoned(GatewayError):
+    """The caller's ``cancel`` flag was set before the call got an answer (e.g. a hedge lost the race)."""
+    status_code = 503
+
+
+class CircuitOpenError(GatewayError):
+    status_code = 503
+
+    def __init__(self, model_name, retry_after):
+        super().__init__(f"{model_name} is temporarily unavailable, please retry shortly.")
+        self.retry_after = max(1, int(retry_after))
+
+
+def response_text(response):
+    """Extract text from a Gemini response (or stream chunk) without raising."""
+    try:
+        text = getattr(response, "text", None)
+    except ValueError:
+        # Raised by the SDK for chunks with no text parts (e.g. safety stops)
+        text = None
+    if not text and getattr(response, "candidates", None):
+        try:
+            text = response.candidates[0].content.parts[0].text
+        except (IndexError, AttributeError):
+            text = None
+    return text
+
+
+def _retryable_errors():
+    from google.api_core import exceptions as gexc
+
+    return (
+        gexc.ServiceUnavailable,
+        gexc.DeadlineExceeded,
+        gexc.InternalServerError,
+        gexc.TooManyRequests,
+        gexc.ResourceExhausted,
+        ConnectionError,
+        TimeoutError,
+    )
+
+
+def _is_timeout(error):
+    from google.api_core import exceptions as gexc
+
+    return isinstance(error, (gexc.DeadlineExceeded, TimeoutError))
+
+
+def request_key(model_name, contents):
+    """Stable digest of a model call, used to coalesce identical in-flight requests."""
+    digest = hashlib.sha256(model_name.encode())
+
+    def feed(part):
+        if isinstance(part, bytes):
+            digest.update(b"b")
+            digest.update(hashlib.sha256(part).digest())
+        elif isinstance(part, str):
+            digest.update(b"s")
+            digest.update(part.encode())
+        elif isinstance(part, dict):
+            for key in sorted(part):
+                digest.update(b"k")
+                digest.update(str(key).encode())
+                feed(part[key])
+        elif isinstance(part, (list, tuple)):
+            digest.update(b"l")
+            for item in part:
+                feed(item)
+        else:
+            digest.update(repr(part).encode())
+
+    feed(contents)
+    return digest.hexdigest()
+
+
+class CircuitBreaker:
+    """
+    Classic closed → open → half-open breaker. After ``threshold`` consecutive
+    failed calls (a call that succeeds on a retry is not a failure) calls fail
+    fast for ``reset_timeout`` seconds, then a single probe call is let
+    through to decide whether to close again.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return 0 if the call may proceed, otherwise seconds until the next probe."""
+        with self._lock:
+            if self.state == "closed":
+                return 0
+            elapsed = time.monotonic() - self.opened_at
+            if self.state == "open" and elapsed >= self.reset_timeout:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return 0
+            return max(self.reset_timeout - elapsed, 1)
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def release(self):
+        """Drop a half-open probe that ended without an upstream verdict."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == "half_open" or self.failures >= self.threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class GeminiGateway:
+    """
+    Shared Gemini client for every route: warm model instances per model name,
+    singleflight coalescing of identical in-flight calls, a per-call deadline
+    spanning all attempts, jittered exponential retries and a circuit breaker
+    per model.
+    """
+
+    def __init__(self, app=None):
+        self.timeout = 30.0
+        self.max_retries = 2
+        self.retry_base_delay = 0.5
+        self.retry_max_delay = 4.0
+        self.breaker_threshold = 5
+        self.breaker_reset = 30.0
+        self.api_key = None
+        self.transport = None
+        self._genai = None
+        self._pid = None
+        self._models = {}
+        self._breakers = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._init_lock = threading.Lock()
+        self._counters = {
+            "requests": 0,
+            "upstream_calls": 0,
+            "coalesced": 0,
+            "retries": 0,
+            "timeouts": 0,
+            "failures": 0,
+            "short_circuited": 0,
+            "abandoned": 0,
+        }
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.timeout = app.config.get("GEMINI_TIMEOUT", self.timeout)
+        self.max_retries = app.config.get("GEMINI_MAX_RETRIES", self.max_retries)
+        self.retry_base_delay = app.config.get("GEMINI_RETRY_BASE_DELAY", self.retry_base_delay)
+        self.breaker_threshold = app.config.get("GEMINI_BREAKER_THRESHOLD", self.breaker_threshold)
+        self.breaker_reset = app.config.get("GEMINI_BREAKER_RESET", self.breaker_reset)
+        self.api_key = app.config.get("GEMINI_API_KEY")
+        self.transport = app.config.get("GEMINI_TRANSPORT")
+        app.extensions["gemini_gateway"] = self
+
+    # --- Warm instances ---
+    def sdk(self):
+        """
+        Import and configure google.generativeai on first use. The SDK (and its
+        gRPC channels) is heavy and not fork-safe, so it is loaded lazily in
+        each worker process instead of at app import time.
+        """
+        if self._genai is None or self._pid != os.getpid():
+            with self._init_lock:
+                if self._genai is None or self._pid != os.getpid():
+                    import google.generativeai as genai
+
+                    genai.configure(api_key=self.api_key, transport=self.transport)
+                    with self._lock:
+                        self._models.clear()
+                    self._genai = genai
+                    self._pid = os.getpid()
+        return self._genai
+
+    def model(self, model_name):
+        genai = self.sdk()
+        with self._lock:
+            model = self._models.get(model_name)
+            if model is None:
+                model = self._models[model_name] = genai.GenerativeModel(model_name)
+            return model
+
+    def breaker(self, model_name):
+        with self._lock:
+            breaker = self._breakers.get(model_name)
+            if breaker is None:
+                breaker = self._breakers[model_name] = CircuitBreaker(
+                    self.breaker_threshold, self.breaker_reset
+                )
+            return breaker
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["in_flight"] = len(self._inflight)
+            stats["breakers"] = {
+                name: {"state": b.state, "failures": b.failures}
+                for name, b in self._breakers.items()
+            }
+        return stats
+
+    # --- Blocking generation ---
+    def generate(self, model_name, contents, timeout=None, cancel=None):
+        """
+        Return the response text for ``contents``. Identical concurrent calls
+        share one upstream request; followers wait on the leader's result.
+
+        ``cancel`` is a ``threading.Event``: once set, no further attempt is
+        started and the call raises CallAbandoned if its current attempt
+        fails. Such calls are not coalesced, so abandoning one never fails
+        another request.
+        """
+        timeout = timeout or self.timeout
+        self._count("requests")
+        if cancel is not None:
+            return self._call_with_retries(model_name, contents, timeout, cancel)
+        key = request_key(model_name, contents)
+
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+
+        if not leader:
+            self._count("coalesced")
+            if not flight.done.wait(timeout):
+                self._count("timeouts")
+                raise UpstreamTimeout(f"{model_name} did not answer within {timeout:.0f}s")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._call_with_retries(model_name, contents, timeout)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    def _call_with_retries(self, model_name, contents, timeout, cancel=None):
+        breaker = self.breaker(model_name)
+        retryable = _retryable_errors()
+        deadline = time.monotonic() + timeout
+        attempt = 0
+
+        # Checked once per call: retries belong to the call (and to its probe when half-open)
+        wait = breaker.allow()
+        if wait:
+            self._count("short_circuited")
+            raise CircuitOpenError(model_name, wait)
+
+        while True:
+            if cancel is not None and cancel.is_set():
+                # Nothing learned about upstream health from an abandoned call
+                breaker.release()
+                self._count("abandoned")
+                raise CallAbandoned(f"{model_name} call abandoned")
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                breaker.record_failure()
+                self._count("timeouts")
+                raise UpstreamTimeout(f"{model_name} did not answer within {timeout:.0f}s")
+
+            self._count("upstream_calls")
+            started = time.perf_counter()
+            try:
+                response = self.model(model_name).generate_content(
+                    contents,
+                    request_options={"timeout": remaining, "retry": None},
+                )
+            except retryable as e:
+                GEMINI_CALL_SECONDS.observe(time.perf_counter() - started, model_name, "blocking",
+                                            "timeout" if _is_timeout(e) else "error")
+                attempt += 1
+                delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** (attempt - 1)))
+                if attempt > self.max_retries or time.monotonic() + delay >= deadline:
+                    # One failure per call, once its retries are used up
+                    breaker.record_failure()
+                    self._count("failures")
+                    if _is_timeout(e):
+                        self._count("timeouts")
+                        raise UpstreamTimeout(f"{model_name} timed out: {e}") from e
+                    raise GatewayError(f"{model_name} failed: {e}") from e
+                self._count("retries")
+                if cancel is not None:
+                    cancel.wait(delay)
+                else:
+                    time.sleep(delay)
+                continue
+            except Exception as e:
+                GEMINI_CALL_SECONDS.observe(time.perf_counter() - started, model_name, "blocking", "rejected")
+                # Request-level errors (bad input, auth) say nothing about upstream health
+                breaker.release()
+                self._count("failures")
+                raise GatewayError(f"{model_name} rejected the request: {e}") from e
+
+            breaker.record_success()
+            text = response_text(response)
+            GEMINI_CALL_SECONDS.observe(time.perf_counter() - started, model_name, "blocking", "ok")
+            GEMINI_REQUEST_BYTES.observe(payload_size(contents), model_name)
+            GEMINI_RESPONSE_BYTES.observe(len(text.encode()) if text else 0, model_name)
+            return text
+
+    # --- Streaming generation ---
+    def stream(self, model_name, contents, timeout=None):
+        """
+        Yield text chunks as they arrive. Streams are never coalesced or retried
+        (chunks may already be on the wire), but they respect the breaker and
+        deadline, and closing the generator cancels the upstream call.
+        """
+        timeout = timeout or self.timeout
+        breaker = self.breaker(model_name)
+        self._count("requests")
+
+        wait = breaker.allow()
+        if wait:
+            self._count("short_circuited")
+            raise CircuitOpenError(model_name, wait)
+
+        self._count("upstream_calls")
+        GEMINI_REQUEST_BYTES.observe(payload_size(contents), model_name)
+        completed = False
+        response = None
+        started = time.perf_counter()
+        received = 0
+        try:
+            response = self.model(model_name).generate_content(
+                contents,
+                stream=True,
+                request_options={"timeout": timeout, "retry": None},
+            )
+            for chunk in response:
+                text = response_text(chunk)
+                if text:
+                    if not received:
+                        GEMINI_FIRST_CHUNK_SECONDS.observe(time.perf_counter() - started, model_name)
+                    received += len(text.encode())
+                    yield text
+            completed = True
+            breaker.record_success()
+            GEMINI_CALL_SECONDS.observe(time.perf_counter() - started, model_name, "stream", "ok")
+            GEMINI_RESPONSE_BYTES.observe(received, model_name)
+        except GeneratorExit:
+            GEMINI_CALL_SECONDS.observe(time.perf_counter() - started, model_name, "stream", "cancelled")
+            breaker.release()
+            raise
+        except _retryable_errors() as e:
+            GEMINI_CALL_SECONDS.observe(time.perf_counter() - started, model_name, "stream",
+                                        "timeout" if _is_timeout(e) else "error")
+            breaker.record_failure()
+            self._count("failures")
+            if _is_timeout(e):
+                self._count("timeouts")
+                raise UpstreamTimeout(f"{model_name} timed out: {e}") from e
+            raise GatewayError(f"{model_name} failed: {e}") from e
+        except Exception as e:
+            GEMINI_CALL_SECONDS.observe(time.perf_counter() - started, model_name, "stream", "rejected")
+            # Request-level errors (bad input, auth) say nothing about upstream health
+            breaker.release()
+            self._count("failures")
+            raise GatewayError(f"{model_name} rejected the request: {e}") from e
+        finally:
+            if not completed and response is not None:
+                _cancel_stream(response)
+
+
+def _cancel_stream(response):
+    """Best-effort cancel of the underlying gRPC stream."""
+    cancel = getattr(getattr(response, "_iterator", None), "cancel", None)
+    if callable(cancel):
+        try:
+            cancel()
+        except Exception:
+            pass
+
+
+gemini_gateway = GeminiGateway()
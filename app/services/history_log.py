@@ -0,0 +1,293 @@
+import atexit
+import os
+import threading
+from collections import deque
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import DBAPIError, DisconnectionError, InterfaceError, OperationalError
+
+from app import db
+from app.models.ai_diagnosis_model import AIDiagnosis, _utcnow
+from app.models.chat_log_model import ChatLog
+from app.models.conversation_model import Conversation
+from app.services.metrics import HISTORY_DROPPED_ROWS
+
+
+def _is_transient(error):
+    """Connection trouble (worth retrying the whole batch) rather than a row the database rejects."""
+    if isinstance(error, (OperationalError, InterfaceError, DisconnectionError)):
+        return True
+    return isinstance(error, DBAPIError) and error.connection_invalidated
+
+
+def _count_turns(conn, rows):
+    """Add each conversation's newly logged turns to its ``turn_count``, creating the row on its first turn."""
+    counts = {}
+    for row in rows:
+        key = (row["id"], row["user_id"])
+        count, _ = counts.get(key, (0, None))
+        counts[key] = (count + 1, row["updated_at"])
+
+    for (conversation_id, user_id), (count, updated_at) in counts.items():
+        updated = conn.execute(
+            update(Conversation)
+            .where(Conversation.id == conversation_id, Conversation.user_id == user_id)
+            .values(turn_count=Conversation.turn_count + count, updated_at=updated_at)
+        ).rowcount
+        if updated:
+            continue
+        if conn.execute(select(Conversation.id).where(Conversation.id == conversation_id)).first():
+            continue  # A client-chosen id that belongs to someone else; nothing to count
+        conn.execute(insert(Conversation).values(
+            id=conversation_id, user_id=user_id, summary="", summarized_turns=0,
+            turn_count=count, created_at=updated_at, updated_at=updated_at,
+        ))
+
+
+class HistoryLog:
+    """
+    Write-behind log for chat turns and diagnoses.
+
+    Requests only append a row to an in-memory buffer; a background thread
+    per process writes the buffer with one multi-row INSERT per table every
+    ``HISTORY_FLUSH_INTERVAL`` seconds, or as soon as ``HISTORY_FLUSH_SIZE``
+    rows are waiting. The buffer is drained when the worker exits. Rows carry
+    the time they were logged, so history order doesn't depend on flushes.
+    A chat turn that belongs to a conversation also bumps that conversation's
+    ``turn_count`` in the same flush, so the count always matches the turns
+    in ``chat_logs``.
+
+    The buffer is bounded by ``HISTORY_MAX_BUFFER``: if the database is down
+    for long, the oldest rows are dropped rather than growing without limit.
+    If the database rejects the batch itself (say, a foreign key violation),
+    it is rewritten table by table and then row by row, so only the rows
+    that fail on their own are dropped. Drops are logged and counted in
+    ``agroai_history_dropped_rows_total``.
+    ``HISTORY_WRITE_BEHIND=0`` writes each row inline instead.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.write_behind = True
+        self.flush_size = 200
+        self.flush_interval = 1.0
+        self.max_buffer = 10000
+        self.max_attempts = 3
+        self._pending = deque()
+        self._pid = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._failed_attempts = 0
+        self._counters = {"logged": 0, "written": 0, "flushes": 0, "failures": 0, "dropped": 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.write_behind = app.config.get("HISTORY_WRITE_BEHIND", self.write_behind)
+        self.flush_size = app.config.get("HISTORY_FLUSH_SIZE", self.flush_size)
+        self.flush_interval = app.config.get("HISTORY_FLUSH_INTERVAL", self.flush_interval)
+        self.max_buffer = app.config.get("HISTORY_MAX_BUFFER", self.max_buffer)
+        app.extensions["history_log"] = self
+
+    # --- Logging (request path) ---
+    def log_chat(self, user_id, response_type, response, source, message=None, model_name=None,
+                 image_hash=None, conversation_id=None):
+        """Buffer a chat turn; returns the ``created_at`` it will be stored with."""
+        created_at = _utcnow()
+        rows = [(ChatLog, {
+            "user_id": user_id,
+            "type": response_type,
+            "message": message,
+            "response": response,
+            "source": source,
+            "model_name": model_name,
+            "image_hash": image_hash,
+            "conversation_id": conversation_id,
+            "created_at": created_at,
+        })]
+        if conversation_id:
+            rows.append((Conversation, {"id": conversation_id, "user_id": user_id, "updated_at": created_at}))
+        self._enqueue(*rows)
+        return created_at
+
+    def log_diagnosis(self, image_hash, result, model_name=None, phash=None, user_id=None, image_id=None):
+        self._enqueue((AIDiagnosis, {
+            "image_hash": image_hash,
+            "phash": phash,
+            "result": result,
+            "model_name": model_name,
+            "user_id": user_id,
+            "image_id": image_id,
+            "created_at": _utcnow(),
+        }))
+
+    def _enqueue(self, *rows):
+        """Buffer ``(model, row)`` pairs together, so one flush writes all of them."""
+        with self._lock:
+            evicted = []
+            while self._pending and len(self._pending) + len(rows) > self.max_buffer:
+                evicted.append(self._pending.popleft())
+            self._pending.extend(rows)
+            self._counters["logged"] += len(rows)
+            pending = len(self._pending)
+        if evicted:
+            self._dropped(evicted, "buffer_full")
+
+        if not self.write_behind:
+            self.flush()
+            return
+        self.ensure_writer()
+        if pending >= self.flush_size:
+            self._wakeup.set()
+
+    # --- Writer lifecycle ---
+    def ensure_writer(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Threads don't survive a fork, so each worker process starts its own
+            self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+        atexit.register(self.drain)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ History writer error: {e}")
+
+    def drain(self):
+        """Write everything still buffered (worker shutdown)."""
+        while self.pending():
+            if not self.flush():
+                break
+
+    # --- Flushing ---
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """Write buffered rows now. Returns False if the write failed and rows were kept."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return True
+                batch = list(self._pending)
+                self._pending.clear()
+
+            rows_by_model = {}
+            for model, row in batch:
+                rows_by_model.setdefault(model, []).append(row)
+
+            written = len(batch)
+            try:
+                self._write(rows_by_model)
+            except Exception as e:
+                if _is_transient(e):
+                    self._failed(batch, e)
+                    return False
+                written, retry = self._isolate(rows_by_model)
+                if retry:
+                    self._failed(retry, e)
+                    with self._lock:
+                        self._counters["written"] += written
+                    return False
+
+            with self._lock:
+                self._failed_attempts = 0
+                self._counters["written"] += written
+                self._counters["flushes"] += 1
+            return True
+
+    def _write(self, rows_by_model):
+        # Separate connection, so the caller's session/transaction is never touched
+        with self.app.app_context(), db.engine.begin() as conn:
+            for model, rows in rows_by_model.items():
+                if model is Conversation:
+                    _count_turns(conn, rows)
+                else:
+                    conn.execute(insert(model), rows)
+
+    def _isolate(self, rows_by_model):
+        """
+        Write a batch the database rejected, one table and then one row at a
+        time, dropping only the rows that fail alone. Returns ``(written,
+        retry)``: rows that hit a connection error are handed back for retry.
+        """
+        written, retry = 0, []
+        for model, rows in rows_by_model.items():
+            try:
+                self._write({model: rows})
+                written += len(rows)
+                continue
+            except Exception as e:
+                if _is_transient(e):
+                    retry.extend((model, row) for row in rows)
+                    continue
+            for row in rows:
+                try:
+                    self._write({model: [row]})
+                    written += 1
+                except Exception as e:
+                    if _is_transient(e):
+                        retry.append((model, row))
+                    else:
+                        self._dropped([(model, row)], "rejected", e)
+        return written, retry
+
+    def _failed(self, batch, error):
+        overflow = []
+        with self._lock:
+            self._counters["failures"] += 1
+            self._failed_attempts += 1
+            exhausted = self._failed_attempts >= self.max_attempts
+            if exhausted:
+                # A long outage; don't retry this batch forever
+                self._failed_attempts = 0
+            else:
+                room = max(self.max_buffer - len(self._pending), 0)
+                if room < len(batch):
+                    overflow = batch[:len(batch) - room]
+                    batch = batch[len(batch) - room:]
+                self._pending.extendleft(reversed(batch))
+
+        if exhausted:
+            self._dropped(batch, "retries_exhausted", error)
+            return
+        if overflow:
+            self._dropped(overflow, "buffer_full")
+        self.app.logger.warning("History write failed, will retry %d rows: %s", len(batch), error)
+
+    def _dropped(self, batch, reason, error=None):
+        """Count and log rows given up on; ``batch`` is a list of ``(model, row)``."""
+        tables = {}
+        for model, _ in batch:
+            tables[model.__tablename__] = tables.get(model.__tablename__, 0) + 1
+        with self._lock:
+            self._counters["dropped"] += len(batch)
+        for table, count in tables.items():
+            HISTORY_DROPPED_ROWS.inc(table, reason, amount=count)
+        if reason != "buffer_full":
+            # Buffer overflow happens row by row during an outage; the retry warnings already cover it
+            self.app.logger.error("Dropped %d history rows (%s, %s): %s", len(batch), reason,
+                                  ", ".join(f"{table}={count}" for table, count in tables.items()), error)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["pending"] = len(self._pending)
+        stats["write_behind"] = self.write_behind
+        return stats
+
+
+history_log = HistoryLog()
@@ -0,0 +1,48 @@
+import base64
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+from app import db
+
+
+def encode_cursor(row):
+    """Opaque cursor pointing just after ``row`` in newest-first order."""
+    raw = f"{row.created_at.isoformat()}|{row.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Return ``(created_at, id)``; raises ValueError for a malformed cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def history_page(model, user_id, limit, cursor=None, filters=()):
+    """
+    One page of a user's history, newest first, using keyset (seek) pagination.
+
+    Instead of OFFSET, each page continues strictly after the last row of the
+    previous one, ``(created_at, id) < cursor``, which the
+    ``(user_id, created_at, id)`` index answers directly. Page N costs the
+    same as page 1. Extra ``filters`` narrow the page (e.g. one conversation).
+    Returns ``(rows, next_cursor_or_None)``.
+    """
+    query = db.session.query(model).filter(model.user_id == user_id, *filters)
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.filter(tuple_(model.created_at, model.id) < tuple_(created_at, row_id))
+
+    # Fetch one extra row to know whether there is another page
+    rows = (
+        query.order_by(model.created_at.desc(), model.id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1]) if has_more else None
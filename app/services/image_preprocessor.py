@@ -0,0 +1,134 @@
+import io
+import os
+import time
+
+from flask import current_app
+
+from app.services.diagnosis_cache import dhash
+from app.services.metrics import IMAGE_PREPROCESS_SECONDS, IMAGE_UPLOAD_BYTES
+
+# Formats we accept from phones/cameras; anything else is rejected before decoding
+ALLOWED_FORMATS = {"JPEG", "MPO", "PNG", "WEBP", "BMP", "TIFF", "GIF"}
+
+OUTPUT_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+class ImageRejected(Exception):
+    """Upload is not a usable image; ``status_code`` is 400 or 413."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class PreparedImage:
+    __slots__ = ("data", "mime_type", "width", "height", "source_format", "source_bytes", "phash")
+
+    def __init__(self, data, mime_type, width, height, source_format, source_bytes, phash):
+        self.data = data
+        self.mime_type = mime_type
+        self.width = width
+        self.height = height
+        self.source_format = source_format
+        self.source_bytes = source_bytes
+        self.phash = phash
+
+
+def _stream_size(stream):
+    try:
+        position = stream.tell()
+        stream.seek(0, os.SEEK_END)
+        size = stream.tell()
+        stream.seek(position)
+        return size
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def preprocess_image(stream, max_edge=1536, output_format="JPEG", quality=85,
+                     max_bytes=15 * 1024 * 1024, max_pixels=40_000_000):
+    """
+    Decode an upload in memory and return a compact, normalized PreparedImage.
+
+    The real format is sniffed from the bytes (the filename and client
+    content type are ignored), EXIF orientation is applied and all metadata
+    is dropped, and the image is downscaled so its longest edge is at most
+    ``max_edge`` before being re-encoded as JPEG or WebP. The output bytes are
+    deterministic for a given input, so they double as the cache key.
+    """
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    output_format = output_format.upper()
+    if output_format not in OUTPUT_MIME_TYPES:
+        raise ValueError(f"Unsupported output format: {output_format}")
+
+    size = _stream_size(stream)
+    if size is not None and size > max_bytes:
+        raise ImageRejected(f"Image is too large ({size // 1024} KB, max {max_bytes // 1024} KB)", 413)
+    if size == 0:
+        raise ImageRejected("Empty image upload")
+
+    try:
+        img = Image.open(stream)
+    except Image.DecompressionBombError:
+        # Pillow refuses absurd dimensions in open(), before our own max_pixels check
+        raise ImageRejected("Image dimensions too large", 413)
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+        # Truncated or malformed PNG/GIF/WebP headers raise SyntaxError/ValueError rather than OSError
+        raise ImageRejected("Uploaded file is not a recognised image")
+
+    with img:
+        source_format = img.format
+        if source_format not in ALLOWED_FORMATS:
+            raise ImageRejected(f"Unsupported image format: {source_format}")
+        if img.width * img.height > max_pixels:
+            raise ImageRejected(f"Image dimensions too large ({img.width}x{img.height})", 413)
+
+        # Let the JPEG decoder downscale by a power of two while decoding (much cheaper)
+        if source_format in ("JPEG", "MPO"):
+            img.draft("RGB", (max_edge, max_edge))
+
+        try:
+            img = ImageOps.exif_transpose(img)
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+            raise ImageRejected(f"Could not decode image: {e}")
+
+        out = io.BytesIO()
+        if output_format == "WEBP":
+            img.save(out, "WEBP", quality=quality, method=4)
+        else:
+            img.save(out, "JPEG", quality=quality, progressive=False)
+
+        return PreparedImage(
+            data=out.getvalue(),
+            mime_type=OUTPUT_MIME_TYPES[output_format],
+            width=img.width,
+            height=img.height,
+            source_format=source_format,
+            source_bytes=size,
+            phash=dhash(img),
+        )
+
+
+def preprocess_upload(file_storage):
+    """Run ``preprocess_image`` on a werkzeug upload using the app's IMAGE_* config."""
+    config = current_app.config
+    started = time.perf_counter()
+    try:
+        prepared = preprocess_image(
+            file_storage.stream,
+            max_edge=config.get("IMAGE_MAX_EDGE", 1536),
+            output_format=config.get("IMAGE_OUTPUT_FORMAT", "JPEG"),
+            quality=config.get("IMAGE_QUALITY", 85),
+            max_bytes=config.get("IMAGE_MAX_UPLOAD_BYTES", 15 * 1024 * 1024),
+            max_pixels=config.get("IMAGE_MAX_PIXELS", 40_000_000),
+        )
+    except ImageRejected:
+        IMAGE_PREPROCESS_SECONDS.observe(time.perf_counter() - started, "rejected")
+        raise
+    IMAGE_PREPROCESS_SECONDS.observe(time.perf_counter() - started, "ok")
+    IMAGE_UPLOAD_BYTES.observe(prepared.source_bytes)
+    return prepared
@@ -0,0 +1,438 @@
+import errno
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+from sqlalchemy import delete, select, update
+from werkzeug.utils import secure_filename
+
+from app import db
+
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_chunks(data, chunk_size=CHUNK_SIZE):
+    """Yield ``data`` (bytes or a binary stream) in bounded chunks without copying it whole."""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        view = memoryview(data)
+        for start in range(0, len(view), chunk_size):
+            yield view[start:start + chunk_size]
+        return
+    while True:
+        chunk = data.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+class StoredObject:
+    __slots__ = ("digest", "size", "last_access")
+
+    def __init__(self, digest, size, last_access):
+        self.digest = digest
+        self.size = size
+        self.last_access = last_access
+
+
+class ImageBackend(ABC):
+    """
+    Where image bytes live. Objects are addressed by the SHA-256 of their
+    content; each may have small derived variants (e.g. "thumb").
+
+    Subclass and register with ``register_backend`` to add an object store;
+    ``LocalImageBackend`` is the filesystem implementation.
+    """
+
+    @abstractmethod
+    def put(self, chunks):
+        """Store a stream of chunks; return ``(digest, size, created)`` (created=False when deduplicated)."""
+
+    @abstractmethod
+    def open(self, digest, variant=None):
+        """Binary file object for an object or variant; raises FileNotFoundError."""
+
+    @abstractmethod
+    def exists(self, digest, variant=None):
+        """True if the object (or its variant) is stored."""
+
+    @abstractmethod
+    def put_variant(self, digest, variant, data):
+        """Store derived bytes (e.g. a thumbnail) alongside an object."""
+
+    @abstractmethod
+    def delete(self, digest):
+        """Remove an object and all of its variants; return the bytes freed."""
+
+    @abstractmethod
+    def objects(self):
+        """Iterate StoredObject for every stored original (variants count toward its size)."""
+
+    @abstractmethod
+    def locator(self, digest):
+        """Stable string recorded in UploadedImage.filepath."""
+
+    @contextmanager
+    def exclusive(self):
+        """Cross-process lock for maintenance; yields False if another process holds it."""
+        yield True
+
+
+class LocalImageBackend(ImageBackend):
+    """
+    Filesystem layout ``<root>/ab/cd/<sha256>[.<variant>]``.
+
+    Uploads are streamed to a temp file in ``<root>/tmp`` while being hashed,
+    then atomically renamed into place, so concurrent uploads of the same
+    content converge on one file and readers never see a partial write.
+    Reads refresh the file's mtime, which the garbage collector uses as the
+    last-access time.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def _path(self, digest, variant=None):
+        name = f"{digest}.{variant}" if variant else digest
+        return os.path.join(self.root, digest[:2], digest[2:4], name)
+
+    def put(self, chunks):
+        hasher = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir, prefix="upload-")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                for chunk in chunks:
+                    hasher.update(chunk)
+                    fh.write(chunk)
+                    size += len(chunk)
+
+            digest = hasher.hexdigest()
+            path = self._path(digest)
+            if os.path.exists(path):
+                os.utime(path)
+                return digest, size, False
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+            tmp_path = None
+            return digest, size, True
+        finally:
+            if tmp_path is not None:
+                try:
+                    os.unlink(tmp_path)
+                except FileNotFoundError:
+                    pass
+
+    def open(self, digest, variant=None):
+        path = self._path(digest, variant)
+        fh = open(path, "rb")
+        try:
+            os.utime(self._path(digest))
+        except OSError:
+            pass
+        return fh
+
+    def exists(self, digest, variant=None):
+        return os.path.exists(self._path(digest, variant))
+
+    def put_variant(self, digest, variant, data):
+        path = self._path(digest, variant)
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir, prefix=f"{variant}-")
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp_path, path)
+
+    def delete(self, digest):
+        directory = os.path.dirname(self._path(digest))
+        freed = 0
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return 0
+        for name in names:
+            if name.split(".", 1)[0] != digest:
+                continue
+            path = os.path.join(directory, name)
+            try:
+                freed += os.path.getsize(path)
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        return freed
+
+    def objects(self):
+        for prefix in os.scandir(self.root):
+            if not prefix.is_dir() or len(prefix.name) != 2:
+                continue
+            for sub in os.scandir(prefix.path):
+                if not sub.is_dir():
+                    continue
+                sizes, access = {}, {}
+                for entry in os.scandir(sub.path):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    digest = entry.name.split(".", 1)[0]
+                    sizes[digest] = sizes.get(digest, 0) + stat.st_size
+                    if "." not in entry.name:
+                        access[digest] = stat.st_mtime
+                for digest, size in sizes.items():
+                    # Variants whose original is gone are reported as never accessed
+                    yield StoredObject(digest, size, access.get(digest, 0.0))
+
+    def locator(self, digest):
+        return f"local:{digest[:2]}/{digest[2:4]}/{digest}"
+
+    @contextmanager
+    def exclusive(self):
+        import fcntl
+
+        with open(os.path.join(self.root, ".gc.lock"), "a") as fh:
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def clean_tmp(self, older_than):
+        """Remove temp files left by crashed writers."""
+        cutoff = time.time() - older_than
+        for entry in os.scandir(self.tmp_dir):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+BACKENDS = {
+    "local": lambda app: LocalImageBackend(app.config["IMAGE_STORE_ROOT"]),
+}
+
+
+def register_backend(name, factory):
+    """Make ``IMAGE_STORE_BACKEND=<name>`` build its backend with ``factory(app)``."""
+    BACKENDS[name] = factory
+
+
+class ImageStore:
+    """
+    Content-addressed storage for uploaded leaf images.
+
+    Each upload is streamed to the backend in ``CHUNK_SIZE`` pieces, so
+    identical images are stored once, and an ``UploadedImage`` row records
+    who uploaded what and where it lives. Thumbnails are made on first
+    request. A background collector per process (one at a time across
+    processes) removes blobs no row references and, above
+    ``IMAGE_STORE_QUOTA_BYTES``, evicts the least recently accessed images
+    until usage is back under ``IMAGE_STORE_GC_TARGET`` of the quota. An
+    evicted image's ``UploadedImage`` rows are deleted before its blob (their
+    diagnoses are kept, detached), so no row points at missing bytes.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.backend = None
+        self.enabled = True
+        self.quota = 5 * 1024 ** 3
+        self.gc_target = 0.9
+        self.gc_interval = 300
+        self.orphan_grace = 3600
+        self.thumbnail_size = 256
+        self._pid = None
+        self._lock = threading.Lock()
+        self._counters = {"stored": 0, "deduplicated": 0, "thumbnails": 0, "gc_runs": 0, "evicted": 0,
+                          "evicted_rows": 0, "orphans": 0}
+        self._last_gc = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get("IMAGE_STORE_ENABLED", self.enabled)
+        self.quota = app.config.get("IMAGE_STORE_QUOTA_BYTES", self.quota)
+        self.gc_target = app.config.get("IMAGE_STORE_GC_TARGET", self.gc_target)
+        self.gc_interval = app.config.get("IMAGE_STORE_GC_INTERVAL", self.gc_interval)
+        self.orphan_grace = app.config.get("IMAGE_STORE_ORPHAN_GRACE", self.orphan_grace)
+        self.thumbnail_size = app.config.get("IMAGE_THUMBNAIL_SIZE", self.thumbnail_size)
+        if self.enabled:
+            name = app.config.get("IMAGE_STORE_BACKEND", "local")
+            if name not in BACKENDS:
+                raise RuntimeError(f"Unknown IMAGE_STORE_BACKEND: {name}")
+            self.backend = BACKENDS[name](app)
+        app.extensions["image_store"] = self
+
+    # --- Writes ---
+    def save_upload(self, user_id, filename, prepared):
+        """
+        Store a preprocessed upload, record it in ``uploaded_images`` and
+        return the row id (None when storage is disabled).
+        """
+        from app.models.uploaded_image_model import UploadedImage
+
+        if not self.enabled:
+            return None
+
+        digest, size, created = self.backend.put(iter_chunks(prepared.data))
+        self._count("stored" if created else "deduplicated")
+        self.ensure_collector()
+
+        image = UploadedImage(
+            filename=(secure_filename(filename or "") or "upload")[:255],
+            filepath=self.backend.locator(digest),
+            content_hash=digest,
+            size_bytes=size,
+            mime_type=prepared.mime_type,
+            user_id=user_id,
+        )
+        db.session.add(image)
+        db.session.flush()
+        image_id = image.id
+        db.session.commit()
+        return image_id
+
+    # --- Reads ---
+    def open(self, digest):
+        return self.backend.open(digest)
+
+    def thumbnail(self, digest):
+        """Open the JPEG thumbnail, generating it from the original on first use."""
+        if not self.backend.exists(digest, "thumb"):
+            from PIL import Image
+
+            with self.backend.open(digest) as fh, Image.open(fh) as img:
+                img.draft("RGB", (self.thumbnail_size, self.thumbnail_size))
+                img = img.convert("RGB")
+                img.thumbnail((self.thumbnail_size, self.thumbnail_size))
+                out = io.BytesIO()
+                img.save(out, "JPEG", quality=80)
+            self.backend.put_variant(digest, "thumb", out.getvalue())
+            self._count("thumbnails")
+        return self.backend.open(digest, "thumb")
+
+    # --- Garbage collection ---
+    def ensure_collector(self):
+        if self._pid == os.getpid() or self.gc_interval <= 0:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Threads don't survive a fork, so each worker process starts its own
+            threading.Thread(target=self._run_collector, name="image-gc", daemon=True).start()
+            self._pid = os.getpid()
+
+    def _run_collector(self):
+        while True:
+            time.sleep(self.gc_interval)
+            try:
+                with self.app.app_context():
+                    self.collect()
+            except Exception as e:
+                print(f"❌ Image GC error: {e}")
+
+    def collect(self):
+        """One GC pass; returns a summary dict (``skipped`` if another process is collecting)."""
+        from app.models.uploaded_image_model import UploadedImage
+
+        with self.backend.exclusive() as acquired:
+            if not acquired:
+                return {"skipped": True}
+
+            started = time.monotonic()
+            if hasattr(self.backend, "clean_tmp"):
+                self.backend.clean_tmp(self.orphan_grace)
+
+            objects = list(self.backend.objects())
+            usage = sum(obj.size for obj in objects)
+            orphans = evicted = evicted_rows = freed = 0
+
+            # Blobs no row points at (e.g. the request died before commit)
+            cutoff = time.time() - self.orphan_grace
+            live = []
+            for start in range(0, len(objects), 500):
+                batch = objects[start:start + 500]
+                referenced = {
+                    digest for (digest,) in db.session.query(UploadedImage.content_hash)
+                    .filter(UploadedImage.content_hash.in_([obj.digest for obj in batch]))
+                    .distinct()
+                }
+                for obj in batch:
+                    if obj.digest not in referenced and obj.last_access < cutoff:
+                        freed += self.backend.delete(obj.digest)
+                        orphans += 1
+                    else:
+                        live.append(obj)
+            db.session.rollback()
+            usage -= freed
+
+            # Over quota: evict least recently accessed until under the target
+            if usage > self.quota:
+                target = self.quota * self.gc_target
+                for obj in sorted(live, key=lambda o: o.last_access):
+                    if usage <= target:
+                        break
+                    evicted_rows += self._forget(obj.digest)
+                    released = self.backend.delete(obj.digest)
+                    usage -= released
+                    freed += released
+                    evicted += 1
+
+            summary = {
+                "objects": len(objects) - orphans - evicted,
+                "usage_bytes": usage,
+                "quota_bytes": self.quota,
+                "orphans_removed": orphans,
+                "evicted": evicted,
+                "evicted_rows": evicted_rows,
+                "freed_bytes": freed,
+                "duration_ms": round((time.monotonic() - started) * 1000, 1),
+            }
+        with self._lock:
+            self._counters["gc_runs"] += 1
+            self._counters["orphans"] += orphans
+            self._counters["evicted"] += evicted
+            self._counters["evicted_rows"] += evicted_rows
+            self._last_gc = summary
+        if orphans or evicted:
+            print(f"🧹 Image GC freed {freed // 1024} KB ({orphans} orphaned, {evicted} evicted)")
+        return summary
+
+    def _forget(self, digest):
+        """Delete the rows that reference ``digest``, detaching their diagnoses; returns rows deleted."""
+        from app.models.ai_diagnosis_model import AIDiagnosis
+        from app.models.uploaded_image_model import UploadedImage
+
+        rows = select(UploadedImage.id).where(UploadedImage.content_hash == digest)
+        db.session.execute(update(AIDiagnosis).where(AIDiagnosis.image_id.in_(rows)).values(image_id=None))
+        deleted = db.session.execute(delete(UploadedImage).where(UploadedImage.content_hash == digest)).rowcount
+        db.session.commit()
+        return deleted
+
+    # --- Counters ---
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["last_gc"] = dict(self._last_gc)
+        stats["enabled"] = self.enabled
+        return stats
+
+
+image_store = ImageStore()
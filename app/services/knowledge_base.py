@@ -0,0 +1,329 @@
+import difflib
+import json
+import os
+import re
+import threading
+
+from cachetools import LRUCache
+
+from app import db
+
+SEED_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "disease_info.json")
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "on", "in", "my", "i", "is", "are", "to", "for",
+    "what", "how", "do", "does", "can", "should", "with", "it", "its", "this", "that", "me",
+    "about", "please", "tell", "there", "have", "has", "be", "from", "at", "you", "your",
+    "plant", "plants", "crop", "crops", "disease", "diseases",
+    "help", "need", "advice", "info", "information", "know", "want", "some", "any",
+    "we", "our", "us", "they", "them", "their",
+}
+
+# Local names, plurals and spelling variants folded onto one canonical token
+SYNONYMS = {
+    "corn": "maize", "mahindi": "maize",
+    "tomatoes": "tomato", "nyanya": "tomato",
+    "potatoes": "potato", "viazi": "potato",
+    "muhogo": "cassava", "manioc": "cassava",
+    "bean": "beans", "maharagwe": "beans",
+    "bananas": "banana", "ndizi": "banana",
+    "grey": "gray", "leaves": "leaf", "mould": "mold",
+    "caterpillar": "armyworm", "caterpillars": "armyworm",
+}
+
+# Words that signal what the user wants to know rather than which disease
+INTENTS = {
+    "treatment": {"treat", "treatment", "treating", "cure", "control", "manage", "management",
+                  "remedy", "spray", "fungicide", "pesticide", "insecticide", "kill", "fix", "medicine"},
+    "symptoms": {"symptom", "symptoms", "sign", "signs", "identify", "recognise", "recognize", "look", "like"},
+    "prevention": {"prevent", "prevention", "avoid", "stop", "protect"},
+}
+_INTENT_WORDS = {word: intent for intent, words in INTENTS.items() for word in words}
+
+# Openings that make a question a plain lookup ("what is X", "how to treat X", "symptoms of X")
+LOOKUP_RE = re.compile(
+    r"^\s*(?:"
+    r"what\s+(?:is|are)\s+(?:the\s+)?(?:(?:symptoms?|signs?|treatments?|cures?|remed(?:y|ies)|control)\s+(?:of|for)\s+)?"
+    r"|how\s+(?:do\s+(?:i|you|we)\s+|can\s+(?:i|you|we)\s+|to\s+)?"
+    r"(?:treat|control|manage|cure|prevent|identify|recogni[sz]e|spot|stop|get\s+rid\s+of)\b"
+    r"|(?:symptoms?|signs?|treatments?|cures?|control|prevention)\s+(?:of|for)\b"
+    r")",
+    re.IGNORECASE,
+)
+
+# Words that turn a query into a real question the canned card can't answer
+QUESTION_WORDS = {
+    "can", "could", "should", "would", "will", "shall", "may", "might", "must",
+    "is", "are", "was", "were", "am", "do", "does", "did",
+    "why", "when", "where", "which", "who", "whom", "whose", "what", "how", "else",
+}
+
+
+def is_open_question(query):
+    """
+    True when ``query`` asks something beyond "what is X" / "how to treat X"
+    (e.g. "can I eat…", "is it caused by…", "what else can I do?"); those go
+    to the model even if they name a disease.
+    """
+    query = query or ""
+    lookup = LOOKUP_RE.match(query)
+    rest = query[lookup.end():] if lookup else query
+    words = _TOKEN_RE.findall(rest.lower())
+    if lookup:
+        return any(word in QUESTION_WORDS for word in words)
+    return "?" in query or any(word in QUESTION_WORDS for word in words)
+
+
+# Field weights when building the inverted index
+NAME_WEIGHT = 0.7
+CROP_WEIGHT = 0.3
+SYMPTOM_WEIGHT = 0.02
+SYMPTOM_CAP = 0.1
+
+
+def stem(token):
+    """Very light suffix stripping; enough to fold plurals and -ing/-ed forms."""
+    if len(token) <= 4 or token.isdigit():
+        return token
+    if token.endswith("ies"):
+        return token[:-3] + "y"
+    for suffix in ("ing", "ed", "es", "s"):
+        if token.endswith(suffix) and len(token) - len(suffix) >= 4:
+            return token[: -len(suffix)]
+    return token
+
+
+def tokenize(text):
+    """Lowercase, split, fold synonyms, drop stopwords and stem."""
+    tokens = []
+    for raw in _TOKEN_RE.findall((text or "").lower()):
+        raw = SYNONYMS.get(raw, raw)
+        if raw in STOPWORDS:
+            continue
+        tokens.append(stem(raw))
+    return tokens
+
+
+class _Entry:
+    __slots__ = ("crop", "disease", "symptoms", "treatment", "prevention", "crop_tokens", "names",
+                 "symptom_tokens", "vocabulary")
+
+    def __init__(self, crop, disease, aliases, symptoms, treatment, prevention):
+        self.crop = crop
+        self.disease = disease
+        self.symptoms = symptoms
+        self.treatment = treatment
+        self.prevention = prevention
+        self.crop_tokens = frozenset(tokenize(crop))
+        names = [disease] + [a for a in (aliases or "").split(",") if a.strip()]
+        # Crop words inside a disease name ("Cassava Mosaic Disease") count as crop, not name
+        self.names = [
+            frozenset(t for t in tokenize(name) if t not in self.crop_tokens) or frozenset(tokenize(name))
+            for name in names
+        ]
+        self.symptom_tokens = frozenset(tokenize(symptoms))
+        self.vocabulary = self.crop_tokens.union(self.symptom_tokens, *self.names)
+
+
+class KnowledgeBase:
+    """
+    In-memory inverted index over ``DiseaseInfo`` rows for answering common
+    disease questions ("maize leaf blight treatment") without calling the LLM.
+
+    Queries are normalized (synonyms, stopwords, light stemming), unknown
+    words are fuzzily corrected against the index vocabulary, and candidates
+    are scored by how completely they match a disease name/alias plus the
+    crop, discounted by the share of query words the entry doesn't cover.
+    Only confident, unambiguous lookups are answered locally; real questions
+    (``is_open_question``) and anything else return None so the caller can
+    fall back to Gemini.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.min_confidence = 0.85
+        self.fuzzy_cutoff = 0.7
+        self._entries = []
+        self._index = {}
+        self._vocabulary = []
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._answers = LRUCache(maxsize=2048)
+        self._corrections = LRUCache(maxsize=4096)
+        self._cache_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get("KB_ENABLED", True)
+        self.min_confidence = app.config.get("KB_MIN_CONFIDENCE", self.min_confidence)
+        self.fuzzy_cutoff = app.config.get("KB_FUZZY_CUTOFF", self.fuzzy_cutoff)
+        app.extensions["knowledge_base"] = self
+
+    # --- Loading ---
+    def ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if not self._loaded:
+                self._build(self._load_records())
+                self._loaded = True
+
+    def reload(self):
+        with self._lock:
+            self._build(self._load_records())
+            self._loaded = True
+
+    def _load_records(self):
+        from app.models.disease_info_model import DiseaseInfo
+
+        try:
+            rows = DiseaseInfo.query.all()
+        except Exception as e:
+            db.session.rollback()
+            print(f"⚠️ Could not load disease_info table, using bundled data: {e}")
+            rows = []
+        if rows:
+            return [row.to_dict() for row in rows]
+        return load_seed_records()
+
+    def _build(self, records):
+        entries = [
+            _Entry(r["crop"], r["disease"], r.get("aliases"), r["symptoms"], r["treatment"], r.get("prevention"))
+            for r in records
+        ]
+        index = {}
+        for doc_id, entry in enumerate(entries):
+            tokens = set(entry.crop_tokens) | entry.symptom_tokens
+            for name in entry.names:
+                tokens |= name
+            for token in tokens:
+                index.setdefault(token, set()).add(doc_id)
+
+        self._entries = entries
+        self._index = index
+        self._vocabulary = sorted(index)
+        with self._cache_lock:
+            self._answers.clear()
+            self._corrections.clear()
+
+    # --- Querying ---
+    def _correct(self, token):
+        if token in self._index or len(token) < 4 or token.isdigit():
+            return token
+        with self._cache_lock:
+            corrected = self._corrections.get(token)
+        if corrected is None:
+            matches = difflib.get_close_matches(token, self._vocabulary, n=1, cutoff=self.fuzzy_cutoff)
+            corrected = matches[0] if matches else token
+            with self._cache_lock:
+                self._corrections[token] = corrected
+        return corrected
+
+    def search(self, query, limit=3):
+        """Return ``(intent, [(score, entry), ...])`` best first."""
+        self.ensure_loaded()
+
+        intent = None
+        terms = set()
+        for raw in _TOKEN_RE.findall((query or "").lower()):
+            if raw in _INTENT_WORDS:
+                intent = intent or _INTENT_WORDS[raw]
+                continue
+            for token in tokenize(raw):
+                terms.add(self._correct(token))
+
+        candidates = set()
+        for term in terms:
+            candidates |= self._index.get(term, set())
+
+        scored = []
+        for doc_id in candidates:
+            entry = self._entries[doc_id]
+            name_cover = max((len(name & terms) / len(name) for name in entry.names if name), default=0.0)
+            if name_cover == 0:
+                continue
+            score = NAME_WEIGHT * name_cover
+            if entry.crop_tokens & terms:
+                score += CROP_WEIGHT
+            score += min(SYMPTOM_WEIGHT * len(entry.symptom_tokens & terms), SYMPTOM_CAP)
+            # Words the entry knows nothing about ("eat", "cows", "fungus") mean a different question
+            score *= 1 - len(terms - entry.vocabulary) / len(terms)
+            scored.append((round(score, 4), entry))
+
+        scored.sort(key=lambda pair: pair[0], reverse=True)
+        return intent, scored[:limit]
+
+    def answer(self, query):
+        """Return ``(text, entry, confidence)`` for a confident match, else None."""
+        if not self.enabled or not query or is_open_question(query):
+            return None
+
+        key = " ".join(_TOKEN_RE.findall(query.lower()))
+        with self._cache_lock:
+            if key in self._answers:
+                return self._answers[key]
+
+        intent, results = self.search(query, limit=2)
+        result = None
+        if results:
+            best_score, best = results[0]
+            runner_up = results[1][0] if len(results) > 1 else 0.0
+            margin = best_score - runner_up
+            # Confident: full name + crop, or a full name no other entry fully matches
+            if (best_score >= self.min_confidence and margin >= 0.1) or \
+                    (best_score >= NAME_WEIGHT and runner_up < NAME_WEIGHT):
+                result = (format_answer(best, intent), best, best_score)
+
+        with self._cache_lock:
+            self._answers[key] = result
+        return result
+
+
+def format_answer(entry, intent=None):
+    title = f"{entry.crop} — {entry.disease}"
+    sections = {
+        "symptoms": ("Symptoms", entry.symptoms),
+        "treatment": ("Treatment", entry.treatment),
+        "prevention": ("Prevention", entry.prevention),
+    }
+    if intent == "treatment":
+        order = ["treatment", "prevention"]
+    elif intent == "symptoms":
+        order = ["symptoms"]
+    elif intent == "prevention":
+        order = ["prevention"]
+    else:
+        order = ["symptoms", "treatment", "prevention"]
+
+    lines = [title]
+    for key in order:
+        label, text = sections[key]
+        if text:
+            lines.append(f"{label}: {text}")
+    return "\n\n".join(lines)
+
+
+def load_seed_records():
+    with open(SEED_PATH, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def seed_disease_info():
+    """Insert bundled disease records that aren't in the table yet. Returns the number added."""
+    from app.models.disease_info_model import DiseaseInfo
+
+    existing = {(row.crop.lower(), row.disease.lower()) for row in DiseaseInfo.query.all()}
+    added = 0
+    for record in load_seed_records():
+        if (record["crop"].lower(), record["disease"].lower()) in existing:
+            continue
+        db.session.add(DiseaseInfo(**record))
+        added += 1
+    db.session.commit()
+    return added
+
+
+knowledge_base = KnowledgeBase()
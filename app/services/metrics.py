@@ -0,0 +1,552 @@
+import fcntl
+import glob
+import hmac
+import json
+import os
+import threading
+import time
+import uuid
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import db
+
+# Latency buckets (seconds) and size buckets (bytes)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# Existing stats() values re-exported: (metric prefix, module, attribute, gauge keys).
+# Values are cumulative counts since the process started (exported as counters)
+# unless their key is listed as a point-in-time gauge. Only keys described in
+# STATS_HELP are exported.
+STATS_SOURCES = (
+    ("admission", "app.services.admission_control", "admission_control",
+     ("in_flight", "queued", "max_concurrent", "local_processes")),
+    ("gemini_gateway", "app.services.gemini_gateway", "gemini_gateway", ("in_flight",)),
+    ("diagnosis_cache", "app.services.diagnosis_cache", "diagnosis_cache",
+     ("size", "hit_ratio", "maxsize", "ttl_seconds")),
+    ("history_log", "app.services.history_log", "history_log", ("pending",)),
+)
+
+STATS_HELP = {
+    ("admission", "admitted"): "AI requests that passed admission control.",
+    ("admission", "throttled_user"): "AI requests rejected with 429 because the caller's token bucket was empty.",
+    ("admission", "throttled_global"): "AI requests rejected with 503 because the global token bucket was empty.",
+    ("admission", "shed_queue_timeout"): "AI requests shed because they would have queued past ADMISSION_QUEUE_TARGET.",
+    ("admission", "shed_queue_full"): "AI requests shed because the admission queue was full.",
+    ("admission", "paced_background"): "Times a batch worker waited for a global token before a model call.",
+    ("admission", "throttled_hedges"): "Hedged model calls skipped because the global token bucket was empty.",
+    ("admission", "backend_errors"): "Failed calls to the shared rate limit backend (local buckets used instead).",
+    ("admission", "in_flight"): "AI requests currently being served by this process.",
+    ("admission", "queued"): "AI requests currently waiting for a concurrency slot.",
+    ("admission", "max_concurrent"): "Configured limit of concurrent AI requests per process.",
+    ("admission", "local_processes"): "Workers the global limit is split across with local buckets.",
+    ("gemini_gateway", "requests"): "Generate and stream calls made to the Gemini gateway.",
+    ("gemini_gateway", "upstream_calls"): "Attempts sent to Gemini, retries included.",
+    ("gemini_gateway", "coalesced"): "Calls answered by an identical call already in flight.",
+    ("gemini_gateway", "retries"): "Attempts retried after a retryable upstream error.",
+    ("gemini_gateway", "timeouts"): "Calls that ran past their deadline.",
+    ("gemini_gateway", "failures"): "Calls that failed after their last attempt or were rejected upstream.",
+    ("gemini_gateway", "short_circuited"): "Calls refused without an upstream attempt because the circuit breaker was open.",
+    ("gemini_gateway", "abandoned"): "Calls stopped by their caller before an answer (e.g. a hedge that lost).",
+    ("gemini_gateway", "in_flight"): "Distinct blocking calls currently waiting on Gemini.",
+    ("diagnosis_cache", "memory_hits"): "Diagnoses served from this process's exact-match cache.",
+    ("diagnosis_cache", "near_duplicate_hits"): "Diagnoses served for a perceptually similar image.",
+    ("diagnosis_cache", "db_hits"): "Diagnoses served from an earlier result stored in the database.",
+    ("diagnosis_cache", "misses"): "Image lookups that had to go to the model.",
+    ("diagnosis_cache", "bypassed"): "Image diagnoses whose request asked to skip the cache.",
+    ("diagnosis_cache", "stores"): "Diagnoses added to the in-memory cache.",
+    ("diagnosis_cache", "size"): "Diagnoses currently held in the in-memory cache.",
+    ("diagnosis_cache", "hit_ratio"): "Share of lookups answered from the cache since the process started.",
+    ("diagnosis_cache", "maxsize"): "Configured capacity of the in-memory cache.",
+    ("diagnosis_cache", "ttl_seconds"): "Configured lifetime of a cached diagnosis.",
+    ("history_log", "logged"): "Chat and diagnosis history rows buffered for writing.",
+    ("history_log", "written"): "History rows written to the database.",
+    ("history_log", "flushes"): "Successful history buffer flushes.",
+    ("history_log", "failures"): "History flushes that failed and were retried.",
+    ("history_log", "dropped"): "History rows given up on (buffer full, rejected or retries exhausted).",
+    ("history_log", "pending"): "History rows waiting in the buffer.",
+}
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """One metric family. Series are keyed by their label values, in ``labelnames`` order."""
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labels}")
+        return tuple(str(value) for value in labels)
+
+    def snapshot(self):
+        with self._lock:
+            series = [[list(key), self._copy(value)] for key, value in self._series.items()]
+        return {"kind": self.kind, "help": self.documentation, "labels": list(self.labelnames), "series": series}
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def set(self, value, *labels):
+        """Mirror a count kept elsewhere (a service's ``stats()``); it must only grow."""
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+
+class Histogram(Metric):
+    """Fixed-bucket histogram; each series is ``[bucket_counts, sum, count]`` (counts not cumulative)."""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        key = self._key(labels)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @staticmethod
+    def _copy(value):
+        return [list(value[0]), value[1], value[2]]
+
+    def snapshot(self):
+        snapshot = super().snapshot()
+        snapshot["buckets"] = list(self.buckets)
+        return snapshot
+
+
+def merge_snapshots(snapshots):
+    """Sum snapshots from several processes, series by series."""
+    merged = {}
+    for snapshot in snapshots:
+        for name, family in snapshot.items():
+            target = merged.setdefault(name, {**family, "series": {}})
+            for labels, value in family["series"]:
+                key = tuple(labels)
+                current = target["series"].get(key)
+                if current is None:
+                    target["series"][key] = Histogram._copy(value) if family["kind"] == "histogram" else value
+                elif family["kind"] == "histogram":
+                    current[0] = [a + b for a, b in zip(current[0], value[0])]
+                    current[1] += value[1]
+                    current[2] += value[2]
+                else:
+                    target["series"][key] = current + value
+    for family in merged.values():
+        family["series"] = [[list(key), value] for key, value in family["series"].items()]
+    return merged
+
+
+def render(snapshot):
+    """Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for name in sorted(snapshot):
+        family = snapshot[name]
+        labelnames = family["labels"]
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['kind']}")
+        for labels, value in sorted(family["series"], key=lambda series: series[0]):
+            if family["kind"] != "histogram":
+                lines.append(f"{name}{_format_labels(labelnames, labels)} {_format_value(value)}")
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for bound, bucket_count in zip(list(family["buckets"]) + [float("inf")], counts):
+                cumulative += bucket_count
+                le = (("le", _format_value(bound)),)
+                lines.append(f"{name}_bucket{_format_labels(labelnames, labels, le)} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(labelnames, labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+class Metrics:
+    """
+    Prometheus metrics for the app, served at ``/api/metrics``.
+
+    Instrumentation only touches in-memory counters under a lock; nothing is
+    computed until a scrape. Request hooks record per-route latency and the
+    number and time of SQL queries each request ran; SQLAlchemy engine events
+    time every query and pool checkout. Services record their own metrics
+    (Gemini calls, image preprocessing) through the module-level families below.
+
+    Gunicorn workers each hold their own counters. With ``METRICS_DIR`` set,
+    every worker writes a snapshot there every ``METRICS_FLUSH_INTERVAL``
+    seconds and a scrape sums them all, so any worker can answer for the
+    whole server. Exited workers' counters and histograms, including the
+    services' cumulative ``stats()`` counts, are folded into one retired
+    snapshot so they never go backwards.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = True
+        self.directory = None
+        self.flush_interval = 5.0
+        self.token = None
+        self._families = {}
+        self._lock = threading.Lock()
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    # --- Families ---
+    def _register(self, metric):
+        with self._lock:
+            return self._families.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    # --- Setup ---
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get("METRICS_ENABLED", self.enabled)
+        self.directory = app.config.get("METRICS_DIR") or None
+        self.flush_interval = app.config.get("METRICS_FLUSH_INTERVAL", self.flush_interval)
+        # With the profiler on, metrics and profiles are never public: PROFILE_TOKEN stands in
+        self.token = app.config.get("METRICS_TOKEN") or app.config.get("PROFILE_TOKEN") or None
+        app.extensions["metrics"] = self
+        if not self.enabled:
+            return
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+        _listen_for_queries()
+        with app.app_context():
+            for engine in db.engines.values():
+                _time_checkouts(engine)
+
+    def authorized(self, headers):
+        """
+        ``Authorization: Bearer <METRICS_TOKEN>`` (or ``<PROFILE_TOKEN>`` when
+        only that is set); without either token the endpoints are public.
+        """
+        if not self.token:
+            return True
+        supplied = headers.get("Authorization", "").removeprefix("Bearer ").strip()
+        return hmac.compare_digest(supplied, self.token)
+
+    # --- Request hooks ---
+    def _before_request(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_query_seconds = 0.0
+        HTTP_IN_FLIGHT.inc()
+        self.ensure_writer()
+
+    def _after_request(self, response):
+        g.metrics_status = response.status_code
+        return response
+
+    def _teardown_request(self, exc=None):
+        # Runs after a streamed body has been sent, so streams are timed end to end
+        started = g.pop("metrics_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        HTTP_IN_FLIGHT.dec()
+        route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        status = g.pop("metrics_status", 500 if exc is not None else 200)
+        HTTP_REQUEST_SECONDS.observe(elapsed, request.method, route, status)
+        HTTP_REQUEST_DB_QUERIES.observe(g.pop("metrics_queries", 0), route)
+        HTTP_REQUEST_DB_SECONDS.observe(g.pop("metrics_query_seconds", 0.0), route)
+
+    # --- Snapshots ---
+    def snapshot(self):
+        self._collect()
+        with self._lock:
+            families = list(self._families.values())
+        return {family.name: family.snapshot() for family in families}
+
+    def _collect(self):
+        """Refresh gauges that are read rather than recorded: pool state and service stats."""
+        import importlib
+
+        if self.app is not None:
+            with self.app.app_context():
+                for name, engine in db.engines.items():
+                    pool = engine.pool
+                    bind = name or "default"
+                    for state in ("size", "checkedout", "overflow"):
+                        reader = getattr(pool, state, None)
+                        if callable(reader):
+                            DB_POOL_CONNECTIONS.set(reader(), bind, state)
+
+        for prefix, module_name, attribute, gauges in STATS_SOURCES:
+            try:
+                stats = getattr(importlib.import_module(module_name), attribute).stats()
+            except Exception:
+                continue
+            for key, value in stats.items():
+                description = STATS_HELP.get((prefix, key))
+                if description is None or not isinstance(value, (int, float)) or isinstance(value, bool):
+                    continue
+                if key in gauges:
+                    self.gauge(f"agroai_{prefix}_{key}", description).set(value)
+                else:
+                    # Counters are kept when a worker retires, so the sum never goes backwards
+                    self.counter(f"agroai_{prefix}_{key}_total", description).set(value)
+
+    def exposition(self):
+        """Text for a scrape: this process, or every worker when METRICS_DIR is shared."""
+        own = self.snapshot()
+        if not self.directory:
+            return render(own)
+        self.write_snapshot(own)
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, "metrics-*.json")):
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # A worker is mid-write or just retired
+        return render(merge_snapshots(snapshots))
+
+    # --- Multi-process ---
+    def ensure_writer(self):
+        if not self.directory or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Threads don't survive a fork, so each worker process starts its own
+            os.makedirs(self.directory, exist_ok=True)
+            threading.Thread(target=self._run, name="metrics-writer", daemon=True).start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.write_snapshot()
+            except Exception as e:
+                print(f"⚠️ Metrics snapshot failed: {e}")
+
+    def write_snapshot(self, snapshot=None):
+        snapshot = snapshot if snapshot is not None else self.snapshot()
+        path = os.path.join(self.directory, f"metrics-{os.getpid()}.json")
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp, path)
+
+    def retire(self):
+        """Fold this worker's counters into the retired snapshot (gunicorn worker_exit)."""
+        if not self.directory:
+            return
+        snapshot = {
+            name: family for name, family in self.snapshot().items() if family["kind"] != "gauge"
+        }
+        retired_path = os.path.join(self.directory, "metrics-retired.json")
+        with open(os.path.join(self.directory, "retired.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(retired_path) as f:
+                    retired = json.load(f)
+            except (OSError, ValueError):
+                retired = {}
+            merged = merge_snapshots([retired, snapshot])
+            tmp = f"{retired_path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(merged, f)
+            os.replace(tmp, retired_path)
+        try:
+            os.remove(os.path.join(self.directory, f"metrics-{os.getpid()}.json"))
+        except FileNotFoundError:
+            pass
+
+
+metrics = Metrics()
+
+# --- HTTP ---
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    "agroai_http_request_duration_seconds", "Request latency by route, including streamed bodies",
+    ("method", "route", "status"),
+)
+HTTP_IN_FLIGHT = metrics.gauge("agroai_http_requests_in_flight", "Requests currently being served")
+HTTP_REQUEST_DB_QUERIES = metrics.histogram(
+    "agroai_http_request_db_queries", "SQL queries run per request", ("route",), COUNT_BUCKETS,
+)
+HTTP_REQUEST_DB_SECONDS = metrics.histogram(
+    "agroai_http_request_db_seconds", "Time spent in SQL per request", ("route",),
+)
+
+# --- Database ---
+DB_QUERY_SECONDS = metrics.histogram(
+    "agroai_db_query_duration_seconds", "Duration of each SQL statement", (), QUERY_BUCKETS,
+)
+DB_POOL_CHECKOUT_SECONDS = metrics.histogram(
+    "agroai_db_pool_checkout_seconds", "Wait for a pooled connection (including connecting)", (), QUERY_BUCKETS,
+)
+DB_POOL_CONNECTIONS = metrics.gauge(
+    "agroai_db_pool_connections", "Pool size, checked-out and overflow connections", ("bind", "state"),
+)
+
+# --- Gemini ---
+GEMINI_CALL_SECONDS = metrics.histogram(
+    "agroai_gemini_call_duration_seconds", "Upstream Gemini call duration per attempt",
+    ("model", "mode", "outcome"),
+)
+GEMINI_FIRST_CHUNK_SECONDS = metrics.histogram(
+    "agroai_gemini_first_chunk_seconds", "Time to the first streamed chunk", ("model",),
+)
+GEMINI_REQUEST_BYTES = metrics.histogram(
+    "agroai_gemini_request_bytes", "Prompt payload size sent to Gemini", ("model",), SIZE_BUCKETS,
+)
+GEMINI_RESPONSE_BYTES = metrics.histogram(
+    "agroai_gemini_response_bytes", "Response text size received from Gemini", ("model",), SIZE_BUCKETS,
+)
+
+# --- Images ---
+IMAGE_PREPROCESS_SECONDS = metrics.histogram(
+    "agroai_image_preprocess_seconds", "Upload decode/normalize time", ("outcome",),
+)
+IMAGE_UPLOAD_BYTES = metrics.histogram(
+    "agroai_image_upload_bytes", "Uploaded image size before preprocessing", (), SIZE_BUCKETS,
+)
+
+
+# --- History ---
+HISTORY_DROPPED_ROWS = metrics.counter(
+    "agroai_history_dropped_rows_total", "Chat/diagnosis history rows given up on without being written",
+    ("table", "reason"),
+)
+
+
+# --- SQLAlchemy instrumentation ---
+_listening = False
+
+
+def _listen_for_queries():
+    global _listening
+    if _listening:
+        return
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(Engine, "handle_error", _query_failed)
+    _listening = True
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("metrics_query_started")
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    DB_QUERY_SECONDS.observe(elapsed)
+    if has_request_context() and "metrics_started" in g:
+        g.metrics_queries += 1
+        g.metrics_query_seconds += elapsed
+
+
+def _query_failed(context):
+    started = context.connection.info.get("metrics_query_started") if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def _time_checkouts(engine):
+    """Time ``engine.raw_connection()``, where SQLAlchemy waits on the pool (there's no event for it)."""
+    if getattr(engine, "_metrics_checkout_timed", False):
+        return
+    raw_connection = engine.raw_connection
+
+    def timed_raw_connection():
+        started = time.perf_counter()
+        try:
+            return raw_connection()
+        finally:
+            DB_POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - started)
+
+    engine.raw_connection = timed_raw_connection
+    engine._metrics_checkout_timed = True
+
+
+def payload_size(contents):
+    """Approximate bytes in a Gemini ``contents`` value (text encoded as UTF-8, inline data raw)."""
+    if isinstance(contents, bytes):
+        return len(contents)
+    if isinstance(contents, str):
+        return len(contents.encode())
+    if isinstance(contents, dict):
+        return sum(payload_size(value) for value in contents.values())
+    if isinstance(contents, (list, tuple)):
+        return sum(payload_size(item) for item in contents)
+    return 0
@@ -0,0 +1,339 @@
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from app.services.admission_control import admission_control
+from app.services.gemini_gateway import CallAbandoned, GatewayError, UpstreamTimeout, gemini_gateway
+
+SHORT_FACTUAL = "short_factual"
+LONG_DIAGNOSTIC = "long_diagnostic"
+IMAGE = "image"
+
+# Which tier serves each request class
+TIER_FOR_KIND = {SHORT_FACTUAL: "fast", LONG_DIAGNOSTIC: "strong", IMAGE: "image"}
+
+DIAGNOSTIC_WORDS = re.compile(
+    r"\b(why|diagnos\w*|symptoms?|cause[sd]?|wrong|dying|wilt\w*|yellow\w*|spots?|compare|"
+    r"difference|plan|schedule|explain|recommend\w*|step[- ]by[- ]step|how much|calculate)\b",
+    re.IGNORECASE,
+)
+
+
+def classify(query=None, has_image=False, context_tokens=0, long_query_tokens=60):
+    """
+    Request class used to pick a model tier: ``image`` for photos,
+    ``long_diagnostic`` for long or reasoning-heavy questions (or deep
+    conversations), otherwise ``short_factual``.
+    """
+    if has_image:
+        return IMAGE
+    from app.services.conversation_context import estimate_tokens
+
+    query = query or ""
+    if estimate_tokens(query) > long_query_tokens or context_tokens > long_query_tokens * 10:
+        return LONG_DIAGNOSTIC
+    if query.count("?") > 1 or DIAGNOSTIC_WORDS.search(query):
+        return LONG_DIAGNOSTIC
+    return SHORT_FACTUAL
+
+
+class ModelHealth:
+    """Rolling latency and error samples for one model over the last ``window`` seconds."""
+
+    def __init__(self, window=300.0, max_samples=500):
+        self.window = window
+        self._samples = deque(maxlen=max_samples)  # (timestamp, latency_or_None, ok)
+        self._lock = threading.Lock()
+
+    def record(self, latency, ok):
+        with self._lock:
+            self._samples.append((time.monotonic(), latency, ok))
+
+    def _recent(self):
+        cutoff = time.monotonic() - self.window
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+        return list(self._samples)
+
+    def snapshot(self):
+        with self._lock:
+            samples = self._recent()
+        latencies = sorted(latency for _, latency, _ in samples if latency is not None)
+        errors = sum(1 for _, _, ok in samples if not ok)
+        return {
+            "samples": len(samples),
+            "p50": latencies[len(latencies) // 2] if latencies else None,
+            "p95": latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] if latencies else None,
+            "error_rate": errors / len(samples) if samples else 0.0,
+        }
+
+
+class ModelRouter:
+    """
+    Picks a Gemini model per request instead of hard-coding one per route.
+
+    Requests are classified (``classify``) into a tier, and each tier has an
+    ordered list of candidate models. The first candidate whose rolling p95
+    latency and error rate are within the tier's limits (and whose circuit
+    breaker is closed) gets the traffic; a degraded model still receives a
+    small probe share so its recovery is noticed.
+
+    With ``ROUTER_HEDGE_ENABLED`` blocking calls are hedged: if the chosen
+    model hasn't answered by its own p95, the same request is sent to the
+    next candidate and the first answer wins. A hedge costs a global
+    admission token like any model call, so it is skipped when the bucket is
+    empty; once hedged, the primary makes no further retries, and the loser
+    is abandoned as soon as the winner answers.
+    """
+
+    def __init__(self, app=None):
+        self.tiers = {
+            "fast": ["gemini-2.0-flash-exp", "gemini-1.5-flash"],
+            "strong": ["gemini-1.5-pro", "gemini-2.0-flash-exp"],
+            "image": ["gemini-1.5-flash", "gemini-2.0-flash-exp"],
+        }
+        self.p95_limits = {"fast": 4.0, "strong": 12.0, "image": 8.0}
+        self.max_error_rate = 0.2
+        self.min_samples = 20
+        self.probe_rate = 0.05
+        self.long_query_tokens = 60
+        self.hedge_enabled = False
+        self.hedge_delay = 5.0
+        self.hedge_min_delay = 1.0
+        self.hedge_threads = 32
+        self.window = 300.0
+        self._health = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        self._slots = None
+        self._counters = {"routed": {}, "shifted": 0, "fallbacks": 0, "hedged": 0, "hedge_wins": 0,
+                          "hedges_throttled": 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        for tier in ("fast", "strong", "image"):
+            key = tier.upper()
+            models = app.config.get(f"ROUTER_{key}_MODELS")
+            if models:
+                self.tiers[tier] = [name.strip() for name in models.split(",") if name.strip()]
+            self.p95_limits[tier] = app.config.get(f"ROUTER_{key}_P95_LIMIT", self.p95_limits[tier])
+        self.max_error_rate = app.config.get("ROUTER_MAX_ERROR_RATE", self.max_error_rate)
+        self.min_samples = app.config.get("ROUTER_MIN_SAMPLES", self.min_samples)
+        self.probe_rate = app.config.get("ROUTER_PROBE_RATE", self.probe_rate)
+        self.long_query_tokens = app.config.get("ROUTER_LONG_QUERY_TOKENS", self.long_query_tokens)
+        self.hedge_enabled = app.config.get("ROUTER_HEDGE_ENABLED", self.hedge_enabled)
+        self.hedge_delay = app.config.get("ROUTER_HEDGE_DELAY", self.hedge_delay)
+        self.hedge_min_delay = app.config.get("ROUTER_HEDGE_MIN_DELAY", self.hedge_min_delay)
+        self.hedge_threads = app.config.get("ROUTER_HEDGE_THREADS", self.hedge_threads)
+        self.window = app.config.get("ROUTER_WINDOW", self.window)
+        app.extensions["model_router"] = self
+
+    # --- Health ---
+    def health(self, model_name):
+        with self._lock:
+            health = self._health.get(model_name)
+            if health is None:
+                health = self._health[model_name] = ModelHealth(self.window)
+            return health
+
+    def is_healthy(self, tier, model_name):
+        if gemini_gateway.breaker(model_name).state == "open":
+            return False
+        snapshot = self.health(model_name).snapshot()
+        if snapshot["samples"] < self.min_samples:
+            return True
+        if snapshot["error_rate"] > self.max_error_rate:
+            return False
+        return snapshot["p95"] is None or snapshot["p95"] <= self.p95_limits[tier]
+
+    # --- Selection ---
+    def candidates(self, kind):
+        """Tier models for ``kind``, best first: healthy ones in configured order, then the rest."""
+        tier = TIER_FOR_KIND[kind]
+        models = self.tiers[tier]
+        healthy = [name for name in models if self.is_healthy(tier, name)]
+        degraded = [name for name in models if name not in healthy]
+        if degraded:
+            # Fastest degraded model first, in case nothing is healthy
+            degraded.sort(key=lambda name: self.health(name).snapshot()["p95"] or 0.0)
+            if healthy and random.random() < self.probe_rate:
+                # Keep a trickle of traffic on degraded models so recovery shows up in the stats
+                return degraded[:1] + healthy + degraded[1:]
+        if healthy and healthy[0] != models[0]:
+            self._count("shifted")
+        return healthy + degraded
+
+    def pick(self, kind):
+        model_name = self.candidates(kind)[0]
+        self._count_route(kind)
+        return model_name
+
+    # --- Calls ---
+    def _call(self, model_name, contents, timeout, cancel=None):
+        started = time.monotonic()
+        try:
+            text = gemini_gateway.generate(model_name, contents, timeout=timeout, cancel=cancel)
+        except CallAbandoned:
+            raise
+        except GatewayError:
+            self.health(model_name).record(time.monotonic() - started, False)
+            raise
+        self.health(model_name).record(time.monotonic() - started, True)
+        return text
+
+    def generate(self, kind, contents, timeout=None):
+        """
+        Blocking generation for a request class. Returns ``(text, model_name)``.
+        Falls back to the next candidate if the chosen model fails, and hedges
+        slow calls when enabled.
+        """
+        timeout = timeout or gemini_gateway.timeout
+        deadline = time.monotonic() + timeout
+        candidates = self.candidates(kind)
+        self._count_route(kind)
+        primary = candidates[0]
+        secondary = candidates[1] if len(candidates) > 1 else None
+
+        if secondary is not None and self.hedge_enabled:
+            hedged = self._hedged(primary, secondary, contents, deadline)
+            if hedged is not None:
+                return hedged
+
+        try:
+            return self._call(primary, contents, timeout), primary
+        except GatewayError:
+            remaining = deadline - time.monotonic()
+            if secondary is None or remaining <= 0:
+                raise
+            self._count("fallbacks")
+            return self._call(secondary, contents, remaining), secondary
+
+    def _hedged(self, primary, secondary, contents, deadline):
+        """Race ``primary`` against a delayed ``secondary``; None if the hedge pool is saturated."""
+        pool, slots = self._pool()
+        if not slots.acquire(blocking=False):
+            return None
+        if not slots.acquire(blocking=False):
+            slots.release()
+            return None
+
+        # Set to stop a call from starting another attempt; its current one may still answer
+        cancels = {primary: threading.Event(), secondary: threading.Event()}
+
+        def run(model_name):
+            try:
+                return self._call(model_name, contents, max(deadline - time.monotonic(), 0.1), cancels[model_name])
+            finally:
+                slots.release()
+
+        first = pool.submit(run, primary)
+        try:
+            done, _ = wait([first], timeout=min(self.hedge_after(primary), max(deadline - time.monotonic(), 0)))
+            if first in done and first.exception() is None:
+                slots.release()  # the hedge slot was never used
+                return first.result(), primary
+
+            hedging = first not in done
+            if hedging and not admission_control.spend_global():
+                # No quota for a second call: keep waiting on the primary alone
+                slots.release()
+                self._count("hedges_throttled")
+                return first.result(timeout=max(deadline - time.monotonic(), 0)), primary
+
+            # Slow (or failed) primary: send the same request to the secondary now
+            self._count("hedged" if hedging else "fallbacks")
+            cancels[primary].set()
+            second = pool.submit(run, secondary)
+            futures = {first: primary, second: secondary}
+            error = None
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=max(deadline - time.monotonic(), 0),
+                                     return_when=FIRST_COMPLETED)
+                if not done:
+                    break
+                for future in done:
+                    if future.exception() is None:
+                        if future is second and hedging:
+                            self._count("hedge_wins")
+                        return future.result(), futures[future]
+                    if not isinstance(future.exception(), CallAbandoned):
+                        error = future.exception()
+            if error is not None and not pending:
+                raise error
+            raise UpstreamTimeout(f"{primary} and {secondary} did not answer in time")
+        except FutureTimeout:
+            raise UpstreamTimeout(f"{primary} did not answer in time") from None
+        finally:
+            # Whoever lost (or ran past the deadline) stops retrying
+            for cancel in cancels.values():
+                cancel.set()
+
+    def hedge_after(self, model_name):
+        """Seconds to wait before hedging: the model's own p95 once we have enough samples."""
+        snapshot = self.health(model_name).snapshot()
+        if snapshot["samples"] >= self.min_samples and snapshot["p95"] is not None:
+            return max(snapshot["p95"], self.hedge_min_delay)
+        return self.hedge_delay
+
+    def stream(self, model_name, contents, timeout=None):
+        """Gateway stream that feeds the model's error rate (streams are never hedged)."""
+        chunks = gemini_gateway.stream(model_name, contents, timeout=timeout)
+        try:
+            for text in chunks:
+                yield text
+        except GatewayError:
+            self.health(model_name).record(None, False)
+            raise
+        finally:
+            chunks.close()
+        self.health(model_name).record(None, True)
+
+    # --- Pool ---
+    def _pool(self):
+        # Executor threads don't survive a fork; make one per process
+        if self._executor is None or self._executor_pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._executor_pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.hedge_threads, thread_name_prefix="model-hedge"
+                    )
+                    self._slots = threading.BoundedSemaphore(self.hedge_threads)
+                    self._executor_pid = os.getpid()
+        return self._executor, self._slots
+
+    # --- Counters ---
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _count_route(self, kind):
+        with self._lock:
+            routed = self._counters["routed"]
+            routed[kind] = routed.get(kind, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            stats = {key: dict(value) if isinstance(value, dict) else value for key, value in self._counters.items()}
+            names = list(self._health)
+        stats["tiers"] = {tier: list(models) for tier, models in self.tiers.items()}
+        stats["models"] = {}
+        for name in names:
+            snapshot = self.health(name).snapshot()
+            stats["models"][name] = {
+                "samples": snapshot["samples"],
+                "p50_ms": round(snapshot["p50"] * 1000, 1) if snapshot["p50"] is not None else None,
+                "p95_ms": round(snapshot["p95"] * 1000, 1) if snapshot["p95"] is not None else None,
+                "error_rate": round(snapshot["error_rate"], 4),
+            }
+        return stats
+
+
+model_router = ModelRouter()
@@ -0,0 +1,176 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+
+class HasherBusy(Exception):
+    """Hashing couldn't run in time (queue full, slow pool or a dead pool process); the route should return 503."""
+    status_code = 503
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = max(1, int(retry_after))
+
+
+# --- Hashing primitives (top-level so they can run in pool processes) ---
+def hash_password(method, password):
+    """
+    Hash ``password`` with ``method``: any werkzeug method string
+    ("scrypt:32768:8:1", "pbkdf2:sha256:600000") or "bcrypt:<rounds>".
+    """
+    if method.startswith("bcrypt"):
+        import bcrypt
+
+        rounds = int(method.split(":")[1]) if ":" in method else 12
+        return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("ascii")
+
+    from werkzeug.security import generate_password_hash
+    return generate_password_hash(password, method=method)
+
+
+def _init_pool_process():
+    """
+    First thing each pool process runs: load the hashing backend only. The
+    pool process never builds the Flask app, so entry points must not call
+    create_app() when re-imported as ``__mp_main__`` (see run.py).
+    """
+    from werkzeug.security import generate_password_hash  # noqa: F401
+
+
+def verify_password(stored_hash, password):
+    if not stored_hash:
+        return False
+    if stored_hash.startswith("$2"):
+        import bcrypt
+
+        return bcrypt.checkpw(password.encode("utf-8"), stored_hash.encode("ascii"))
+
+    from werkzeug.security import check_password_hash
+    return check_password_hash(stored_hash, password)
+
+
+def hash_parameters(stored_hash):
+    """The algorithm/cost part of a stored hash, e.g. "scrypt:32768:8:1" or "$2b$12"."""
+    if stored_hash.startswith("$2"):
+        return stored_hash[:6]
+    return stored_hash.split("$", 1)[0]
+
+
+class PasswordHasher:
+    """
+    Password hashing with one configured algorithm and cost, run in a bounded
+    process pool so login spikes burn at most ``PASSWORD_HASH_WORKERS`` cores
+    per gunicorn worker instead of competing with request threads for the
+    worker's CPU. Stored
+    hashes made with other parameters are reported by ``needs_rehash`` so
+    login can upgrade them transparently.
+
+    ``PASSWORD_HASH_WORKERS=0`` hashes inline (useful for tests and tiny boxes).
+    When the queue stays full or a hash outlasts ``PASSWORD_HASH_TIMEOUT``,
+    ``HasherBusy`` is raised; if a pool process dies the pool is dropped and
+    rebuilt on the next call.
+    """
+
+    def __init__(self, app=None):
+        self.method = "scrypt:32768:8:1"
+        self.workers = 0
+        self.timeout = 10.0
+        self._pool = None
+        self._pool_pid = None
+        self._slots = None
+        self._parameters = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.method = app.config.get("PASSWORD_HASH_METHOD", self.method)
+        self.workers = app.config.get("PASSWORD_HASH_WORKERS", self.workers)
+        self.timeout = app.config.get("PASSWORD_HASH_TIMEOUT", self.timeout)
+        self._parameters = None
+        app.extensions["password_hasher"] = self
+
+    # --- Pool ---
+    def _executor(self):
+        if self.workers <= 0:
+            return None
+        # A pool inherited across a fork (gunicorn --preload) is unusable; make one per process
+        if self._pool is None or self._pool_pid != os.getpid():
+            with self._lock:
+                if self._pool is None or self._pool_pid != os.getpid():
+                    context = multiprocessing.get_context(
+                        "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                    )
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=context, initializer=_init_pool_process
+                    )
+                    self._pool_pid = os.getpid()
+                    # Cap queued work so a login storm applies backpressure instead of piling up
+                    self._slots = threading.BoundedSemaphore(self.workers * 4)
+        return self._pool
+
+    def _run(self, fn, *args):
+        pool = self._executor()
+        if pool is None:
+            return fn(*args)
+        # Keep our own reference: a broken pool is replaced along with its semaphore
+        slots = self._slots
+        if not slots.acquire(timeout=self.timeout):
+            raise HasherBusy("Password hashing queue is full", self.timeout)
+        try:
+            future = pool.submit(fn, *args)
+        except BaseException as e:
+            slots.release()
+            if isinstance(e, BrokenProcessPool):
+                self._discard(pool)
+                raise HasherBusy("Password hashing pool restarted")
+            if isinstance(e, RuntimeError) and self._pool is not pool:
+                # Another thread shut this pool down after finding it broken
+                raise HasherBusy("Password hashing pool restarted")
+            raise
+        # A hash that outlasts our timeout keeps its process busy, so the slot is
+        # only freed when it really ends (or is cancelled before starting)
+        future.add_done_callback(lambda _: slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise HasherBusy("Password hashing timed out", self.timeout)
+        except BrokenProcessPool:
+            # A pool process died (OOM kill, crash); every later submit would fail too
+            self._discard(pool)
+            raise HasherBusy("Password hashing pool restarted")
+
+    def _discard(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        if self._pool is not None and self._pool_pid == os.getpid():
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+
+    # --- Public API ---
+    def hash(self, password):
+        return self._run(hash_password, self.method, password)
+
+    def verify(self, stored_hash, password):
+        return self._run(verify_password, stored_hash, password)
+
+    def current_parameters(self):
+        if self._parameters is None:
+            # Let the backend expand defaults (e.g. "scrypt" -> "scrypt:32768:8:1") once
+            self._parameters = hash_parameters(hash_password(self.method, "parameter-probe"))
+        return self._parameters
+
+    def needs_rehash(self, stored_hash):
+        return bool(stored_hash) and hash_parameters(stored_hash) != self.current_parameters()
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,147 @@
+import hmac
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from flask import g, request
+
+PROFILE_ID = re.compile(r"^[0-9]+-[0-9a-f]{12}$")
+
+
+class StackSampler:
+    """
+    Samples one thread's Python stack every ``interval`` seconds from a helper
+    thread, counting identical stacks. Nothing is added to the sampled
+    thread's own code path, so the request runs at (almost) full speed.
+    """
+
+    def __init__(self, thread_id, interval=0.005, max_depth=128):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        """Collapsed-stack text (``frame;frame;frame count``), readable by flamegraph.pl and speedscope."""
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+
+class RequestProfiler:
+    """
+    On-demand sampling profiler for single requests.
+
+    A request carrying ``X-Profile: <PROFILE_TOKEN>`` is sampled for its whole
+    life (streamed bodies included). The response gets an ``X-Profile-Id``
+    header, and the collapsed stacks are written to ``PROFILE_DIR`` and
+    served from ``/api/metrics/profiles/<id>`` (behind ``METRICS_TOKEN``,
+    or this token when that is unset). Disabled unless a token is configured, and at most
+    ``PROFILE_MAX_CONCURRENT`` requests per process are sampled at once.
+    Samples OS threads, one per request under gthread and sync workers.
+    Installs its own request hooks, so it works with metrics disabled.
+    """
+
+    def __init__(self, app=None):
+        self.token = None
+        self.interval = 0.005
+        self.directory = None
+        self.max_concurrent = 2
+        self._active = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.token = app.config.get("PROFILE_TOKEN") or None
+        self.interval = app.config.get("PROFILE_INTERVAL", self.interval)
+        self.directory = app.config.get("PROFILE_DIR") or os.path.join(app.instance_path, "profiles")
+        self.max_concurrent = app.config.get("PROFILE_MAX_CONCURRENT", self.max_concurrent)
+        app.extensions["profiler"] = self
+        if not self.token:
+            return
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    # --- Request hooks ---
+    def _before_request(self):
+        self.maybe_start(request.headers)
+
+    def _after_request(self, response):
+        self.annotate(response)
+        return response
+
+    def _teardown_request(self, exc=None):
+        # Runs after a streamed body has been sent, so streams are sampled to the end
+        route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        self.maybe_stop(route)
+
+    def maybe_start(self, headers):
+        supplied = headers.get("X-Profile")
+        if not self.token or not supplied or not hmac.compare_digest(supplied, self.token):
+            return
+        with self._lock:
+            if self._active >= self.max_concurrent:
+                return
+            self._active += 1
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        sampler.start()
+        g.profile = (f"{int(time.time())}-{uuid.uuid4().hex[:12]}", sampler, time.perf_counter())
+
+    def annotate(self, response):
+        profile = g.get("profile")
+        if profile is not None:
+            response.headers["X-Profile-Id"] = profile[0]
+
+    def maybe_stop(self, route):
+        profile = g.pop("profile", None)
+        if profile is None:
+            return
+        profile_id, sampler, started = profile
+        elapsed = time.perf_counter() - started
+        try:
+            sampler.stop()
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.path(profile_id), "w") as f:
+                f.write(sampler.collapsed())
+            print(f"🔬 Profiled {route}: {elapsed * 1000:.0f} ms, {sampler.samples} samples → {profile_id}")
+        except Exception as e:
+            print(f"⚠️ Could not save profile {profile_id}: {e}")
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def path(self, profile_id):
+        if not PROFILE_ID.match(profile_id):
+            raise ValueError("bad profile id")
+        return os.path.join(self.directory, f"{profile_id}.collapsed")
+
+
+profiler = RequestProfiler()
@@ -1,5 +1,104 @@
+import threading
+
+from cachetools import TTLCache
+
+from app import db
 from app.models.user_model import User
 
+
 def get_all_users():
     users = User.query.all()
     return [{"username": u.username, "email": u.email} for u in users]
+
+
+class CachedUser:
+    """Read-only snapshot of a user row, safe to share across requests and threads."""
+    __slots__ = ("id", "username", "email")
+
+    def __init__(self, id, username, email):
+        self.id = id
+        self.username = username
+        self.email = email
+
+    @classmethod
+    def from_model(cls, user):
+        return cls(user.id, user.username, user.email)
+
+    def to_dict(self):
+        return {"id": self.id, "username": self.username, "email": self.email}
+
+
+class UserCache:
+    """
+    Flask-JWT-Extended user loader backed by a bounded in-process TTL cache.
+
+    Tokens carry the stable user id as their identity, so hot authenticated
+    routes resolve ``current_user`` without touching Postgres. Entries are
+    dropped on profile updates in this process; other processes pick up the
+    change within ``USER_CACHE_TTL`` seconds.
+    """
+
+    def __init__(self, app=None, jwt=None):
+        self._cache = TTLCache(maxsize=10000, ttl=300)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app, jwt)
+
+    def init_app(self, app, jwt):
+        with self._lock:
+            self._cache = TTLCache(
+                maxsize=app.config.get("USER_CACHE_SIZE", 10000),
+                ttl=app.config.get("USER_CACHE_TTL", 300),
+            )
+        jwt.user_lookup_loader(self.load_from_jwt)
+        jwt.user_lookup_error_loader(self.lookup_error)
+        app.extensions["user_cache"] = self
+
+    def get(self, user_id):
+        """Return a CachedUser for ``user_id`` or None if it doesn't exist."""
+        with self._lock:
+            cached = self._cache.get(user_id)
+            if cached is not None:
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        cached = CachedUser.from_model(user)
+        with self._lock:
+            self._cache[user_id] = cached
+        return cached
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._cache.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+    # --- Flask-JWT-Extended callbacks ---
+    def load_from_jwt(self, _jwt_header, jwt_data):
+        identity = str(jwt_data["sub"])
+        if identity.isdigit():
+            return self.get(int(identity))
+
+        # Tokens issued before ids were used carry the email; resolve once and cache by id
+        user = User.query.filter_by(email=identity).first()
+        if user is None:
+            return None
+        cached = CachedUser.from_model(user)
+        with self._lock:
+            self._cache[user.id] = cached
+        return cached
+
+    @staticmethod
+    def lookup_error(_jwt_header, _jwt_data):
+        return {"message": "User not found"}, 404
+
+
+user_cache = UserCache()
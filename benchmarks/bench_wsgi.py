@@ -0,0 +1,19 @@
+"""
+Gunicorn entry point for load benchmarks: the real app, with the offline
+Gemini stand-in from fake_genai installed first. Never deploy this.
+
+    gunicorn -c gunicorn.conf.py benchmarks.bench_wsgi:app
+"""
+import os
+import sys
+
+# Ensure Python can find the app package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_genai import install  # noqa: E402
+
+install()
+
+from app import create_app  # noqa: E402
+
+app = create_app()
@@ -0,0 +1,189 @@
+"""
+Offline stand-in for ``google.generativeai``, for benchmarks and local runs
+without network access or a GEMINI_API_KEY.
+
+``install()`` puts it in ``sys.modules`` so the gateway's lazy
+``import google.generativeai`` picks it up. Behaviour is set with
+environment variables, read when the first model is created:
+
+    FAKE_GEMINI_LATENCY_MS      mean time to a full answer (default 800)
+    FAKE_GEMINI_JITTER_MS       +/- uniform jitter on that (default 200)
+    FAKE_GEMINI_MODEL_LATENCY   per-model overrides, e.g. "gemini-1.5-pro=2500,gemini-1.5-flash=400"
+    FAKE_GEMINI_FIRST_CHUNK_MS  time to the first streamed chunk (default 250)
+    FAKE_GEMINI_CHUNKS          chunks per streamed answer (default 12)
+    FAKE_GEMINI_RESPONSE_WORDS  words per answer (default 120)
+    FAKE_GEMINI_ERROR_RATE      share of calls failing with 503 ServiceUnavailable (default 0)
+    FAKE_GEMINI_QUOTA_RATE      share of calls failing with 429 ResourceExhausted (default 0)
+    FAKE_GEMINI_TIMEOUT_RATE    share of calls hanging until their deadline, then DeadlineExceeded (default 0)
+    FAKE_GEMINI_SEED            seed for latency/error draws (default: unseeded)
+
+Errors are the real ``google.api_core`` exceptions, so the gateway's retry,
+breaker and router code paths run exactly as in production.
+"""
+import os
+import random
+import sys
+import threading
+import time
+import types
+
+WORDS = (
+    "maize leaves show early blight lesions remove infected debris rotate crops apply copper "
+    "fungicide water at the base keep spacing wide scout weekly check soil nitrogen levels"
+).split()
+
+
+def _env_float(name, default):
+    return float(os.getenv(name, default))
+
+
+class FakeSettings:
+    def __init__(self):
+        self.latency = _env_float("FAKE_GEMINI_LATENCY_MS", 800) / 1000
+        self.jitter = _env_float("FAKE_GEMINI_JITTER_MS", 200) / 1000
+        self.first_chunk = _env_float("FAKE_GEMINI_FIRST_CHUNK_MS", 250) / 1000
+        self.chunks = max(1, int(_env_float("FAKE_GEMINI_CHUNKS", 12)))
+        self.words = max(1, int(_env_float("FAKE_GEMINI_RESPONSE_WORDS", 120)))
+        self.error_rate = _env_float("FAKE_GEMINI_ERROR_RATE", 0)
+        self.quota_rate = _env_float("FAKE_GEMINI_QUOTA_RATE", 0)
+        self.timeout_rate = _env_float("FAKE_GEMINI_TIMEOUT_RATE", 0)
+        self.model_latency = {}
+        for item in os.getenv("FAKE_GEMINI_MODEL_LATENCY", "").split(","):
+            if "=" in item:
+                name, ms = item.split("=", 1)
+                self.model_latency[name.strip()] = float(ms) / 1000
+        seed = os.getenv("FAKE_GEMINI_SEED")
+        self.random = random.Random(int(seed) if seed else None)
+        self._lock = threading.Lock()
+
+    def draw(self, model_name):
+        """``(latency_seconds, failure)`` for one call; failure is None, "error", "quota" or "timeout"."""
+        with self._lock:
+            mean = self.model_latency.get(model_name, self.latency)
+            latency = max(0.0, mean + self.random.uniform(-self.jitter, self.jitter))
+            roll = self.random.random()
+        if roll < self.timeout_rate:
+            return latency, "timeout"
+        roll -= self.timeout_rate
+        if roll < self.error_rate:
+            return latency, "error"
+        roll -= self.error_rate
+        if roll < self.quota_rate:
+            return latency, "quota"
+        return latency, None
+
+
+_settings = None
+_settings_lock = threading.Lock()
+calls = {"generate": 0, "stream": 0, "failures": 0}
+
+
+def settings():
+    global _settings
+    if _settings is None:
+        with _settings_lock:
+            if _settings is None:
+                _settings = FakeSettings()
+    return _settings
+
+
+def _fail(kind, model_name, deadline):
+    from google.api_core import exceptions as gexc
+
+    calls["failures"] += 1
+    if kind == "timeout":
+        time.sleep(max(0.0, deadline - time.monotonic()))
+        raise gexc.DeadlineExceeded(f"fake {model_name} deadline exceeded")
+    if kind == "quota":
+        raise gexc.ResourceExhausted(f"fake {model_name} quota exhausted")
+    raise gexc.ServiceUnavailable(f"fake {model_name} unavailable")
+
+
+def _answer(model_name, words):
+    text = " ".join(WORDS[i % len(WORDS)] for i in range(words))
+    return f"[{model_name}] {text}"
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeStream:
+    """Iterable of chunks with a cancellable ``_iterator``, like the SDK's streaming response."""
+
+    def __init__(self, model_name, text, first_chunk, rest, chunks, failure, deadline):
+        self._iterator = self
+        self._cancelled = False
+        self.model_name = model_name
+        words = text.split(" ")
+        size = max(1, len(words) // chunks)
+        self.parts = [" ".join(words[i:i + size]) + " " for i in range(0, len(words), size)]
+        self.first_chunk = first_chunk
+        self.gap = rest / max(1, len(self.parts) - 1)
+        self.failure = failure
+        self.deadline = deadline
+
+    def cancel(self):
+        self._cancelled = True
+
+    def __iter__(self):
+        time.sleep(self.first_chunk)
+        for index, part in enumerate(self.parts):
+            if self._cancelled:
+                return
+            if self.failure and index == len(self.parts) // 2:
+                _fail(self.failure, self.model_name, self.deadline)
+            if index:
+                time.sleep(self.gap)
+            yield FakeResponse(part)
+
+
+class GenerativeModel:
+    def __init__(self, model_name, **kwargs):
+        self.model_name = model_name
+
+    def generate_content(self, contents, stream=False, request_options=None, **kwargs):
+        config = settings()
+        timeout = (request_options or {}).get("timeout") or 60
+        deadline = time.monotonic() + timeout
+        latency, failure = config.draw(self.model_name)
+        text = _answer(self.model_name, config.words)
+
+        if stream:
+            calls["stream"] += 1
+            first_chunk = min(config.first_chunk, latency)
+            return FakeStream(self.model_name, text, first_chunk, latency - first_chunk,
+                              config.chunks, failure, deadline)
+
+        calls["generate"] += 1
+        if failure == "timeout":
+            _fail(failure, self.model_name, deadline)
+        if latency >= timeout:
+            time.sleep(timeout)
+            _fail("timeout", self.model_name, deadline)
+        time.sleep(latency)
+        if failure:
+            _fail(failure, self.model_name, deadline)
+        return FakeResponse(text)
+
+
+def configure(api_key=None, transport=None, **kwargs):
+    """Accepts the real SDK's arguments; there is nothing to configure."""
+
+
+def install():
+    """Make ``import google.generativeai`` return this module."""
+    module = types.ModuleType("google.generativeai")
+    module.GenerativeModel = GenerativeModel
+    module.configure = configure
+    module.__doc__ = __doc__
+    sys.modules["google.generativeai"] = module
+    try:
+        import google
+
+        google.generativeai = module
+    except ImportError:
+        pass
+    os.environ.setdefault("GEMINI_API_KEY", "fake-gemini-key")
+    return module
@@ -0,0 +1,114 @@
+"""
+Seeded database for benchmarks: users with a known password and uploaded
+images (stored through the image store, so image endpoints serve real files).
+
+    python benchmarks/fixtures.py --database-url sqlite:////tmp/agroai_bench.db --users 200
+    python benchmarks/fixtures.py --database-url postgresql://... --users 1000 --images-per-user 3
+
+Seeding is idempotent: users that already exist are left alone. All rows
+use one password hash computed once, so seeding is fast whatever
+PASSWORD_HASH_METHOD costs (logins still pay the full verify cost).
+"""
+import argparse
+import io
+import os
+import random
+import sys
+
+# Ensure Python can find the app package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BENCH_PASSWORD = "bench-password-123"
+EMAIL_TEMPLATE = "bench{:05d}@agroai.test"
+
+
+def credentials(count):
+    """``(email, password)`` for the first ``count`` seeded users."""
+    return [(EMAIL_TEMPLATE.format(i), BENCH_PASSWORD) for i in range(count)]
+
+
+def sample_jpeg(seed, size=(640, 480)):
+    """Distinct, leaf-coloured JPEG bytes for ``seed`` (different seeds never hash alike)."""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    img = Image.new("RGB", size, (rng.randint(20, 80), rng.randint(110, 200), rng.randint(20, 80)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        r = rng.randint(4, 30)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=(rng.randint(90, 200), rng.randint(60, 140), 20))
+    buffer = io.BytesIO()
+    img.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def seed(app, users=200, images_per_user=2, distinct_images=20):
+    """Create tables and seed users/images. Returns the number of users created."""
+    from sqlalchemy import insert, select
+
+    from app import db
+    from app.models.uploaded_image_model import UploadedImage
+    from app.models.user_model import User
+    from app.services.image_store import image_store, iter_chunks
+    from app.services.password_service import hash_password
+
+    with app.app_context():
+        db.create_all()
+
+        emails = [email for email, _ in credentials(users)]
+        existing = set(db.session.scalars(select(User.email).where(User.email.in_(emails))))
+        password_hash = hash_password(app.config["PASSWORD_HASH_METHOD"], BENCH_PASSWORD)
+        rows = [
+            {"username": email.split("@")[0], "email": email, "password_hash": password_hash}
+            for email in emails if email not in existing
+        ]
+        if rows:
+            db.session.execute(insert(User), rows)
+            db.session.commit()
+
+        if not rows or not images_per_user or not image_store.enabled:
+            return len(rows)
+
+        stored = []
+        for i in range(distinct_images):
+            digest, size, _ = image_store.backend.put(iter_chunks(sample_jpeg(i)))
+            stored.append((digest, size))
+
+        new_emails = [row["email"] for row in rows]
+        user_ids = db.session.scalars(select(User.id).where(User.email.in_(new_emails))).all()
+        images = []
+        for n, user_id in enumerate(user_ids):
+            for k in range(images_per_user):
+                digest, size = stored[(n * images_per_user + k) % len(stored)]
+                images.append({
+                    "filename": f"leaf_{k}.jpg",
+                    "filepath": image_store.backend.locator(digest),
+                    "content_hash": digest,
+                    "size_bytes": size,
+                    "mime_type": "image/jpeg",
+                    "user_id": user_id,
+                })
+        db.session.execute(insert(UploadedImage), images)
+        db.session.commit()
+        return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"), help="Database to seed")
+    parser.add_argument("--users", type=int, default=200, help="Users to create")
+    parser.add_argument("--images-per-user", type=int, default=2, help="Uploaded images per user")
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("--database-url or DATABASE_URL is required")
+
+    os.environ["DATABASE_URL"] = args.database_url
+    from app import create_app
+
+    created = seed(create_app(), users=args.users, images_per_user=args.images_per_user)
+    print(f"🌱 Seeded {created} users ({args.users} requested, password {BENCH_PASSWORD!r}).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Password hashing micro-benchmark for sizing instances.
+
+Reports hashes/sec on one core and through a process pool, so you can work
+out how many logins per second a box sustains for a PASSWORD_HASH_METHOD:
+
+    python benchmarks/password_hash_bench.py
+    python benchmarks/password_hash_bench.py --method bcrypt:12 --method scrypt:16384:8:1 --workers 4
+    python benchmarks/password_hash_bench.py --json bench_output.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Ensure Python can find the app package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.password_service import hash_password, verify_password  # noqa: E402
+
+DEFAULT_METHODS = ["scrypt:32768:8:1", "pbkdf2:sha256:600000", "bcrypt:12"]
+
+
+def _rate(count, elapsed):
+    return round(count / elapsed, 2) if elapsed else float("inf")
+
+
+def bench_method(method, iterations, workers):
+    password = "correct horse battery staple"
+
+    # Warm-up (imports, first allocation)
+    stored = hash_password(method, password)
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        hash_password(method, password)
+    single = _rate(iterations, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        verify_password(stored, password)
+    verify_single = _rate(iterations, time.perf_counter() - started)
+
+    total = iterations * workers
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(hash_password, [method] * workers, [password] * workers))  # warm workers
+        started = time.perf_counter()
+        list(pool.map(hash_password, [method] * total, [password] * total))
+        pooled = _rate(total, time.perf_counter() - started)
+
+    return {
+        "method": method,
+        "iterations": iterations,
+        "hashes_per_sec_single_core": single,
+        "verifies_per_sec_single_core": verify_single,
+        "ms_per_hash": round(1000 / single, 2) if single else None,
+        "pool_workers": workers,
+        "hashes_per_sec_pool": pooled,
+        "hashes_per_sec_per_core": round(pooled / workers, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--method", action="append", help="Hash method to test (repeatable)")
+    parser.add_argument("--iterations", type=int, default=20, help="Hashes per core per method")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Pool size for the parallel run")
+    parser.add_argument("--json", help="Also write results to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'method':<24} {'ms/hash':>9} {'hash/s 1 core':>14} {'verify/s':>9} {'hash/s/core (pool)':>19}")
+    for method in args.method or DEFAULT_METHODS:
+        result = bench_method(method, args.iterations, args.workers)
+        results.append(result)
+        print(f"{method:<24} {result['ms_per_hash']:>9} {result['hashes_per_sec_single_core']:>14} "
+              f"{result['verifies_per_sec_single_core']:>9} {result['hashes_per_sec_per_core']:>19}")
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump({"cpu_count": os.cpu_count(), "results": results}, fh, indent=2)
+        print(f"📄 Wrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Cold-start benchmark: how long a fresh worker takes to import the app and
+build it with create_app(), and which imports dominate.
+
+Each run is a separate interpreter, so nothing is warm:
+
+    python benchmarks/startup_bench.py
+    python benchmarks/startup_bench.py --runs 10 --top 15
+    python benchmarks/startup_bench.py --json bench_output.json
+
+Set DATABASE_URL as in production; create_app() must not need the database
+to be reachable (the schema is created by `python create_tables.py`).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter; prints import and create_app() times in ms
+PROBE = """
+import time
+started = time.perf_counter()
+import app as package
+imported = time.perf_counter()
+application = package.create_app()
+built = time.perf_counter()
+print((imported - started) * 1000, (built - imported) * 1000)
+"""
+
+
+def _env():
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", "sqlite:///:memory:")
+    env.setdefault("JWT_SECRET_KEY", "startup-bench")
+    return env
+
+
+def time_startup(runs):
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", PROBE], cwd=ROOT, env=_env(),
+            capture_output=True, text=True, check=True,
+        )
+        import_ms, create_ms = map(float, out.stdout.strip().splitlines()[-1].split())
+        samples.append((import_ms, create_ms))
+    return samples
+
+
+def import_profile(top):
+    """Heaviest modules by cumulative import time, from `python -X importtime`."""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app; app.create_app()"],
+        cwd=ROOT, env=_env(), capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # Nested imports are indented two spaces per level; the app's direct imports are depth 1
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth > 1:
+            continue
+        rows.append({
+            "module": name.strip(),
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000,
+            "depth": depth,
+        })
+    rows.sort(key=lambda row: row["cumulative_ms"], reverse=True)
+    return rows[:top]
+
+
+def _summary(values):
+    return {
+        "min_ms": round(min(values), 1),
+        "median_ms": round(statistics.median(values), 1),
+        "max_ms": round(max(values), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to time")
+    parser.add_argument("--top", type=int, default=10, help="Heaviest imports to list")
+    parser.add_argument("--json", help="Also write results to this file")
+    args = parser.parse_args()
+
+    samples = time_startup(args.runs)
+    results = {
+        "runs": args.runs,
+        "import": _summary([s[0] for s in samples]),
+        "create_app": _summary([s[1] for s in samples]),
+        "total": _summary([s[0] + s[1] for s in samples]),
+        "heaviest_imports": import_profile(args.top),
+    }
+
+    print(f"{'phase':<12} {'min ms':>8} {'median ms':>10} {'max ms':>8}")
+    for phase in ("import", "create_app", "total"):
+        row = results[phase]
+        print(f"{phase:<12} {row['min_ms']:>8} {row['median_ms']:>10} {row['max_ms']:>8}")
+    print(f"\n{'module':<40} {'cumulative ms':>14}")
+    for row in results["heaviest_imports"]:
+        print(f"{'  ' * row['depth'] + row['module']:<40} {row['cumulative_ms']:>14}")
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+        print(f"📄 Wrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,41 @@
+from sqlalchemy import inspect, text
+
 from app import create_app, db
 from app.models.user_model import User
 from app.models.uploaded_image_model import UploadedImage
 from app.models.ai_diagnosis_model import AIDiagnosis
 from app.models.chat_log_model import ChatLog
+from app.models.conversation_model import Conversation
+from app.models.diagnosis_job_model import DiagnosisJob, DiagnosisJobItem
 from app.models.disease_info_model import DiseaseInfo
+from app.models.rate_limit_model import RateLimitBucket
+from app.services.knowledge_base import seed_disease_info
 
 app = create_app()
 
 with app.app_context():
     db.create_all()
     print("✅ All tables created successfully!")
+
+    # create_all() skips existing tables, so add nullable columns and indexes introduced since
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            if not column.nullable:
+                print(f"⚠️ {table.name}.{column.name} is NOT NULL; add it manually.")
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            print(f"➕ Added column {table.name}.{column.name}")
+
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+    print("✅ All indexes exist.")
+
+    added = seed_disease_info()
+    print(f"🌱 Seeded {added} disease knowledge base entries.")
@@ -0,0 +1,102 @@
+# Gunicorn configuration for AgroAI.
+#
+# Almost all request time is spent waiting on Gemini over the network, so the
+# default sync worker (one request per process) wastes the box. The supported
+# mode is gthread: N processes x T threads, with the stock gRPC Gemini
+# transport, psycopg2 and SQLAlchemy's thread-local sessions. In-flight
+# requests = workers * threads.
+#
+# Async workers (gevent, eventlet) are not supported: the background thread
+# pools, the forkserver password-hash pool and the admission limiter's
+# threading.Condition have not been verified under monkey-patching.
+#
+# Every knob can be overridden with an environment variable:
+#   GUNICORN_WORKER_CLASS, GUNICORN_WORKERS, GUNICORN_THREADS,
+#   GUNICORN_TIMEOUT, GUNICORN_PRELOAD, GUNICORN_MAX_REQUESTS, PORT,
+#   DB_MAX_CONNECTIONS, ADMISSION_LOCAL_PROCESSES
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("GUNICORN_WORKERS", min(multiprocessing.cpu_count() + 1, 8)))
+
+# gthread: threads per worker process
+threads = int(os.getenv("GUNICORN_THREADS", 32))
+
+# Database connection budget. Each worker has its own SQLAlchemy pool, so the
+# deployment can open workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections,
+# and that must stay under Postgres' max_connections (100 by default) minus
+# what migrations, psql and other clients need. DB_MAX_CONNECTIONS is this
+# deployment's share; unless DB_POOL_SIZE / DB_MAX_OVERFLOW are set, each
+# worker gets an equal slice, and never more than its threads plus the
+# background threads could use. AI calls release their connection
+# before waiting on Gemini, so 32 threads get by on a handful of connections.
+db_max_connections = int(os.getenv("DB_MAX_CONNECTIONS", 90))
+db_per_worker = max(2, min(
+    db_max_connections // workers,
+    (threads if worker_class == "gthread" else 1) + 8,
+))
+os.environ.setdefault("DB_POOL_SIZE", str(max(1, db_per_worker // 2)))
+os.environ.setdefault("DB_MAX_OVERFLOW", str(max(0, db_per_worker - int(os.environ["DB_POOL_SIZE"]))))
+
+# With local admission buckets each worker enforces its share of the global limit
+os.environ.setdefault("ADMISSION_LOCAL_PROCESSES", str(workers))
+
+# Streaming and batch long-polls legitimately keep a request open for a while
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers periodically to keep memory flat
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 2000))
+max_requests_jitter = max_requests // 10
+
+preload_app = os.getenv("GUNICORN_PRELOAD", "0") == "1"
+
+accesslog = "-"
+errorlog = "-"
+
+
+def post_fork(server, worker):
+    if preload_app:
+        # Connections opened in the master must not be shared across forks. Use
+        # the app gunicorn loaded (run:app, benchmarks.bench_wsgi:app, ...)
+        # rather than importing an entry point, which would build a second app.
+        from app import db
+
+        app = server.app.wsgi()
+        if hasattr(app, "app_context"):
+            with app.app_context():
+                db.engine.dispose(close=False)
+
+
+def on_starting(server):
+    if worker_class not in ("gthread", "sync"):
+        server.log.warning("GUNICORN_WORKER_CLASS=%s is not supported; use gthread", worker_class)
+
+    db_connections = workers * (int(os.environ["DB_POOL_SIZE"]) + int(os.environ["DB_MAX_OVERFLOW"]))
+    if db_connections > db_max_connections:
+        server.log.warning(
+            "%d workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW) allow %d database connections, "
+            "over DB_MAX_CONNECTIONS=%d", workers, db_connections, db_max_connections,
+        )
+
+    # Snapshots from a previous run would be summed into this one's metrics
+    metrics_dir = os.getenv("METRICS_DIR")
+    if metrics_dir and os.path.isdir(metrics_dir):
+        for name in os.listdir(metrics_dir):
+            if name.startswith("metrics-"):
+                os.remove(os.path.join(metrics_dir, name))
+
+
+def worker_exit(server, worker):
+    # Write chat/diagnosis history still buffered in this worker
+    from app.services.history_log import history_log
+    history_log.drain()
+
+    # Keep this worker's counters in the shared metrics after it's gone
+    from app.services.metrics import metrics
+    metrics.retire()
@@ -6,8 +6,10 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from app import create_app, db
 
-# 👇 This must be outside so Gunicorn can detect it
-app = create_app()
+# 👇 This must be outside so Gunicorn can detect it. Password-hashing pool
+# processes re-import this file as __mp_main__ and must not build the app.
+if __name__ != "__mp_main__":
+    app = create_app()
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))  # Railway provides PORT dynamically
@@ -0,0 +1,128 @@
+import pytest
+from google.api_core.exceptions import InvalidArgument, ServiceUnavailable
+
+from app.services.gemini_gateway import CircuitBreaker, CircuitOpenError, GatewayError, GeminiGateway
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+    def __iter__(self):
+        yield self
+
+
+class FakeModel:
+    """Raises the queued errors in turn, then answers."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def generate_content(self, contents, stream=False, request_options=None):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return FakeResponse("ok")
+
+
+@pytest.fixture
+def gateway():
+    gateway = GeminiGateway()
+    gateway.max_retries = 2
+    gateway.retry_base_delay = 0
+    gateway.breaker_threshold = 5
+    gateway.fake = FakeModel()
+    gateway.model = lambda model_name: gateway.fake
+    return gateway
+
+
+def test_breaker_opens_after_threshold_failures():
+    breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    assert breaker.allow() == 0
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.allow() > 0
+
+
+def test_half_open_lets_one_probe_through():
+    breaker = CircuitBreaker(threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow() == 0
+    assert breaker.state == "half_open"
+    assert breaker.allow() > 0  # The probe is still out
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow() == 0
+
+
+def test_failed_probe_reopens():
+    breaker = CircuitBreaker(threshold=3, reset_timeout=0)
+    for _ in range(3):
+        breaker.record_failure()
+    assert breaker.allow() == 0
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def test_released_probe_frees_the_slot():
+    breaker = CircuitBreaker(threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow() == 0
+    breaker.release()
+    assert breaker.allow() == 0
+
+
+def test_retried_success_is_not_a_failure(gateway):
+    gateway.fake = FakeModel(ServiceUnavailable("busy"), ServiceUnavailable("busy"))
+    assert gateway.generate("m", "hello") == "ok"
+    assert gateway.fake.calls == 3
+    assert gateway.breaker("m").failures == 0
+
+
+# Each failed call counts once, however many attempts it made
+def test_failed_call_counts_once(gateway):
+    for i in range(2):
+        gateway.fake = FakeModel(*[ServiceUnavailable("down")] * 3)
+        with pytest.raises(GatewayError):
+            gateway.generate("m", f"call {i}")
+        assert gateway.fake.calls == 3
+    breaker = gateway.breaker("m")
+    assert breaker.failures == 2
+    assert breaker.state == "closed"
+
+
+def test_breaker_opens_after_threshold_calls(gateway):
+    for i in range(gateway.breaker_threshold):
+        gateway.fake = FakeModel(*[ServiceUnavailable("down")] * 3)
+        with pytest.raises(GatewayError):
+            gateway.generate("m", f"call {i}")
+    gateway.fake = FakeModel()
+    with pytest.raises(CircuitOpenError):
+        gateway.generate("m", "one more")
+    assert gateway.fake.calls == 0
+
+
+def test_rejected_request_does_not_count(gateway):
+    gateway.fake = FakeModel(InvalidArgument("bad image"))
+    with pytest.raises(GatewayError):
+        gateway.generate("m", "hello")
+    assert gateway.fake.calls == 1
+    assert gateway.breaker("m").failures == 0
+
+
+def test_stream_counts_only_upstream_errors(gateway):
+    gateway.fake = FakeModel(InvalidArgument("bad image"))
+    with pytest.raises(GatewayError):
+        list(gateway.stream("m", "hello"))
+    assert gateway.breaker("m").failures == 0
+
+    gateway.fake = FakeModel(ServiceUnavailable("down"))
+    with pytest.raises(GatewayError):
+        list(gateway.stream("m", "hello"))
+    assert gateway.breaker("m").failures == 1
+
+    gateway.fake = FakeModel()
+    assert list(gateway.stream("m", "hello")) == ["ok"]
+    assert gateway.breaker("m").failures == 0
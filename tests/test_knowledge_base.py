@@ -0,0 +1,54 @@
+import pytest
+
+from app.services.knowledge_base import KnowledgeBase, is_open_question, load_seed_records
+
+
+@pytest.fixture(scope="module")
+def kb():
+    kb = KnowledgeBase()
+    kb._build(load_seed_records())
+    kb._loaded = True
+    return kb
+
+
+# Open-ended questions that name a disease must still go to the model
+@pytest.mark.parametrize("query", [
+    "Can I eat tomatoes from plants with late blight?",
+    "my cows ate cassava with mosaic disease, are they safe?",
+    "My tomato has late blight, I already sprayed mancozeb twice and it keeps spreading, what else can I do?",
+    "Is northern leaf blight caused by a fungus or bacteria?",
+    "my cows ate cassava with mosaic disease",
+    "northern leaf blight fungus or bacteria",
+    "What is late blight and should I burn the plants?",
+])
+def test_open_questions_fall_back_to_model(kb, query):
+    assert kb.answer(query) is None
+
+
+@pytest.mark.parametrize("query, crop, disease", [
+    ("maize leaf blight treatment", "Maize", "Northern Leaf Blight"),
+    ("What is maize lethal necrosis?", "Maize", "Maize Lethal Necrosis"),
+    ("How to treat tomato late blight?", "Tomato", "Late Blight"),
+    ("how do I control fall armyworm in maize", "Maize", "Fall Armyworm"),
+    ("What are the symptoms of bean rust?", "Beans", "Bean Rust"),
+    ("gray leaf spot on my corn", "Maize", "Gray Leaf Spot"),
+])
+def test_clear_lookups_answered_locally(kb, query, crop, disease):
+    text, entry, _ = kb.answer(query)
+    assert (entry.crop, entry.disease) == (crop, disease)
+
+
+def test_uncovered_words_lower_the_score(kb):
+    _, [(plain, _)] = kb.search("cassava mosaic", limit=1)
+    _, [(noisy, _)] = kb.search("cows ate cassava mosaic", limit=1)
+    assert noisy < plain
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("what is cassava mosaic disease?", False),
+    ("how to treat tomato late blight", False),
+    ("late blight, is it serious?", True),
+    ("why do my maize leaves have blight", True),
+])
+def test_is_open_question(query, expected):
+    assert is_open_question(query) is expected